@@ -1,22 +1,61 @@
+import asyncio
+import contextvars
+import copy
+import inspect
 import json
+import time
 import uuid
 from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 from enum import Enum
-from typing import Dict, Callable, Any
+from typing import Dict, Callable, Any, Union, Awaitable, Tuple, Optional, List, Set
 
-from utils.llm_api import infer_llm_generation
+from utils.llm_api import infer_llm_generation, ainfer_llm_generation, get_token_ledger
+from utils.llm_api import infer_llm_generation_stream, ainfer_llm_generation_stream
 
 from agent_builder.agent_factory import AgentCard, AgentContext
 from agent_builder.agent_language_builder import Prompt, AgentLanguage
 from agent_builder.context_builder import ContextBuilder, TurnContext
 from agent_builder.environment_builder import Environment
-from agent_builder.feedback_builder import FeedbackBuilder, AgentFeedback
+from agent_builder.feedback_builder import FeedbackBuilder, AgentFeedback, TaskStatus, failure_reason, \
+    rule_based_feedback
+from agent_builder.invocation_memo import InvocationMemo, is_memoized
 from agent_builder.memory_builder import Memory, PayloadMemory
-from agent_builder.plan_builder import PlanBuilder, Plan
+from agent_builder.memory_compaction import MemoryCompactor
+from agent_builder.plan_builder import PlanBuilder, Plan, PlanStep, resolve_plan_steps, step_reference
+from agent_builder.plan_builder import order_plan_steps, sequential_plan_steps, critical_path
 from agent_builder.resource_registry import ResourceRegistry, ToolContext
+from agent_builder.tool_speculation import ToolSpeculator, Speculation
 from agent_builder.tools_factory import ToolsFactory
 from utils.llm_api import infer_llm_tool_selection, infer_llm_task_routing, infer_llm_json
+from utils.llm_api import ainfer_llm_tool_selection, ainfer_llm_task_routing, ainfer_llm_json
+from utils.llm_api import infer_llm_fused_routing, ainfer_llm_fused_routing, is_llm_error
+from utils.llm_providers import LLMProvider
+from utils.model_policy import ModelPolicy, StepConfig, get_model_policy, use_model_policy
 from utils.prompt_store import PromptStore
+from utils.cancellation import CancellationToken, current_cancellation_token, use_cancellation_token
+from utils.llm_retry import BudgetExhaustedError, RunCancelledError
+from utils.run_budget import RunBudget, RunReport, current_run_budget, use_run_budget
+from utils.token_ledger import ledger_scope, current_ledger_scope, set_ledger_iteration
+
+PAYLOAD_REFERENCE_DESCRIPTION = "Reference to the memory store where result is being stored and can be retrieved using the `payload_id`. Refer to `payload_description` for more information about the result."
+
+BLUE = "\033[94m"
+GREEN = "\033[92m"
+RESET = "\033[0m"
+
+
+@dataclass
+class _PendingContext:
+    """
+    A turn context built ahead of the turn that uses it (a `Future`, or an `asyncio.Task` in async runs), with
+    the context prompt it was started with and, in sync runs, the token that abandons its request.
+    """
+    future: Any
+    prompt: str
+    token: Optional[CancellationToken] = None
 
 
 class AgentRole(Enum):
@@ -26,25 +65,103 @@ class AgentRole(Enum):
     HIERARCHICAL = "hierarchical"
 
 
-def prompt_adaptor(tools_factory: ToolsFactory, task="routing") -> Callable[[Prompt], Dict[str, Any]]:
+def prompt_adaptor(tools_factory: ToolsFactory, task="routing",
+                   provider: Union[str, LLMProvider] = None,
+                   model_policy: ModelPolicy = None) -> Callable[[Prompt], Dict[str, Any]]:
+    """
+    task: "routing", "selection", or "fused" (routing and tool selection in one request, see
+    `Agent(generate_response_fused=...)`).
+    Without an explicit `model_policy` the adaptor follows the policy of the agent run that calls it.
+    """
     def tool_selection_adaptor(prompt: Prompt) -> Dict:
-        return infer_llm_tool_selection(
+        return get_model_policy(model_policy).call("selection", lambda step: infer_llm_tool_selection(
             task=prompt.task,
             plan=prompt.plan,
             tools_factory=tools_factory,
-            turn_context=prompt.turn_context
-        )
+            turn_context=prompt.turn_context,
+            model=step.model,
+            max_tokens=step.max_tokens,
+            timeout=step.timeout,
+            provider=provider
+        ))
 
     def routing_adaptor(prompt: Prompt) -> Dict:
-        return infer_llm_task_routing(
+        return get_model_policy(model_policy).call("routing", lambda step: infer_llm_task_routing(
             task=prompt.task,
             plan=prompt.plan,
             tools=prompt.tools,
             agents=prompt.agents,
-            turn_context=prompt.turn_context
-        )
+            turn_context=prompt.turn_context,
+            model=step.model,
+            max_tokens=step.max_tokens,
+            timeout=step.timeout,
+            provider=provider
+        ))
+
+    def fused_routing_adaptor(prompt: Prompt) -> Dict:
+        return get_model_policy(model_policy).call("routing", lambda step: infer_llm_fused_routing(
+            task=prompt.task,
+            plan=prompt.plan,
+            tools=prompt.tools,
+            tools_factory=tools_factory,
+            agents=prompt.agents,
+            turn_context=prompt.turn_context,
+            feedback=prompt.feedback,
+            model=step.model,
+            max_tokens=step.max_tokens,
+            timeout=step.timeout,
+            provider=provider
+        ))
 
-    return routing_adaptor if task == "routing" else tool_selection_adaptor
+    adaptors = {"routing": routing_adaptor, "fused": fused_routing_adaptor}
+    return adaptors.get(task, tool_selection_adaptor)
+
+
+def async_prompt_adaptor(tools_factory: ToolsFactory, task="routing",
+                         provider: Union[str, LLMProvider] = None,
+                         model_policy: ModelPolicy = None) -> Callable[[Prompt], Awaitable[Dict[str, Any]]]:
+    async def tool_selection_adaptor(prompt: Prompt) -> Dict:
+        return await get_model_policy(model_policy).acall("selection", lambda step: ainfer_llm_tool_selection(
+            task=prompt.task,
+            plan=prompt.plan,
+            tools_factory=tools_factory,
+            turn_context=prompt.turn_context,
+            model=step.model,
+            max_tokens=step.max_tokens,
+            timeout=step.timeout,
+            provider=provider
+        ))
+
+    async def routing_adaptor(prompt: Prompt) -> Dict:
+        return await get_model_policy(model_policy).acall("routing", lambda step: ainfer_llm_task_routing(
+            task=prompt.task,
+            plan=prompt.plan,
+            tools=prompt.tools,
+            agents=prompt.agents,
+            turn_context=prompt.turn_context,
+            model=step.model,
+            max_tokens=step.max_tokens,
+            timeout=step.timeout,
+            provider=provider
+        ))
+
+    async def fused_routing_adaptor(prompt: Prompt) -> Dict:
+        return await get_model_policy(model_policy).acall("routing", lambda step: ainfer_llm_fused_routing(
+            task=prompt.task,
+            plan=prompt.plan,
+            tools=prompt.tools,
+            tools_factory=tools_factory,
+            agents=prompt.agents,
+            turn_context=prompt.turn_context,
+            feedback=prompt.feedback,
+            model=step.model,
+            max_tokens=step.max_tokens,
+            timeout=step.timeout,
+            provider=provider
+        ))
+
+    adaptors = {"routing": routing_adaptor, "fused": fused_routing_adaptor}
+    return adaptors.get(task, tool_selection_adaptor)
 
 
 class Agent:
@@ -57,7 +174,62 @@ class Agent:
                  generate_response: Callable[[Prompt], str],
                  environment: Environment,
                  payload_memory: PayloadMemory,
-                 tool_context: ToolContext = None):
+                 tool_context: ToolContext = None,
+                 provider: Union[str, LLMProvider] = None,
+                 async_generate_response_routing: Callable[[Prompt], Awaitable[Dict[str, Any]]] = None,
+                 async_generate_response_tool_selection: Callable[[Prompt], Awaitable[Dict[str, Any]]] = None,
+                 model_policy: ModelPolicy = None,
+                 generate_response_fused: Callable[[Prompt], Dict[str, Any]] = None,
+                 async_generate_response_fused: Callable[[Prompt], Awaitable[Dict[str, Any]]] = None,
+                 pipelined: bool = False,
+                 fast_feedback: bool = True,
+                 plan_executor: bool = False,
+                 speculative_tools: bool = False,
+                 speculation_max_waste: float = 0.3,
+                 budget: RunBudget = None,
+                 max_identical_calls: Optional[int] = 2,
+                 max_calls_per_resource: Optional[int] = None,
+                 memory_compactor: MemoryCompactor = None):
+        """
+        `generate_response_fused` (e.g. `prompt_adaptor(tools_factory, task="fused")`) switches the agent to
+        fused routing: one request returns the routing decision together with the tool arguments. Turns
+        where the fused answer is unusable fall back to the two-phase routing + selection adaptors.
+
+        `pipelined` overlaps turn phases that do not depend on each other: the first turn context is built
+        while the plan is, and each later one while the feedback LLM assesses the previous turn, with the
+        prompt it gets when that feedback is PENDING (which the context prompt leaves out). A context built
+        ahead is used only when the prompt the serial loop would send is identical, and is otherwise
+        discarded and rebuilt, so the decisions are the same in both modes (see `pipeline_stats`).
+
+        `fast_feedback` decides mechanical turn outcomes (failed or unknown tool, terminal tool executed)
+        without the feedback LLM. A terminal tool that ran ends the run with a response built from its result.
+
+        `plan_executor` runs the plan's step graph directly, without routing or selection calls: steps that
+        resolve to a registered tool or sub-agent with complete, literal arguments run concurrently as soon
+        as their dependencies have completed. The routing LLM takes over for ambiguous steps, their
+        dependants and anything left after a failure. `last_plan_report` compares the critical path with
+        the total work.
+
+        `speculative_tools` starts the call the plan predicts next while routing is in flight, for tools
+        registered with `side_effect_free=True`. The result is used when the router selects the same call
+        and discarded otherwise; speculation pauses while more than `speculation_max_waste` of the
+        speculative calls were wasted (see `tool_speculator.stats`).
+
+        `budget` is the default `RunBudget` of every run (see `run`).
+
+        Within a run, a tool or agent call identical to one that already succeeded (same name and normalized
+        arguments) is answered from the earlier result, recorded in memory with a `"memoized": true` marker.
+        A call issued more than `max_identical_calls` times, or a tool / agent invoked more than
+        `max_calls_per_resource` times, ends the run with a best-effort answer (stop reason "repeat_limit").
+        None disables the respective limit; `invocation_stats` counts memo hits and limit stops.
+
+        A `Memory` created with a `CompactionPolicy` is compacted by `memory_compactor` (by default one using
+        the agent's provider and model policy) as entries are recorded: older entries are summarized in the
+        background, so the history in the plan and context prompts stays roughly constant in size.
+
+        The payloads an observation or answer references are registered with `payload_memory` against the
+        memory recording it (see `PayloadMemory.add_references`), so they can be reclaimed with that memory.
+        """
         self.prompt_store = PromptStore()
         self.agent_id = uuid.uuid4()
         self.agent_card = agent_card
@@ -66,9 +238,31 @@ class Agent:
         self.environment = environment
         self.generate_response_routing = generate_response_routing
         self.generate_response_tool_selection = generate_response_tool_selection
+        self.async_generate_response_routing = async_generate_response_routing
+        self.async_generate_response_tool_selection = async_generate_response_tool_selection
+        self.generate_response_fused = generate_response_fused
+        self.async_generate_response_fused = async_generate_response_fused
+        self.pipelined = pipelined
+        self.pipeline_stats = {"speculative_contexts": 0, "reused": 0, "discarded": 0}
+        self._pipeline_executor = None
+        self.fast_feedback = fast_feedback
+        self.plan_executor = plan_executor
+        self.plan_stats = {"executed_steps": 0, "handed_to_router": 0}
+        self.last_plan_report = None
+        self.tool_speculator = ToolSpeculator(resources, environment, max_waste_ratio=speculation_max_waste) \
+            if speculative_tools else None
         self.generate_response = generate_response
         self.tool_context = tool_context
         self.payload_memory = payload_memory
+        self.provider = provider
+        self.model_policy = model_policy
+        self.last_run_id = None
+        self.budget = budget
+        self.last_run_report: Optional[RunReport] = None
+        self.max_identical_calls = max_identical_calls
+        self.max_calls_per_resource = max_calls_per_resource
+        self.invocation_stats = {"hits": 0, "limit_stops": 0}
+        self.memory_compactor = memory_compactor or MemoryCompactor(provider=provider, model_policy=model_policy)
         self.agent_context = None
         self.__create_agent_context()
 
@@ -77,7 +271,8 @@ class Agent:
             "id": self.agent_id,
             "agent_card": self.agent_card,
         }
-        self.agent_context = AgentContext(properties=agent_properties, memory=Memory(), invoke=self.run)
+        self.agent_context = AgentContext(properties=agent_properties, memory=Memory(), invoke=self.run,
+                                          ainvoke=self.arun)
 
     def __update_agent_memory(self, updated_memory: Memory):
         agent_properties = {
@@ -87,7 +282,8 @@ class Agent:
 
         # memory reframing (contraction / expansion) logic
 
-        self.agent_context = AgentContext(properties=agent_properties, memory=updated_memory, invoke=self.run)
+        self.agent_context = AgentContext(properties=agent_properties, memory=updated_memory, invoke=self.run,
+                                          ainvoke=self.arun)
 
     def construct_prompt_for_resource_selection(self, task: str, plan: Plan,
                                                 resources: ResourceRegistry, inject_prompt_instruction: str = None,
@@ -128,22 +324,88 @@ class Agent:
 
         return tool, normalized_invocation
 
-    def generate_response_from_payload(self, task: str, response: str, content: str = ""):
+    def _payload_generation_prompt(self, task: str, response: Any, content: str = "") -> str:
         data = []
         if "response" in response:
             payload_ids = response["response"]["payload_ids"]
+        elif "payload_ids" in response:
+            payload_ids = response["payload_ids"]
         else:
             payload_ids = response["payload_id"]
+        if isinstance(payload_ids, str):
+            payload_ids = [payload_ids]
         for payload_id in payload_ids:
             data.append({
                 "payload_id": payload_id,
                 "payload": self.payload_memory.retrieve_payload(payload_id)
             })
-        prompt = (
+        return (
             f"Directions: {task}\nContent: {content}\nContext: {data}\n"
         )
-        agent_response = infer_llm_generation(prompt)
-        return agent_response
+
+    def generate_response_from_payload(self, task: str, response: str, content: str = "",
+                                       on_token: Optional[Callable[[str], Any]] = None):
+        """
+        Generate the final answer from the referenced payloads. With `on_token`, the answer is
+        streamed and every delta is passed to `on_token`; the full text is still returned.
+        """
+        prompt = self._payload_generation_prompt(task=task, response=response, content=content)
+        model_policy = get_model_policy(self.model_policy)
+        if on_token is None:
+            return model_policy.call("generation", lambda step: infer_llm_generation(
+                prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout, provider=self.provider))
+
+        def stream(step: StepConfig):
+            chunks = []
+            try:
+                for delta in infer_llm_generation_stream(prompt, model=step.model, max_tokens=step.max_tokens,
+                                                         timeout=step.timeout, provider=self.provider):
+                    chunks.append(delta)
+                    on_token(delta)
+            except (BudgetExhaustedError, RunCancelledError):
+                raise
+            except Exception as e:
+                if not chunks:
+                    return {"tool": "error", "args": {"message": f"LLM call failed: {e}"}}
+                print(f"[WARN] response stream interrupted: {e}")
+            return "".join(chunks)
+
+        return model_policy.call("generation", stream)
+
+    async def agenerate_response_from_payload(self, task: str, response: str, content: str = "",
+                                              on_token: Optional[Callable[[str], Any]] = None):
+        prompt = self._payload_generation_prompt(task=task, response=response, content=content)
+        model_policy = get_model_policy(self.model_policy)
+        if on_token is None:
+            return await model_policy.acall("generation", lambda step: ainfer_llm_generation(
+                prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout, provider=self.provider))
+
+        async def stream(step: StepConfig):
+            chunks = []
+            try:
+                async for delta in ainfer_llm_generation_stream(prompt, model=step.model, max_tokens=step.max_tokens,
+                                                                timeout=step.timeout, provider=self.provider):
+                    chunks.append(delta)
+                    await self._emit_token(on_token, delta)
+            except (BudgetExhaustedError, RunCancelledError):
+                raise
+            except Exception as e:
+                if not chunks:
+                    return {"tool": "error", "args": {"message": f"LLM call failed: {e}"}}
+                print(f"[WARN] response stream interrupted: {e}")
+            return "".join(chunks)
+
+        return await model_policy.acall("generation", stream)
+
+    @staticmethod
+    async def _emit_token(on_token: Callable[[str], Any], delta: str):
+        result = on_token(delta)
+        if inspect.isawaitable(result):
+            await result
+
+    @staticmethod
+    def _response_text(agent_response: Any) -> str:
+        return agent_response if isinstance(agent_response, str) else json.dumps(agent_response)
 
     def should_terminate(self, invocation: Dict) -> bool:
         try:
@@ -174,6 +436,12 @@ class Agent:
                 "type": "environment",
                 "content": json.dumps(result),
             })
+            payload_ids = self._referenced_payload_ids(result)
+            if payload_ids:
+                self.payload_memory.add_references(memory, payload_ids)
+
+        if getattr(memory, "compaction", None) is not None:
+            self.memory_compactor.maybe_compact(memory, session_id=current_ledger_scope().get("session_id"))
 
         # self.__update_agent_memory(updated_memory=memory)
 
@@ -182,56 +450,850 @@ class Agent:
         return res
 
     def prompt_llm_for_routing(self, prompt: Prompt) -> Dict:
+        if self.generate_response_fused:
+            res = self.generate_response_fused(prompt)
+            if self._fused_response_usable(res):
+                return res
+            print(f"[WARN] fused routing unusable, falling back to two-phase routing: {res}")
         res = self.generate_response_routing(prompt)
         return res
 
-    def construct_payload(self, memory: Memory, invocation: Any, result: Any):
+    async def aprompt_llm_for_tool_selection(self, prompt: Prompt) -> Dict:
+        if self.async_generate_response_tool_selection:
+            return await self.async_generate_response_tool_selection(prompt)
+        return await asyncio.to_thread(self.generate_response_tool_selection, prompt)
+
+    async def aprompt_llm_for_routing(self, prompt: Prompt) -> Dict:
+        if self.async_generate_response_fused or self.generate_response_fused:
+            if self.async_generate_response_fused:
+                res = await self.async_generate_response_fused(prompt)
+            else:
+                res = await asyncio.to_thread(self.generate_response_fused, prompt)
+            if self._fused_response_usable(res):
+                return res
+            print(f"[WARN] fused routing unusable, falling back to two-phase routing: {res}")
+        if self.async_generate_response_routing:
+            return await self.async_generate_response_routing(prompt)
+        return await asyncio.to_thread(self.generate_response_routing, prompt)
+
+    def _payload_description_prompt(self, memory: Memory, invocation: Any) -> str:
         prompt_values = {
             "memory": memory,
             "invocation": invocation
         }
-        agent_payload_memory_builder_prompt = self.prompt_store.get_prompt(
-            "agent_payload_memory_builder_instruction",
-            **prompt_values)
-        res = infer_llm_json(agent_payload_memory_builder_prompt)
+        return self.prompt_store.get_prompt("agent_payload_memory_builder_instruction", **prompt_values)
+
+    def construct_payload(self, memory: Memory, invocation: Any, result: Any):
+        agent_payload_memory_builder_prompt = self._payload_description_prompt(memory=memory, invocation=invocation)
+        res = get_model_policy(self.model_policy).call("payload", lambda step: infer_llm_json(
+            agent_payload_memory_builder_prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout,
+            provider=self.provider, call_site="payload"))
         payload_description = res.get("description", json.dumps(invocation))
-        payload_id = self.payload_memory.add_payload(result)
+        payload_id = self.payload_memory.add_payload(result, holder=memory)
         return payload_id, payload_description
 
-    def run(self, task: str, memory=None, max_iterations: int = 50) -> Memory:
+    async def aconstruct_payload(self, memory: Memory, invocation: Any, result: Any):
+        agent_payload_memory_builder_prompt = self._payload_description_prompt(memory=memory, invocation=invocation)
+        res = await get_model_policy(self.model_policy).acall("payload", lambda step: ainfer_llm_json(
+            agent_payload_memory_builder_prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout,
+            provider=self.provider, call_site="payload"))
+        payload_description = res.get("description", json.dumps(invocation))
+        payload_id = self.payload_memory.add_payload(result, holder=memory)
+        return payload_id, payload_description
+
+    def should_store_payload(self, result: Any) -> bool:
+        return len(json.dumps(result).split()) > 100
+
+    @staticmethod
+    def _referenced_payload_ids(result: Any) -> List[str]:
+        """Payload ids referenced by an observation, a list of observations or an answer."""
+        payload_ids = []
+        for item in result if isinstance(result, list) else [result]:
+            if not isinstance(item, dict):
+                continue
+            if item.get("payload_id"):
+                payload_ids.append(str(item["payload_id"]))
+            referenced = item.get("payload_ids") or []
+            payload_ids.extend([referenced] if isinstance(referenced, str) else [str(p) for p in referenced])
+        return payload_ids
+
+    def _payload_value(self, result: Any) -> Any:
+        return result["result"] if isinstance(result, dict) and "result" in result else result
+
+    def _payload_reference(self, result: Any, payload_id: str, payload_description: str) -> Dict[str, Any]:
+        return {
+            "tool_executed": result.get("tool_executed", "") if isinstance(result, dict) else "",
+            "description": PAYLOAD_REFERENCE_DESCRIPTION,
+            "payload_id": str(payload_id),
+            "payload_description": payload_description
+        }
+
+    def record_observation(self, memory: Memory, invocation: Any, result: Any) -> Any:
+        """
+        Store the outcome of a tool / agent invocation in memory. Large results are moved to the payload
+        memory and replaced by a reference. Returns the observation as recorded.
+        """
+        result = self._observation(memory=memory, invocation=invocation, result=result)
+        self.update_memory(memory=memory, invocation=invocation, result=result)
+        return result
+
+    async def arecord_observation(self, memory: Memory, invocation: Any, result: Any) -> Any:
+        result = await self._aobservation(memory=memory, invocation=invocation, result=result)
+        self.update_memory(memory=memory, invocation=invocation, result=result)
+        return result
+
+    def record_observations(self, memory: Memory, invocations: List[Any], results: List[Any]) -> List[Any]:
+        """Record the invocations and results of one turn's parallel tool calls as a single memory step."""
+        observations = [self._observation(memory=memory, invocation=invocation, result=result)
+                        for invocation, result in zip(invocations, results)]
+        self.update_memory(memory=memory, invocation=invocations, result=observations)
+        return observations
+
+    async def arecord_observations(self, memory: Memory, invocations: List[Any], results: List[Any]) -> List[Any]:
+        observations = await asyncio.gather(*[
+            self._aobservation(memory=memory, invocation=invocation, result=result)
+            for invocation, result in zip(invocations, results)
+        ])
+        self.update_memory(memory=memory, invocation=invocations, result=observations)
+        return observations
+
+    def _observation(self, memory: Memory, invocation: Any, result: Any) -> Any:
+        if not is_memoized(result) and self.should_store_payload(result):
+            payload_id, payload_description = self.construct_payload(memory=memory, invocation=invocation,
+                                                                     result=self._payload_value(result))
+            result = self._payload_reference(result, payload_id, payload_description)
+        return result
+
+    async def _aobservation(self, memory: Memory, invocation: Any, result: Any) -> Any:
+        if not is_memoized(result) and self.should_store_payload(result):
+            payload_id, payload_description = await self.aconstruct_payload(memory=memory, invocation=invocation,
+                                                                            result=self._payload_value(result))
+            result = self._payload_reference(result, payload_id, payload_description)
+        return result
+
+    def execute_selection(self, selection_response: Dict, speculation: Speculation = None,
+                          memo: InvocationMemo = None) -> Tuple[Any, Any]:
+        """
+        Execute the selected tool, reusing the speculative result when `speculation` ran the same call and
+        the earlier result when `memo` has seen it succeed.
+        """
+        invocation = None
+        try:
+            resolved = self.get_tool(selection_response)
+            if isinstance(resolved, dict):
+                return selection_response, resolved
+            tool, invocation = resolved
+            memoized = memo.recall(invocation) if memo is not None else None
+            if memoized is not None:
+                return invocation, memoized
+            args = invocation.get("args", {})
+            result = self.tool_speculator.claim(speculation, invocation) if self.tool_speculator else None
+            if result is None:
+                result = self.environment.execute_tool(tool, args)
+        except Exception as e:
+            result = f"Failed to execute tool: {e}"
+        return invocation, result
+
+    async def aexecute_selection(self, selection_response: Dict, speculation: Speculation = None,
+                                 memo: InvocationMemo = None) -> Tuple[Any, Any]:
+        invocation = None
+        try:
+            resolved = self.get_tool(selection_response)
+            if isinstance(resolved, dict):
+                return selection_response, resolved
+            tool, invocation = resolved
+            memoized = memo.recall(invocation) if memo is not None else None
+            if memoized is not None:
+                return invocation, memoized
+            args = invocation.get("args", {})
+            result = await self.tool_speculator.aclaim(speculation, invocation) if self.tool_speculator else None
+            if result is None:
+                result = await asyncio.to_thread(self.environment.execute_tool, tool, args)
+        except Exception as e:
+            result = f"Failed to execute tool: {e}"
+        return invocation, result
+
+    def execute_selections(self, selections: List[Dict], memo: InvocationMemo = None) -> Tuple[List[Any], List[Any]]:
+        """Execute one turn's independent tool calls concurrently through the environment."""
+        invocations, calls, results = [], [], {}
+        for i, selection in enumerate(selections):
+            invocation = selection
+            try:
+                resolved = self.get_tool(selection)
+                if isinstance(resolved, dict):
+                    results[i] = resolved
+                else:
+                    tool, invocation = resolved
+                    memoized = memo.recall(invocation) if memo is not None else None
+                    if memoized is not None:
+                        results[i] = memoized
+                    else:
+                        calls.append((i, tool, invocation.get("args", {})))
+            except Exception as e:
+                results[i] = f"Failed to execute tool: {e}"
+            invocations.append(invocation)
+
+        executed = self.environment.execute_tools([(tool, args) for _, tool, args in calls])
+        for (i, _, _), result in zip(calls, executed):
+            results[i] = result
+        return invocations, [results[i] for i in range(len(selections))]
+
+    async def aexecute_selections(self, selections: List[Dict],
+                                  memo: InvocationMemo = None) -> Tuple[List[Any], List[Any]]:
+        return await asyncio.to_thread(self.execute_selections, selections, memo)
+
+    def _plan_steps(self, plan: Plan) -> List[PlanStep]:
+        return resolve_plan_steps(plan, self.resources) if self.plan_executor else []
+
+    def _speculation_steps(self, plan: Plan) -> List[PlanStep]:
+        return resolve_plan_steps(plan, self.resources) if self.tool_speculator else []
+
+    def _start_speculation(self, steps: List[PlanStep], task: str, memory: Memory,
+                           speculated: Set[str]) -> Optional[Speculation]:
+        if self.tool_speculator is None:
+            return None
+        return self.tool_speculator.start(steps, task, memory, speculated)
+
+    def _astart_speculation(self, steps: List[PlanStep], task: str, memory: Memory,
+                            speculated: Set[str]) -> Optional[Speculation]:
+        if self.tool_speculator is None:
+            return None
+        return self.tool_speculator.astart(steps, task, memory, speculated)
+
+    def _discard_speculation(self, speculation: Optional[Speculation]):
+        if self.tool_speculator is not None:
+            self.tool_speculator.discard(speculation)
+
+    def _is_terminal_step(self, step: PlanStep) -> bool:
+        return step.tool is not None and getattr(self.resources.get_tool(step.tool), "terminal", False)
+
+    def _runnable_plan_steps(self, steps: List[PlanStep]) -> List[PlanStep]:
+        """
+        The part of the step graph the executor can run on its own, in topological order: executable steps
+        whose dependencies are all executable. A cyclic graph is run sequentially in plan order. Terminal
+        steps wait for every other runnable step, and are left to the router when any step is.
+        """
+        if not steps:
+            return []
+        ordered = order_plan_steps(steps)
+        if ordered is None:
+            print("[WARN] plan steps have cyclic dependencies; running them sequentially")
+            ordered = sequential_plan_steps(steps)
+
+        runnable, blocked = [], set()
+        for step in ordered:
+            if not step.executable or blocked.intersection(step.depends_on):
+                if not step.executable:
+                    print(f"[INFO] plan step {step.id} {step.action!r} handed to the router: {step.reason}")
+                blocked.add(step.id)
+            else:
+                runnable.append(step)
+
+        others = [step.id for step in runnable if not self._is_terminal_step(step)]
+        runnable = [
+            replace(step, depends_on=sorted(set(step.depends_on) | set(others))) if self._is_terminal_step(step)
+            else step
+            for step in runnable if not (blocked and self._is_terminal_step(step))
+        ]
+        runnable = order_plan_steps(runnable) or sequential_plan_steps(runnable)
+        self.plan_stats["handed_to_router"] += len(steps) - len(runnable)
+        return runnable
+
+    @staticmethod
+    def _bind_step_args(step: PlanStep, results: Dict[str, Any]) -> Dict[str, Any]:
+        """Substitute "$<id>" arguments with the results of the steps they refer to."""
+        bound = {}
+        for name, value in step.args.items():
+            reference = step_reference(value)
+            bound[name] = results[reference] if reference in step.depends_on and reference in results else value
+        return bound
+
+    def _sub_agent_memory(self, memory: Memory) -> Memory:
+        """The copy of `memory` a sub-agent works on, referencing the same payloads for as long as it lives."""
+        sub_memory = memory.copy_without_system_memories()
+        self.payload_memory.share_references(memory, sub_memory)
+        return sub_memory
+
+    def _run_plan_step(self, memory: Memory, step: PlanStep, args: Dict[str, Any],
+                       memo: InvocationMemo = None) -> Tuple[Any, Any, float]:
+        started_at = time.monotonic()
+        if step.agent is not None:
+            # Sub-agents append to the memory they are given; concurrent steps each get their own copy.
+            invocation = {"agent": step.agent, "task": args["task"]}
+            result = memo.recall(invocation) if memo is not None else None
+            if result is None:
+                try:
+                    result = self.resources.get_agent(step.agent).invoke(task=args["task"],
+                                                                         memory=self._sub_agent_memory(memory))
+                except Exception as e:
+                    result = {"tool_executed": False, "error": str(e)}
+        else:
+            invocation, result = self.execute_selection({"tool": step.tool, "args": args}, memo=memo)
+        print(f"{GREEN}Plan Step {step.id}: {invocation}{RESET}")
+        return invocation, result, time.monotonic() - started_at
+
+    async def _arun_plan_step(self, memory: Memory, step: PlanStep, args: Dict[str, Any],
+                              memo: InvocationMemo = None) -> Tuple[Any, Any, float]:
+        started_at = time.monotonic()
+        if step.agent is not None:
+            invocation = {"agent": step.agent, "task": args["task"]}
+            agent = self.resources.get_agent(step.agent)
+            result = memo.recall(invocation) if memo is not None else None
+            if result is None:
+                try:
+                    if getattr(agent, "ainvoke", None):
+                        result = await agent.ainvoke(task=args["task"], memory=self._sub_agent_memory(memory))
+                    else:
+                        result = await asyncio.to_thread(agent.invoke, task=args["task"],
+                                                         memory=self._sub_agent_memory(memory))
+                except Exception as e:
+                    result = {"tool_executed": False, "error": str(e)}
+        else:
+            invocation, result = await self.aexecute_selection({"tool": step.tool, "args": args}, memo=memo)
+        print(f"{GREEN}Plan Step {step.id}: {invocation}{RESET}")
+        return invocation, result, time.monotonic() - started_at
+
+    def execute_plan_graph(self, memory: Memory, steps: List[PlanStep],
+                           memo: InvocationMemo = None) -> Tuple[List[Any], List[Any]]:
+        """
+        Run the steps (see `_runnable_plan_steps`) concurrently, each as soon as its dependencies have
+        completed; dependants of a failed step are not run. Every completion is recorded in memory.
+        Returns the invocations and observations in completion order.
+        """
+        started_at = time.monotonic()
+        pending, running = list(steps), {}
+        results, durations, failed = {}, {}, []
+        invocations, observations = [], []
+        while pending or running:
+            for step in [s for s in pending if all(d in results for d in s.depends_on)]:
+                pending.remove(step)
+                future = self._pipeline_submit(self._run_plan_step, memory=memory, step=step,
+                                               args=self._bind_step_args(step, results), memo=memo)
+                running[future] = step
+            if not running:
+                break
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                invocation, result, durations[step.id] = future.result()
+                invocations.append(invocation)
+                observations.append(self.record_observation(memory=memory, invocation=invocation, result=result))
+                if memo is not None:
+                    memo.remember(invocation, observations[-1])
+                if failure_reason(result) is None:
+                    results[step.id] = self._payload_value(result)
+                else:
+                    failed.append(step.id)
+        self._report_plan_graph(steps, durations, failed, time.monotonic() - started_at)
+        return invocations, observations
+
+    async def aexecute_plan_graph(self, memory: Memory, steps: List[PlanStep],
+                                  memo: InvocationMemo = None) -> Tuple[List[Any], List[Any]]:
+        started_at = time.monotonic()
+        pending, running = list(steps), {}
+        results, durations, failed = {}, {}, []
+        invocations, observations = [], []
+        while pending or running:
+            for step in [s for s in pending if all(d in results for d in s.depends_on)]:
+                pending.remove(step)
+                task = asyncio.ensure_future(self._arun_plan_step(memory=memory, step=step,
+                                                                  args=self._bind_step_args(step, results),
+                                                                  memo=memo))
+                running[task] = step
+            if not running:
+                break
+            done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                step = running.pop(task)
+                invocation, result, durations[step.id] = task.result()
+                invocations.append(invocation)
+                observations.append(await self.arecord_observation(memory=memory, invocation=invocation,
+                                                                   result=result))
+                if memo is not None:
+                    memo.remember(invocation, observations[-1])
+                if failure_reason(result) is None:
+                    results[step.id] = self._payload_value(result)
+                else:
+                    failed.append(step.id)
+        self._report_plan_graph(steps, durations, failed, time.monotonic() - started_at)
+        return invocations, observations
+
+    def _report_plan_graph(self, steps: List[PlanStep], durations: Dict[str, float], failed: List[str],
+                           wall_seconds: float):
+        path_seconds, path = critical_path(steps, durations)
+        total_work = sum(durations.values())
+        self.plan_stats["executed_steps"] += len(durations)
+        self.last_plan_report = {
+            "steps": len(steps),
+            "executed": len(durations),
+            "failed": failed,
+            "total_work_seconds": round(total_work, 3),
+            "critical_path_seconds": round(path_seconds, 3),
+            "critical_path": path,
+            "wall_seconds": round(wall_seconds, 3),
+            "parallelism": round(total_work / path_seconds, 2) if path_seconds else 1.0,
+        }
+        print(f"[INFO] plan graph: {len(durations)}/{len(steps)} steps, critical path {path} "
+              f"{path_seconds:.2f}s of {total_work:.2f}s total work")
+
+    @staticmethod
+    def _completed_by_rules(feedback: Optional[AgentFeedback]) -> bool:
+        return feedback is not None and feedback.source == "rules" and feedback.status == TaskStatus.COMPLETED
+
+    @staticmethod
+    def _split_observations(observation: Any) -> Tuple[List[str], List[Any]]:
+        """Split a turn's observation(s) into payload ids and inline results."""
+        payload_ids, results = [], []
+        for item in observation if isinstance(observation, list) else [observation]:
+            if isinstance(item, dict) and "payload_id" in item:
+                payload_ids.append(item["payload_id"])
+            else:
+                results.append(item["result"] if isinstance(item, dict) and "result" in item else item)
+        return payload_ids, results
+
+    def _terminal_observations(self, action: Any, observation: Any) -> Any:
+        """Keep only the observations of terminal tools when a turn ran several calls."""
+        if not isinstance(action, list) or not isinstance(observation, list):
+            return observation
+        terminal = [o for a, o in zip(action, observation)
+                    if isinstance(a, dict) and getattr(self.resources.get_tool(a.get("tool")), "terminal", False)]
+        return terminal or observation
+
+    def respond_from_observation(self, task: str, memory: Memory, observation: Any, action: Any = None,
+                                 on_token: Optional[Callable[[str], Any]] = None) -> Any:
+        """
+        Final answer for a run completed by a terminal tool: the tool result itself, or a response generated
+        from its payload when the result was moved to the payload memory.
+        """
+        payload_ids, results = self._split_observations(self._terminal_observations(action, observation))
+        if payload_ids:
+            agent_response = self.generate_response_from_payload(task=task, response={"payload_ids": payload_ids},
+                                                                 content=json.dumps(results) if results else "",
+                                                                 on_token=on_token)
+        else:
+            agent_response = results[0] if len(results) == 1 else results
+            if on_token:
+                on_token(self._response_text(agent_response))
+        self.update_memory(memory=memory, result=agent_response)
+        return agent_response
+
+    async def arespond_from_observation(self, task: str, memory: Memory, observation: Any, action: Any = None,
+                                        on_token: Optional[Callable[[str], Any]] = None) -> Any:
+        payload_ids, results = self._split_observations(self._terminal_observations(action, observation))
+        if payload_ids:
+            agent_response = await self.agenerate_response_from_payload(
+                task=task, response={"payload_ids": payload_ids}, content=json.dumps(results) if results else "",
+                on_token=on_token)
+        else:
+            agent_response = results[0] if len(results) == 1 else results
+            if on_token:
+                await self._emit_token(on_token, self._response_text(agent_response))
+        self.update_memory(memory=memory, result=agent_response)
+        return agent_response
+
+    def _pipeline_submit(self, fn: Callable, **kwargs):
+        if self._pipeline_executor is None:
+            self._pipeline_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent-pipeline")
+        return self._pipeline_executor.submit(contextvars.copy_context().run, lambda: fn(**kwargs))
+
+    def _start_context(self, context_builder: ContextBuilder, task: str, memory: Memory,
+                       feedback: AgentFeedback = None) -> _PendingContext:
+        """
+        Start building the turn context for `feedback` on the pipeline executor, on a copy of `context_builder`
+        and under its own cancellation token. Its prompt is rendered now, from the memory as it is now.
+        """
+        builder = copy.copy(context_builder)
+        prompt = builder.turn_context_prompt(task=task, memory=memory, feedback=feedback)
+        token = CancellationToken(parent=current_cancellation_token())
+
+        def build() -> TurnContext:
+            with use_cancellation_token(token):
+                return builder.build_turn_context(task=task, memory=memory, prompt=prompt)
+
+        self.pipeline_stats["speculative_contexts"] += 1
+        return _PendingContext(self._pipeline_submit(build), prompt, token)
+
+    def _astart_context(self, context_builder: ContextBuilder, task: str, memory: Memory,
+                        feedback: AgentFeedback = None) -> _PendingContext:
+        builder = copy.copy(context_builder)
+        prompt = builder.turn_context_prompt(task=task, memory=memory, feedback=feedback)
+        self.pipeline_stats["speculative_contexts"] += 1
+        return _PendingContext(asyncio.ensure_future(builder.abuild_turn_context(task=task, memory=memory,
+                                                                                 prompt=prompt)), prompt)
+
+    def _plan_and_first_context(self, plan_builder: PlanBuilder, context_builder: ContextBuilder, task: str,
+                                memory: Memory):
+        """
+        Build the plan. In pipelined mode the first turn context, which never depends on the plan, is started
+        alongside and returned as a `_PendingContext` for `_next_context` (None otherwise).
+        """
+        first_context = self._start_context(context_builder, task, memory) if self.pipelined else None
+        try:
+            plan = plan_builder.build_plan(task=task, resources=self.resources, memory=memory)
+        except BaseException:
+            self._discard_context(first_context)
+            raise
+        return plan, first_context
+
+    async def _aplan_and_first_context(self, plan_builder: PlanBuilder, context_builder: ContextBuilder, task: str,
+                                       memory: Memory):
+        first_context = self._astart_context(context_builder, task, memory) if self.pipelined else None
+        try:
+            plan = await plan_builder.abuild_plan(task=task, resources=self.resources, memory=memory)
+        except BaseException:
+            await self._adiscard_context(first_context)
+            raise
+        return plan, first_context
+
+    def _feedback_needs_llm(self, feedback_builder: FeedbackBuilder, action: Any, observation: Any) -> bool:
+        return not feedback_builder.fast_path or rule_based_feedback(action=action, observation=observation,
+                                                                     resources=self.resources) is None
+
+    def _feedback_and_next_context(self, feedback_builder: FeedbackBuilder, context_builder: ContextBuilder,
+                                   task: str, memory: Memory, action: Any, observation: Any):
+        """
+        Build the turn's feedback. In pipelined mode, when the feedback LLM is needed, the next turn context is
+        started meanwhile and returned as a `_PendingContext` for `_next_context` (None otherwise).
+        """
+        next_context = None
+        if self.pipelined and self._feedback_needs_llm(feedback_builder, action, observation):
+            next_context = self._start_context(context_builder, task, memory)
+        try:
+            feedback = feedback_builder.build_agent_feedback(task=task, action=action, observation=observation,
+                                                             resources=self.resources)
+        except BaseException:
+            self._discard_context(next_context)
+            raise
+        return feedback, next_context
+
+    async def _afeedback_and_next_context(self, feedback_builder: FeedbackBuilder, context_builder: ContextBuilder,
+                                          task: str, memory: Memory, action: Any, observation: Any):
+        next_context = None
+        if self.pipelined and self._feedback_needs_llm(feedback_builder, action, observation):
+            next_context = self._astart_context(context_builder, task, memory)
+        try:
+            feedback = await feedback_builder.abuild_agent_feedback(task=task, action=action, observation=observation,
+                                                                    resources=self.resources)
+        except BaseException:
+            await self._adiscard_context(next_context)
+            raise
+        return feedback, next_context
+
+    def _next_context(self, context_builder: ContextBuilder, pending: Optional[_PendingContext], task: str,
+                      memory: Memory, feedback: Optional[AgentFeedback]) -> TurnContext:
+        """
+        The turn context for `feedback`. A context built ahead is used only when it was started with the very
+        prompt the serial loop sends now; otherwise it is discarded and the context is built now.
+        """
+        prompt = context_builder.turn_context_prompt(task=task, memory=memory, feedback=feedback)
+        if pending is not None and pending.prompt == prompt:
+            return self._adopt_context(context_builder, pending)
+        self._discard_context(pending)
+        return context_builder.build_turn_context(task=task, memory=memory, feedback=feedback, prompt=prompt)
+
+    async def _anext_context(self, context_builder: ContextBuilder, pending: Optional[_PendingContext], task: str,
+                             memory: Memory, feedback: Optional[AgentFeedback]) -> TurnContext:
+        prompt = context_builder.turn_context_prompt(task=task, memory=memory, feedback=feedback)
+        if pending is not None and pending.prompt == prompt:
+            return await self._aadopt_context(context_builder, pending)
+        await self._adiscard_context(pending)
+        return await context_builder.abuild_turn_context(task=task, memory=memory, feedback=feedback, prompt=prompt)
+
+    def _adopt_context(self, context_builder: ContextBuilder, pending: _PendingContext) -> TurnContext:
+        try:
+            turn_context = pending.future.result()
+        finally:
+            pending.token.detach()
+        context_builder.turn_context = turn_context
+        self.pipeline_stats["reused"] += 1
+        return turn_context
+
+    async def _aadopt_context(self, context_builder: ContextBuilder, pending: _PendingContext) -> TurnContext:
+        turn_context = await pending.future
+        context_builder.turn_context = turn_context
+        self.pipeline_stats["reused"] += 1
+        return turn_context
+
+    def _discard_context(self, pending: Optional[_PendingContext]):
+        """
+        Drop a context built ahead that is not used. Its request is abandoned through its cancellation token
+        (recorded as aborted work of the run) and waited for, so nothing of it outlives the run.
+        """
+        if pending is None:
+            return
+        if not pending.future.cancel():
+            pending.token.cancel("pipelined turn context discarded")
+            try:
+                pending.future.result()
+            except Exception:
+                pass
+        pending.token.detach()
+        self.pipeline_stats["discarded"] += 1
+
+    async def _adiscard_context(self, pending: Optional[_PendingContext]):
+        if pending is None:
+            return
+        pending.future.cancel()
+        try:
+            await pending.future
+        except (asyncio.CancelledError, Exception):
+            pass
+        self.pipeline_stats["discarded"] += 1
+
+    def _create_builders(self) -> Tuple[PlanBuilder, ContextBuilder, FeedbackBuilder]:
+        plan_builder = PlanBuilder(provider=self.provider, model_policy=self.model_policy)
+        context_builder = ContextBuilder(payload_memory=self.payload_memory, provider=self.provider,
+                                         model_policy=self.model_policy)
+        feedback_builder = FeedbackBuilder(provider=self.provider, model_policy=self.model_policy,
+                                           fast_path=self.fast_feedback)
+        return plan_builder, context_builder, feedback_builder
+
+    def _fused_response_usable(self, res: Any) -> bool:
+        if not isinstance(res, dict) or not res or is_llm_error(res):
+            return False
+        tool_call = res.get("tool_call")
+        return tool_call is None or self.resources.get_tool(tool_call["tool"]) is not None
+
+    @staticmethod
+    def _is_terminate_response(routing_response: Dict) -> bool:
+        return "type" in routing_response and routing_response["type"] == "generate_response_and_terminate"
+
+    @staticmethod
+    def _has_payload_ids(routing_response: Dict) -> bool:
+        return "payload_ids" in routing_response["response"] and bool(routing_response["response"]["payload_ids"])
+
+    @staticmethod
+    def _reframed_task(routing_response: Dict, task: str) -> str:
+        if "reframed_task" in routing_response and routing_response["reframed_task"]:
+            return routing_response["reframed_task"]
+        return task
+
+    @contextmanager
+    def _run_scope(self, session_id: str = None, budget: RunBudget = None, cancel_token: CancellationToken = None):
+        """
+        Per-run context shared by `run` and `arun`: the agent's model policy is active (including for
+        the routing / selection adaptors) and every completion is attributed to this run in the token ledger.
+        A sub-agent run inherits the session of the run that invoked it. Usage is tracked against the
+        run budget, nested under the invoking run's budget for sub-agents; likewise a sub-agent run is
+        cancelled with the run that invoked it.
+        """
+        self.last_run_id = str(uuid.uuid4())
+        session_id = session_id or current_ledger_scope().get("session_id") or str(self.agent_id)
+        with use_model_policy(self.model_policy), use_run_budget(budget or self.budget) as tracker, \
+                use_cancellation_token(cancel_token) as run_token, \
+                ledger_scope(session_id=session_id, run_id=self.last_run_id, agent=self.agent_card.name):
+            set_ledger_iteration(None)
+            try:
+                yield tracker
+            finally:
+                self.last_run_report = tracker.report(self.last_run_id)
+                if run_token is not None:
+                    self.last_run_report.cancelled = list(run_token.cancelled_work)
+
+    @staticmethod
+    def _run_cancelled() -> bool:
+        token = current_cancellation_token()
+        return token is not None and token.cancelled
+
+    @staticmethod
+    def _raise_if_cancelled():
+        """Phase boundary: stop the run here when it has been cancelled (handled in `run` / `arun`)."""
+        token = current_cancellation_token()
+        if token is not None:
+            token.raise_if_cancelled()
+
+    def _interrupted_reason(self, tracker, error: Exception) -> str:
+        """Why `error` ended the run early: "cancelled" or the exhausted limit."""
+        if self._run_cancelled() or isinstance(error, RunCancelledError):
+            return "cancelled"
+        return tracker.exhausted() or "budget"
+
+    def _over_resource_limit(self, invocations_counter: Counter, invoked_item: str) -> bool:
+        if self.max_calls_per_resource is None or invocations_counter[invoked_item] <= self.max_calls_per_resource:
+            return False
+        self.invocation_stats["limit_stops"] += 1
+        print(f"[WARN] {invoked_item} invoked more than {self.max_calls_per_resource} times; ending the run")
+        self._set_stop_reason("repeat_limit")
+        return True
+
+    def _over_repeat_limit(self, memo: InvocationMemo, action: Any) -> bool:
+        if not memo.over_limit(action):
+            return False
+        print(f"[WARN] identical call issued more than {self.max_identical_calls} times; ending the run: {action}")
+        self._set_stop_reason("repeat_limit")
+        return True
+
+    @staticmethod
+    def _set_stop_reason(reason: str):
+        budget = current_run_budget()
+        if budget is not None:
+            budget.stop_reason = reason
+
+    @staticmethod
+    def _run_checkpoint(iteration: int) -> Optional[str]:
+        """Record the iteration; return why the run has to stop now (cancelled, or a limit nearly used up), if so."""
+        budget = current_run_budget()
+        if budget is None:
+            return None
+        budget.iterations = iteration + 1
+        reason = "cancelled" if Agent._run_cancelled() else budget.nearly_exhausted()
+        if reason is not None:
+            budget.stop_reason = reason
+        return reason
+
+    @staticmethod
+    def _gathered_results(memory: Memory) -> Tuple[List[str], List[Any]]:
+        """Payload ids and inline results of the successful observations recorded since the current task."""
+        payload_ids, results = [], []
+        for item in memory.since(memory.last_id("user") + 1, "environment"):
+            try:
+                content = json.loads(item["content"])
+            except (TypeError, ValueError):
+                continue
+            for observation in content if isinstance(content, list) else [content]:
+                if not isinstance(observation, dict) or failure_reason(observation) is not None:
+                    continue
+                if "payload_id" in observation:
+                    payload_ids.append(observation["payload_id"])
+                elif "result" in observation:
+                    results.append(observation["result"])
+        return payload_ids, results
+
+    def _partial_answer(self, memory: Memory, payload_ids: List[str], results: List[Any]) -> Dict[str, Any]:
+        budget = current_run_budget()
+        reason = budget.stop_reason if budget is not None else None
+        text = f"The run stopped early ({reason}) before the task was completed."
+        if results:
+            text += f" Results gathered so far: {json.dumps(results)}"
+        agent_response = {"text": text, "payload_ids": payload_ids}
+        token = current_cancellation_token()
+        if token is not None and token.cancelled:
+            agent_response["cancelled"] = {"reason": token.reason, "work": list(token.cancelled_work)}
+        self.update_memory(memory=memory, result=agent_response)
+        return agent_response
+
+    def best_effort_answer(self, task: str, memory: Memory, on_token: Optional[Callable[[str], Any]] = None) -> Any:
+        """
+        Answer from what the run has gathered when it has to stop early. The payloads and results recorded
+        since the task was given are turned into an answer by the generation step while the budget still
+        allows a completion; otherwise (and always for a cancelled run) they are returned as a partial answer.
+        """
+        payload_ids, results = self._gathered_results(memory)
+        budget = current_run_budget()
+        if (payload_ids or results) and (budget is None or budget.exhausted() is None) and not self._run_cancelled():
+            agent_response = self.generate_response_from_payload(task=task, response={"payload_ids": payload_ids},
+                                                                 content=json.dumps(results) if results else "",
+                                                                 on_token=on_token)
+            if not is_llm_error(agent_response):
+                self.update_memory(memory=memory, result=agent_response)
+                return agent_response
+        return self._partial_answer(memory, payload_ids, results)
+
+    async def abest_effort_answer(self, task: str, memory: Memory,
+                                  on_token: Optional[Callable[[str], Any]] = None) -> Any:
+        payload_ids, results = self._gathered_results(memory)
+        budget = current_run_budget()
+        if (payload_ids or results) and (budget is None or budget.exhausted() is None) and not self._run_cancelled():
+            agent_response = await self.agenerate_response_from_payload(
+                task=task, response={"payload_ids": payload_ids}, content=json.dumps(results) if results else "",
+                on_token=on_token)
+            if not is_llm_error(agent_response):
+                self.update_memory(memory=memory, result=agent_response)
+                return agent_response
+        return self._partial_answer(memory, payload_ids, results)
+
+    def usage_report(self, run_id: str = None) -> Dict[str, Any]:
+        """Token and cost totals of a run (the last one by default), overall, per call site and per iteration."""
+        run_id = run_id or self.last_run_id
+        report = get_token_ledger().summary(run_id=run_id)
+        report["by_iteration"] = get_token_ledger().totals(by="iteration", run_id=run_id)
+        return report
+
+    def run(self, task: str, memory=None, max_iterations: int = 50,
+            on_token: Optional[Callable[[str], Any]] = None, session_id: str = None,
+            budget: RunBudget = None, cancel_token: CancellationToken = None) -> Memory:
+        """
+        `on_token`, when given, receives the final answer as it is generated (see
+        `utils.util.websocket_token_callback`); the return value and memory bookkeeping are unchanged.
+        `session_id` groups runs in the token ledger (defaults to the agent id).
+
+        `budget` (default: the agent's `budget`) limits the run's wall-clock time, tokens and estimated
+        cost, including sub-agent runs. Once a limit is nearly used up, or after `max_iterations`, the
+        agent answers from the results gathered so far; `last_run_report.stop_reason` says why it stopped.
+
+        `cancel_token.cancel()` (from any thread) stops the run at its next phase boundary; the completions in
+        flight are cancelled with their requests, queued tool calls do not start and running ones are handed
+        the token (see `Environment.execute_tool`), and sub-agent runs stop with the run. The run then returns a partial answer whose
+        "cancelled" entry, like `last_run_report.cancelled`, lists the work that was aborted or skipped.
+        """
+        with self._run_scope(session_id, budget, cancel_token) as tracker:
+            try:
+                return self._run(task, memory=memory, max_iterations=max_iterations, on_token=on_token)
+            except (BudgetExhaustedError, RunCancelledError) as e:
+                self._set_stop_reason(self._interrupted_reason(tracker, e))
+                return self.best_effort_answer(task=task, memory=memory, on_token=on_token)
+
+    def _run(self, task: str, memory=None, max_iterations: int = 50,
+             on_token: Optional[Callable[[str], Any]] = None) -> Memory:
         self.set_current_task(task=task, memory=memory)
 
         invocations_counter = Counter()
-        plan_builder = PlanBuilder()
-        context_builder = ContextBuilder(payload_memory=self.payload_memory)
-        feedback_builder = FeedbackBuilder()
+        memo = InvocationMemo(self.max_identical_calls, stats=self.invocation_stats)
+        plan_builder, context_builder, feedback_builder = self._create_builders()
         turn_feedback, turn_action, turn_observation = None, None, None
-        plan = plan_builder.build_plan(task=task, resources=self.resources, memory=memory)
+        plan, next_context = self._plan_and_first_context(plan_builder, context_builder, task, memory)
+        plan_steps = self._plan_steps(plan)
+        speculation_steps, speculated_calls = self._speculation_steps(plan), set()
 
-        BLUE = "\033[94m"
-        RESET = "\033[0m"
         print(f"{BLUE}Plan: {plan.plan}{RESET}")
 
         for iteration in range(max_iterations):
+            set_ledger_iteration(iteration)
+            stop_reason = self._run_checkpoint(iteration)
+            if stop_reason is not None:
+                self._discard_context(next_context)
+                return self.best_effort_answer(task=task, memory=memory, on_token=on_token)
             if turn_feedback:
                 print(f"\033[33mObservation: {turn_feedback.reasoning}\033[0m")
 
-            turn_context = context_builder.build_turn_context(task=task, memory=memory, feedback=turn_feedback)
+            runnable_steps = self._runnable_plan_steps(plan_steps)
+            plan_steps = []
+            if runnable_steps:
+                self._discard_context(next_context)
+                next_context = None
+                turn_action, turn_observation = self.execute_plan_graph(memory=memory, steps=runnable_steps, memo=memo)
+                self._raise_if_cancelled()
+                turn_feedback, next_context = self._feedback_and_next_context(feedback_builder, context_builder, task,
+                                                                              memory, turn_action, turn_observation)
+                if self._completed_by_rules(turn_feedback):
+                    self._discard_context(next_context)
+                    return self.respond_from_observation(task=task, memory=memory, observation=turn_observation,
+                                                         action=turn_action, on_token=on_token)
+                continue
+
+            turn_context = self._next_context(context_builder, next_context, task, memory, turn_feedback)
+            next_context = None
 
             if turn_context.comments:
                 print(f"\033[34mThought: {turn_context.comments}\033[0m")
             routing_prompt = self.construct_prompt_for_resource_selection(task=task, plan=plan, resources=self.resources,
                                                                           turn_context=turn_context, feedback=turn_feedback)
+            speculation = self._start_speculation(speculation_steps, task, memory, speculated_calls)
             routing_response = self.prompt_llm_for_routing(prompt=routing_prompt)
+            self._raise_if_cancelled()
             if routing_response:
-                if "type" in routing_response and routing_response["type"] == "generate_response_and_terminate":
+                if self._is_terminate_response(routing_response):
+                    self._discard_speculation(speculation)
                     if "response" in routing_response and routing_response["response"]:
                         invocation = "generate_response_and_terminate"
                         content = routing_response["response"]
-                        if "payload_ids" in routing_response["response"] and routing_response["response"]["payload_ids"]:
-                            agent_response = self.generate_response_from_payload(task=task, response=routing_response["response"])
+                        if self._has_payload_ids(routing_response):
+                            agent_response = self.generate_response_from_payload(task=task, response=routing_response["response"],
+                                                                                 on_token=on_token)
                         else:
                             agent_response = routing_response.get("response")
+                            if on_token:
+                                on_token(self._response_text(agent_response))
                         # res_len = len(json.dumps(agent_response).split())
                         # if res_len > 100:
                         #     payload_id, payload_description = self.construct_payload(memory=memory,
@@ -249,76 +1311,46 @@ class Agent:
                         return agent_response
                     else:
                         print("[WARN] routing_response missing 'response'")
-                if "reframed_task" in routing_response and routing_response["reframed_task"]:
-                    reframed_task = routing_response["reframed_task"]
-                else:
-                    reframed_task = task
+                reframed_task = self._reframed_task(routing_response, task)
                 invoked_item = routing_response["name"]
                 invocations_counter[invoked_item] += 1
-
-                # if invocations_counter[invoked_item] > 2:
-                #     agent_response = self.generate_response_from_payload(task=reframed_task,
-                #                                                          response=json.loads(
-                #                                                              memory.get_memories()[-1]["content"]))
-                #     return agent_response
+                if self._over_resource_limit(invocations_counter, invoked_item):
+                    self._discard_speculation(speculation)
+                    return self.best_effort_answer(task=task, memory=memory, on_token=on_token)
 
                 if "type" in routing_response and routing_response["type"] == "agent":
                     scheduled_agent_name = routing_response["name"]
                     print(f"Agent Decision: Calling agent {scheduled_agent_name}")
                     scheduled_agent = self.resources.get_agent(agent_name=scheduled_agent_name)
-                    result = scheduled_agent.invoke(task=task, memory=memory)
-                    scheduled_agent_memory = scheduled_agent.get_memory()
                     invocation = {
                         'agent': scheduled_agent_name,
                         'task': reframed_task
                     }
-                    res_len = len(json.dumps(result).split())
-                    if res_len > 100:
-                        payload_id, payload_description = self.construct_payload(memory=memory, invocation=invocation,
-                                                                                 result=result["result"] if "result" in result else result)
-                        result = {
-                            "tool_executed": result["tool_executed"] if "tool_executed" in result else "",
-                            "description": "Reference to the memory store where result is being stored and can be retrieved using the `payload_id`. Refer to `payload_description` for more information about the result.",
-                            "payload_id": str(payload_id),
-                            "payload_description": payload_description
-                        }
-                        self.update_memory(memory=memory, invocation=invocation, result=result)
-                    else:
-                        self.update_memory(memory=memory, invocation=invocation, result=result)
+                    result = memo.recall(invocation)
+                    if result is None:
+                        result = scheduled_agent.invoke(task=task, memory=memory)
+                    turn_observation = self.record_observation(memory=memory, invocation=invocation, result=result)
                     turn_action = invocation
-                    turn_observation = result
                 elif "type" in routing_response and routing_response["type"] == "tool":
                     if "terminate" in routing_response["name"]:
                         reframed_task = routing_response["name"]
 
                     routing_prompt.task = reframed_task
-                    selection_response = self.prompt_llm_for_tool_selection(routing_prompt)
+                    selection_response = routing_response.get("tool_call") or \
+                        self.prompt_llm_for_tool_selection(routing_prompt)
 
-                    GREEN = "\033[92m"
                     print(f"{GREEN}Agent Decision: {selection_response}{RESET}")
 
-                    if "tool" in selection_response:
-                        invocation = None
-                        try:
-                            tool, invocation = self.get_tool(selection_response)
-                            args = invocation.get("args", {})
-                            result = self.environment.execute_tool(tool, args)
-                        except Exception as e:
-                            result = f"Failed to execute tool: {e}"
-                        res_len = len(json.dumps(result).split())
-                        if res_len > 100:
-                            payload_id, payload_description = self.construct_payload(memory=memory, invocation=invocation, result=result["result"] if "result" in result else result)
-                            result = {
-                                "tool_executed": result["tool_executed"],
-                                "description": "Reference to the memory store where result is being stored and can be retrieved using the `payload_id`. Refer to `payload_description` for more information about the result.",
-                                "payload_id": str(payload_id),
-                                "payload_description": payload_description
-                            }
-                            self.update_memory(memory=memory, invocation=invocation, result=result)
-                        else:
-                            self.update_memory(memory=memory, invocation=invocation, result=result)
+                    if "parallel_calls" in selection_response:
+                        invocations, results = self.execute_selections(selection_response["parallel_calls"], memo=memo)
+                        turn_observation = self.record_observations(memory=memory, invocations=invocations,
+                                                                    results=results)
+                        turn_action = invocations
+                    elif "tool" in selection_response:
+                        invocation, result = self.execute_selection(selection_response, speculation=speculation,
+                                                                 memo=memo)
+                        turn_observation = self.record_observation(memory=memory, invocation=invocation, result=result)
                         turn_action = invocation
-                        turn_observation = result
                     else:
                         json_selection_response = json.dumps(selection_response)
                         self.update_memory(memory=memory, response=json_selection_response)
@@ -330,7 +1362,160 @@ class Agent:
                     #                                                          response=json.loads(memory.get_memories()[-1]["content"]), content=selection_response)
                     #     return agent_response
 
-            turn_feedback = feedback_builder.build_agent_feedback(task=task, action=turn_action, observation=turn_observation,
-                                                  resources=self.resources)
-        final_response = json.loads(memory.get_memories()[-1]["content"])
-        return final_response
+            self._discard_speculation(speculation)
+            self._raise_if_cancelled()
+            memo.remember(turn_action, turn_observation)
+            if self._over_repeat_limit(memo, turn_action):
+                return self.best_effort_answer(task=task, memory=memory, on_token=on_token)
+            turn_feedback, next_context = self._feedback_and_next_context(feedback_builder, context_builder, task,
+                                                                          memory, turn_action, turn_observation)
+            if self._completed_by_rules(turn_feedback):
+                self._discard_context(next_context)
+                return self.respond_from_observation(task=task, memory=memory, observation=turn_observation,
+                                                     action=turn_action, on_token=on_token)
+        self._discard_context(next_context)
+        self._set_stop_reason("max_iterations")
+        return self.best_effort_answer(task=task, memory=memory, on_token=on_token)
+
+    async def arun(self, task: str, memory=None, max_iterations: int = 50,
+                   on_token: Optional[Callable[[str], Any]] = None, session_id: str = None,
+                   budget: RunBudget = None, cancel_token: CancellationToken = None) -> Memory:
+        """
+        Asyncio counterpart of `run` with the same semantics: every LLM round-trip is awaited, and tool
+        executions (which are plain callables) run in a worker thread so the event loop stays free.
+        `on_token` may be a plain function or a coroutine function.
+        """
+        with self._run_scope(session_id, budget, cancel_token) as tracker:
+            try:
+                return await self._arun(task, memory=memory, max_iterations=max_iterations, on_token=on_token)
+            except (BudgetExhaustedError, RunCancelledError) as e:
+                self._set_stop_reason(self._interrupted_reason(tracker, e))
+                return await self.abest_effort_answer(task=task, memory=memory, on_token=on_token)
+
+    async def _arun(self, task: str, memory=None, max_iterations: int = 50,
+                    on_token: Optional[Callable[[str], Any]] = None) -> Memory:
+        self.set_current_task(task=task, memory=memory)
+
+        invocations_counter = Counter()
+        memo = InvocationMemo(self.max_identical_calls, stats=self.invocation_stats)
+        plan_builder, context_builder, feedback_builder = self._create_builders()
+        turn_feedback, turn_action, turn_observation = None, None, None
+        plan, next_context = await self._aplan_and_first_context(plan_builder, context_builder, task, memory)
+        plan_steps = self._plan_steps(plan)
+        speculation_steps, speculated_calls = self._speculation_steps(plan), set()
+
+        print(f"{BLUE}Plan: {plan.plan}{RESET}")
+
+        for iteration in range(max_iterations):
+            set_ledger_iteration(iteration)
+            stop_reason = self._run_checkpoint(iteration)
+            if stop_reason is not None:
+                await self._adiscard_context(next_context)
+                return await self.abest_effort_answer(task=task, memory=memory, on_token=on_token)
+            if turn_feedback:
+                print(f"\033[33mObservation: {turn_feedback.reasoning}\033[0m")
+
+            runnable_steps = self._runnable_plan_steps(plan_steps)
+            plan_steps = []
+            if runnable_steps:
+                await self._adiscard_context(next_context)
+                next_context = None
+                turn_action, turn_observation = await self.aexecute_plan_graph(memory=memory, steps=runnable_steps,
+                                                                                 memo=memo)
+                self._raise_if_cancelled()
+                turn_feedback, next_context = await self._afeedback_and_next_context(
+                    feedback_builder, context_builder, task, memory, turn_action, turn_observation)
+                if self._completed_by_rules(turn_feedback):
+                    await self._adiscard_context(next_context)
+                    return await self.arespond_from_observation(task=task, memory=memory, observation=turn_observation,
+                                                                action=turn_action, on_token=on_token)
+                continue
+
+            turn_context = await self._anext_context(context_builder, next_context, task, memory, turn_feedback)
+            next_context = None
+
+            if turn_context.comments:
+                print(f"\033[34mThought: {turn_context.comments}\033[0m")
+            routing_prompt = self.construct_prompt_for_resource_selection(task=task, plan=plan, resources=self.resources,
+                                                                          turn_context=turn_context, feedback=turn_feedback)
+            speculation = self._astart_speculation(speculation_steps, task, memory, speculated_calls)
+            routing_response = await self.aprompt_llm_for_routing(prompt=routing_prompt)
+            self._raise_if_cancelled()
+            if routing_response:
+                if self._is_terminate_response(routing_response):
+                    self._discard_speculation(speculation)
+                    if "response" in routing_response and routing_response["response"]:
+                        if self._has_payload_ids(routing_response):
+                            agent_response = await self.agenerate_response_from_payload(task=task, response=routing_response["response"],
+                                                                                        on_token=on_token)
+                        else:
+                            agent_response = routing_response.get("response")
+                            if on_token:
+                                await self._emit_token(on_token, self._response_text(agent_response))
+                        self.update_memory(memory=memory, result=agent_response)
+                        return agent_response
+                    else:
+                        print("[WARN] routing_response missing 'response'")
+                reframed_task = self._reframed_task(routing_response, task)
+                invoked_item = routing_response["name"]
+                invocations_counter[invoked_item] += 1
+                if self._over_resource_limit(invocations_counter, invoked_item):
+                    self._discard_speculation(speculation)
+                    return await self.abest_effort_answer(task=task, memory=memory, on_token=on_token)
+
+                if "type" in routing_response and routing_response["type"] == "agent":
+                    scheduled_agent_name = routing_response["name"]
+                    print(f"Agent Decision: Calling agent {scheduled_agent_name}")
+                    scheduled_agent = self.resources.get_agent(agent_name=scheduled_agent_name)
+                    invocation = {
+                        'agent': scheduled_agent_name,
+                        'task': reframed_task
+                    }
+                    result = memo.recall(invocation)
+                    if result is None and getattr(scheduled_agent, "ainvoke", None):
+                        result = await scheduled_agent.ainvoke(task=task, memory=memory)
+                    elif result is None:
+                        result = await asyncio.to_thread(scheduled_agent.invoke, task=task, memory=memory)
+                    turn_observation = await self.arecord_observation(memory=memory, invocation=invocation, result=result)
+                    turn_action = invocation
+                elif "type" in routing_response and routing_response["type"] == "tool":
+                    if "terminate" in routing_response["name"]:
+                        reframed_task = routing_response["name"]
+
+                    routing_prompt.task = reframed_task
+                    selection_response = routing_response.get("tool_call") or \
+                        await self.aprompt_llm_for_tool_selection(routing_prompt)
+
+                    print(f"{GREEN}Agent Decision: {selection_response}{RESET}")
+
+                    if "parallel_calls" in selection_response:
+                        invocations, results = await self.aexecute_selections(selection_response["parallel_calls"],
+                                                                             memo=memo)
+                        turn_observation = await self.arecord_observations(memory=memory, invocations=invocations,
+                                                                           results=results)
+                        turn_action = invocations
+                    elif "tool" in selection_response:
+                        invocation, result = await self.aexecute_selection(selection_response,
+                                                                           speculation=speculation, memo=memo)
+                        turn_observation = await self.arecord_observation(memory=memory, invocation=invocation, result=result)
+                        turn_action = invocation
+                    else:
+                        json_selection_response = json.dumps(selection_response)
+                        self.update_memory(memory=memory, response=json_selection_response)
+                        turn_action = json_selection_response
+                        turn_observation = None
+
+            self._discard_speculation(speculation)
+            self._raise_if_cancelled()
+            memo.remember(turn_action, turn_observation)
+            if self._over_repeat_limit(memo, turn_action):
+                return await self.abest_effort_answer(task=task, memory=memory, on_token=on_token)
+            turn_feedback, next_context = await self._afeedback_and_next_context(
+                feedback_builder, context_builder, task, memory, turn_action, turn_observation)
+            if self._completed_by_rules(turn_feedback):
+                await self._adiscard_context(next_context)
+                return await self.arespond_from_observation(task=task, memory=memory, observation=turn_observation,
+                                                            action=turn_action, on_token=on_token)
+        await self._adiscard_context(next_context)
+        self._set_stop_reason("max_iterations")
+        return await self.abest_effort_answer(task=task, memory=memory, on_token=on_token)
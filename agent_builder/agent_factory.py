@@ -24,7 +24,7 @@ class AgentCard:
 
 
 class AgentContext:
-    def __init__(self, properties: Dict, memory: Memory, invoke: callable):
+    def __init__(self, properties: Dict, memory: Memory, invoke: callable, ainvoke: callable = None):
         if "id" not in properties:
             raise Exception("Agent id not specified.")
         self.agent_id = properties["id"]
@@ -38,6 +38,7 @@ class AgentContext:
 
         self.memory = memory
         self.invoke = invoke
+        self.ainvoke = ainvoke
 
     def get(self, key: str, default=None):
         return self.properties.get(key, default)
@@ -51,7 +51,7 @@ class AgentFunctionCallingActionLanguage(AgentLanguage):
         super().__init__()
 
     def format_memory(self, memory: Memory) -> List:
-        items = memory.get_memories()
+        items = memory.view()
         mapped_items = []
         for item in items:
             content = item.get("content", None)
@@ -1,10 +1,12 @@
 import uuid
 from dataclasses import dataclass, field
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Union
 
-from agent_builder.feedback_builder import AgentFeedback
+from agent_builder.feedback_builder import AgentFeedback, TaskStatus
 from agent_builder.memory_builder import Memory, PayloadMemory
-from utils.llm_api import infer_llm_json
+from utils.llm_api import infer_llm_json, ainfer_llm_json
+from utils.llm_providers import LLMProvider
+from utils.model_policy import ModelPolicy, get_model_policy
 from utils.prompt_store import PromptStore
 
 
@@ -28,7 +30,7 @@ def normalize_context(raw: Any) -> Dict[str, Any]:
         payload_val = d.get("payload_ids")
         comments = d.get("comments")
         if not isinstance(task_val, str):
-            raise TypeError(f"'task' field must be a string, got {type(task_val)}: {task_val!r}")
+            raise ValueError(f"'task' field must be a string, got {type(task_val)}: {task_val!r}")
         return {"task": task_val, "context": context_val, "payload_ids": payload_val, "comments": comments}
 
     if "task" in raw and "context" in raw and "payload_ids" in raw:
@@ -42,11 +44,14 @@ def normalize_context(raw: Any) -> Dict[str, Any]:
 
 
 class ContextBuilder:
-    def __init__(self, payload_memory: PayloadMemory, prompt_store: Optional[PromptStore] = None):
+    def __init__(self, payload_memory: PayloadMemory, prompt_store: Optional[PromptStore] = None,
+                 provider: Union[str, LLMProvider] = None, model_policy: ModelPolicy = None):
         turn_context_id = uuid.uuid4()
         self.payload_memory = payload_memory
         self.turn_context = TurnContext(id=turn_context_id)
         self.prompt_store = prompt_store or PromptStore()
+        self.provider = provider
+        self.model_policy = model_policy
 
     def format_agent_feedback(self, agent_feedback: AgentFeedback) -> Dict[str, Any]:
         return {
@@ -56,15 +61,16 @@ class ContextBuilder:
             "reasoning": agent_feedback.reasoning,
         }
 
-    def build_turn_context(self, task: str, memory: Memory, feedback: AgentFeedback = None) -> TurnContext:
+    def turn_context_prompt(self, task: str, memory: Memory, feedback: AgentFeedback = None) -> str:
+        """
+        The context prompt for the next turn. PENDING feedback only says the task is not finished yet (the
+        routing prompt still gets it), so it is left out: the prompt is then known before that feedback is.
+        """
+        if feedback is not None and feedback.status == TaskStatus.PENDING:
+            feedback = None
         mem_items = [
             {"type": m["type"], "content": m["content"]}
-            for m in memory.get_memories()
-            if (
-                    m.get("type") == "user"
-                    or (m.get("type") == "agent" and "tool" in m.get("content", ""))
-                    or (m.get("type") == "environment" and "tool_executed" in m.get("content", ""))
-            )
+            for m in memory.prompt_view("progress")
         ]
 
         prompt_values = {
@@ -73,9 +79,9 @@ class ContextBuilder:
             "feedback": self.format_agent_feedback(feedback) if feedback else None
         }
 
-        agent_context_builder_prompt = self.prompt_store.get_prompt("agent_context_builder_instruction",
-                                                                    **prompt_values)
-        res = infer_llm_json(agent_context_builder_prompt)
+        return self.prompt_store.get_prompt("agent_context_builder_instruction", **prompt_values)
+
+    def _set_turn_context(self, res: Any) -> TurnContext:
         parsed_turn_context = normalize_context(res)
 
         payload_ids = parsed_turn_context.get("payload_ids", [])
@@ -97,3 +103,20 @@ class ContextBuilder:
         )
 
         return self.turn_context
+
+    def build_turn_context(self, task: str, memory: Memory, feedback: AgentFeedback = None,
+                           prompt: str = None) -> TurnContext:
+        """`prompt`, when given, is the already rendered `turn_context_prompt` for these arguments."""
+        agent_context_builder_prompt = prompt or self.turn_context_prompt(task=task, memory=memory, feedback=feedback)
+        res = get_model_policy(self.model_policy).call("context", lambda step: infer_llm_json(
+            agent_context_builder_prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout,
+            provider=self.provider, call_site="context", validator=normalize_context))
+        return self._set_turn_context(res)
+
+    async def abuild_turn_context(self, task: str, memory: Memory, feedback: AgentFeedback = None,
+                                  prompt: str = None) -> TurnContext:
+        agent_context_builder_prompt = prompt or self.turn_context_prompt(task=task, memory=memory, feedback=feedback)
+        res = await get_model_policy(self.model_policy).acall("context", lambda step: ainfer_llm_json(
+            agent_context_builder_prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout,
+            provider=self.provider, call_site="context", validator=normalize_context))
+        return self._set_turn_context(res)
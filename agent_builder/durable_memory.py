@@ -0,0 +1,293 @@
+import bisect
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from dataclasses import asdict, replace
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from agent_builder.memory_builder import CompactionPolicy, Memory, MemorySummary, classify_memory
+
+DEFAULT_MEMORY_PATH = Path(__file__).resolve().parent.parent / ".cache" / "memory.sqlite"
+
+
+class _PagedEntries(Sequence):
+    """
+    The entries of a `SqliteMemory` session, read on demand: the last `tail_size` entries stay resident,
+    older ones are loaded a page of `page_size` entries at a time and at most `max_pages` pages are kept
+    (least recently used are dropped). Slices and iteration stream from the database without caching.
+    """
+
+    def __init__(self, memory: "SqliteMemory", count: int, tail: List[Dict], tail_size: int, page_size: int,
+                 max_pages: int):
+        self._memory = memory
+        self._count = count
+        self._tail = deque(tail, maxlen=tail_size)
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._pages: "OrderedDict[int, List[Dict]]" = OrderedDict()
+        self.stats = {"tail_hits": 0, "page_hits": 0, "page_loads": 0}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _tail_start(self) -> int:
+        return self._count - len(self._tail)
+
+    def _page(self, page: int) -> List[Dict]:
+        entries = self._pages.get(page)
+        if entries is not None:
+            self._pages.move_to_end(page)
+            self.stats["page_hits"] += 1
+            return entries
+        start = page * self.page_size
+        entries = self._memory._read_range(start, start + self.page_size)
+        self.stats["page_loads"] += 1
+        # A page still being filled would go stale: only complete pages are kept.
+        if len(entries) == self.page_size:
+            self._pages[page] = entries
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return entries
+
+    def __getitem__(self, index):
+        with self._memory._db_lock:
+            if isinstance(index, slice):
+                start, stop, step = index.indices(self._count)
+                if step != 1:
+                    return [self[i] for i in range(start, stop, step)]
+                return self._slice(start, stop)
+            if index < 0:
+                index += self._count
+            if not 0 <= index < self._count:
+                raise IndexError("memory index out of range")
+            tail_start = self._tail_start()
+            if index >= tail_start:
+                self.stats["tail_hits"] += 1
+                return self._tail[index - tail_start]
+            return self._page(index // self.page_size)[index % self.page_size]
+
+    def _slice(self, start: int, stop: int) -> List[Dict]:
+        if start >= stop:
+            return []
+        tail_start = self._tail_start()
+        head = self._memory._read_range(start, min(stop, tail_start)) if start < tail_start else []
+        tail = [self._tail[i - tail_start] for i in range(max(start, tail_start), stop)]
+        return head + tail
+
+    def __iter__(self) -> Iterator[Dict]:
+        position, count = 0, self._count
+        while position < count:
+            stop = min(position + self.page_size, count)
+            yield from self[position:stop]
+            position = stop
+
+    def append(self, entry: Dict):
+        with self._memory._db_lock:
+            self._memory._write_entry(self._count, entry)
+            self._tail.append(entry)
+            self._count += 1
+
+    def resident(self) -> int:
+        return len(self._tail) + sum(len(entries) for entries in self._pages.values())
+
+
+class _OverlayEntries(Sequence):
+    """
+    Entries of a sub-agent copy: the session entries at `positions` of a `_PagedEntries`, read through its
+    page cache, followed by the entries appended to the copy, which stay in process.
+    """
+
+    def __init__(self, source: _PagedEntries, positions: List[int]):
+        self._source = source
+        self.positions = positions
+        self.overlay: List[Dict] = []
+
+    def __len__(self) -> int:
+        return len(self.positions) + len(self.overlay)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("memory index out of range")
+        if index < len(self.positions):
+            return self._source[self.positions[index]]
+        return self.overlay[index - len(self.positions)]
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, entry: Dict):
+        self.overlay.append(entry)
+
+    def resident(self) -> int:
+        return len(self.overlay)
+
+
+class _SubAgentMemory(Memory):
+    """
+    Copy of a `SqliteMemory` handed to a sub-agent (see `SqliteMemory.copy_without_system_memories`). The
+    session's entries are not loaded: they are read through the session's bounded page cache and indexed
+    from the stored classification. What the sub-agent adds is kept in process and never persisted.
+    """
+
+    def __init__(self, session: "SqliteMemory", positions: List[int], compaction: CompactionPolicy = None):
+        super().__init__(compaction=compaction)
+        self._session = session
+        self.items = _OverlayEntries(session.items, positions)
+
+    def _classify_from(self, start: int) -> Iterator[Tuple[int, str, str]]:
+        positions = self.items.positions
+        if start < len(positions):
+            position = start
+            for seq, entry_type, kind in self._session._stored_classification(positions[start], positions[-1] + 1):
+                if seq == positions[position]:
+                    yield position, entry_type, kind
+                    position += 1
+        for position in range(max(start, len(positions)), len(self.items)):
+            item = self.items[position]
+            yield position, item.get("type"), classify_memory(item)
+
+    def residency(self) -> Dict[str, Any]:
+        """Entries of the copy and those it holds in process (the session's page cache is not counted)."""
+        return {"entries": len(self.items), "resident": self.items.resident()}
+
+
+class SqliteMemory(Memory):
+    """
+    `Memory` persisted in a sqlite database (WAL journal) as an append-only log of entries per session.
+    Creating one for an existing `session_id` restores the session: only the entry count, the last
+    `tail_size` entries and the summaries are read, older entries are paged in when accessed (see
+    `_PagedEntries`) and the type / kind index is rebuilt from the stored classification, without loading
+    the entries. Residency is thus bounded by `tail_size + max_pages * page_size` entries however long the
+    conversation gets. Entries must be JSON serializable (other values are stored as strings).
+
+    One writer per session: the entry count is kept in process, so two processes appending to the same
+    session would overwrite each other's entries.
+    """
+
+    def __init__(self, path: str = None, session_id: str = "default", compaction: CompactionPolicy = None,
+                 tail_size: int = 256, page_size: int = 128, max_pages: int = 8):
+        super().__init__(compaction=compaction)
+        self.path = str(path or DEFAULT_MEMORY_PATH)
+        self.session_id = session_id
+        # One lock for the index and the connection: indexing reads the database.
+        self._lock = self._db_lock = threading.RLock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory_entries ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, type TEXT, kind TEXT, entry TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, seq))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory_summaries ("
+            "session_id TEXT NOT NULL, idx INTEGER NOT NULL, summary TEXT NOT NULL, PRIMARY KEY (session_id, idx))"
+        )
+        self._conn.commit()
+        self.items = self._restore(tail_size, page_size, max_pages)
+
+    def _restore(self, tail_size: int, page_size: int, max_pages: int) -> _PagedEntries:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT MAX(seq) FROM memory_entries WHERE session_id = ?", (self.session_id,)).fetchone()
+            count = 0 if row[0] is None else row[0] + 1
+            rows = self._conn.execute(
+                "SELECT entry FROM memory_entries WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+                (self.session_id, tail_size)).fetchall()
+            tail = [json.loads(entry) for (entry,) in reversed(rows)]
+            summaries = self._conn.execute(
+                "SELECT summary FROM memory_summaries WHERE session_id = ? ORDER BY idx", (self.session_id,))
+            self.summaries = [MemorySummary(**json.loads(summary)) for (summary,) in summaries]
+        return _PagedEntries(self, count, tail, tail_size, page_size, max_pages)
+
+    def _read_range(self, start: int, stop: int) -> List[Dict]:
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT entry FROM memory_entries WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (self.session_id, start, stop)).fetchall()
+        return [json.loads(entry) for (entry,) in rows]
+
+    def _write_entry(self, seq: int, entry: Dict):
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO memory_entries (session_id, seq, type, kind, entry) VALUES (?, ?, ?, ?, ?)",
+                (self.session_id, seq, entry.get("type"), classify_memory(entry),
+                 json.dumps(entry, ensure_ascii=False, default=str)))
+            self._conn.commit()
+
+    def _stored_classification(self, start: int, stop: int) -> List[Tuple[int, str, str]]:
+        """(seq, type, kind) of the entries from `start` to `stop`, as stored when they were written."""
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT seq, type, kind FROM memory_entries WHERE session_id = ? AND seq >= ? AND seq < ? "
+                "ORDER BY seq", (self.session_id, start, stop)).fetchall()
+
+    def _classify_from(self, start: int) -> Iterator[Tuple[int, str, str]]:
+        yield from self._stored_classification(start, len(self.items))
+
+    def add_summary(self, summary: MemorySummary) -> bool:
+        with self._db_lock:
+            if not super().add_summary(summary):
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO memory_summaries (session_id, idx, summary) VALUES (?, ?, ?)",
+                (self.session_id, len(self.summaries) - 1, json.dumps(asdict(summary), default=str)))
+            self._conn.commit()
+            return True
+
+    def copy_without_system_memories(self) -> Memory:
+        """
+        Sub-agent copy without the system entries that reads the session's entries on demand instead of
+        loading them, so its residency stays bounded; entries the sub-agent adds are not persisted.
+        """
+        with self._db_lock:
+            count = len(self.items)
+            system = set(self.since(0, "system").ids())
+            positions = [position for position in range(count) if position not in system]
+            memory = _SubAgentMemory(self, positions, compaction=self.compaction)
+            if self.summaries:
+                until_id = bisect.bisect_left(positions, self.compacted_until)
+                memory.summaries = [replace(self.summaries[-1], until_id=until_id, entry_ids=[], previous=None)]
+        return memory
+
+    def residency(self) -> Dict[str, Any]:
+        """Entry count, entries held in process and page cache statistics."""
+        return {"entries": len(self.items), "resident": self.items.resident(), **self.items.stats}
+
+    def clear(self):
+        """Delete the session's entries and summaries."""
+        with self._db_lock:
+            self._conn.execute("DELETE FROM memory_entries WHERE session_id = ?", (self.session_id,))
+            self._conn.execute("DELETE FROM memory_summaries WHERE session_id = ?", (self.session_id,))
+            self._conn.commit()
+            items = self.items
+            self.summaries = []
+            self.items = _PagedEntries(self, 0, [], items._tail.maxlen, items.page_size, items.max_pages)
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+
+    @staticmethod
+    def sessions(path: str = None) -> List[str]:
+        """Ids of the sessions stored in the database at `path`."""
+        path = str(path or DEFAULT_MEMORY_PATH)
+        if not os.path.exists(path):
+            return []
+        conn = sqlite3.connect(path)
+        try:
+            return [row[0] for row in conn.execute("SELECT DISTINCT session_id FROM memory_entries ORDER BY 1")]
+        except sqlite3.OperationalError:
+            return []
+        finally:
+            conn.close()
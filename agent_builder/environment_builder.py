@@ -1,12 +1,29 @@
 import time
 import inspect
+import contextvars
+import threading
 import traceback
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, List, Tuple
 
 from agent_builder.resource_registry import Tool, ToolContext
+from utils.cancellation import current_cancellation_token, wait_cancellable
+from utils.llm_retry import RunCancelledError
+from utils.run_budget import current_run_budget
 
 
 class Environment:
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool")
+            return self._executor
+
     def __has_named_parameter(self, func, param_name: str) -> bool:
         """
         Check if a function has a parameter with the given name.
@@ -26,6 +43,25 @@ class Environment:
             return False
 
     def execute_tool(self, tool: Tool, args: dict, tool_context: ToolContext=None) -> dict:
+        """
+        Under a cancellable run, a tool is not started once the run is cancelled, and the run stops waiting
+        for a running one: the call runs on the environment's worker pool (see `result_of`). Tools that take
+        a `_cancel_token` parameter receive the run's `CancellationToken` so they can stop their own work
+        (e.g. close an HTTP request) when it is cancelled.
+        """
+        if current_cancellation_token() is None:
+            return self._execute(tool, args, tool_context)
+        return self.result_of(tool, self.submit_tool(tool, args, tool_context))
+
+    def _execute(self, tool: Tool, args: dict, tool_context: ToolContext = None) -> dict:
+        cancel_token = current_cancellation_token()
+        budget = current_run_budget()
+        exhausted = budget.exhausted() if budget is not None else None
+        if exhausted is not None:
+            return {
+                "tool_executed": False,
+                "error": f"Run budget exhausted ({exhausted}); tool not executed."
+            }
         try:
             args_copy = args.copy()
 
@@ -40,8 +76,18 @@ class Environment:
                     if self.__has_named_parameter(tool.function, param_name):
                         args_copy[param_name] = value
 
-            result = tool.execute(**args)
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled("tool", tool.name)
+                if self.__has_named_parameter(tool.function, "_cancel_token"):
+                    args_copy["_cancel_token"] = cancel_token
+
+            result = tool.execute(**args_copy)
             return self.format_result(result)
+        except RunCancelledError as e:
+            return {
+                "tool_executed": False,
+                "error": f"{e}; tool not executed to completion."
+            }
         except Exception as e:
             return {
                 "tool_executed": False,
@@ -49,6 +95,34 @@ class Environment:
                 "traceback": traceback.format_exc()
             }
 
+    def submit_tool(self, tool: Tool, args: dict, tool_context: ToolContext = None) -> Future:
+        """Start the tool call on the worker pool and return its future (see `result_of`)."""
+        return self._pool().submit(contextvars.copy_context().run, self._execute, tool, args, tool_context)
+
+    def result_of(self, tool: Tool, future: Future) -> dict:
+        """
+        Wait for a call started with `submit_tool`. A cancellation of the run stops the wait at once: a
+        call still queued never runs, one already running is left to its `_cancel_token` and its worker.
+        """
+        try:
+            return wait_cancellable("tool", tool.name, future)
+        except RunCancelledError as e:
+            return {
+                "tool_executed": False,
+                "error": f"{e}; tool not executed to completion."
+            }
+
+    def execute_tools(self, calls: List[Tuple[Tool, dict]], tool_context: ToolContext = None) -> List[dict]:
+        """
+        Execute independent tool calls concurrently on the environment's bounded worker pool
+        (`max_workers`). Results are returned in the order of `calls`.
+        """
+        if len(calls) <= 1:
+            return [self.execute_tool(tool, args, tool_context) for tool, args in calls]
+
+        futures = [self.submit_tool(tool, args, tool_context) for tool, args in calls]
+        return [self.result_of(tool, future) for (tool, _), future in zip(calls, futures)]
+
     def format_result(self, result: Any) -> dict:
         return {
             "tool_executed": True,
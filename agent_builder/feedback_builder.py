@@ -1,11 +1,13 @@
 import uuid
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Union, Tuple
 
 from agent_builder.agent_factory import AgentContext
 from agent_builder.resource_registry import ResourceRegistry, Tool
-from utils.llm_api import infer_llm_json
+from utils.llm_api import infer_llm_json, ainfer_llm_json
+from utils.llm_providers import LLMProvider
+from utils.model_policy import ModelPolicy, get_model_policy
 from utils.prompt_store import PromptStore
 
 
@@ -22,6 +24,7 @@ class AgentFeedback:
     task: str = ""
     status: TaskStatus = TaskStatus.PENDING
     reasoning: str = ""
+    source: str = "llm"
 
 
 def normalize_feedback(raw: Any) -> Dict[str, Any]:
@@ -32,7 +35,7 @@ def normalize_feedback(raw: Any) -> Dict[str, Any]:
         status_val = d.get("status")
         reasoning_val = d.get("reasoning", "")
         if not isinstance(status_val, str):
-            raise TypeError(f"'status' field must be a string, got {type(status_val)}: {status_val!r}")
+            raise ValueError(f"'status' field must be a string, got {type(status_val)}: {status_val!r}")
         try:
             status_enum = TaskStatus(status_val)
         except ValueError:
@@ -52,11 +55,65 @@ def normalize_feedback(raw: Any) -> Dict[str, Any]:
     raise ValueError(f"Could not normalize agent feedback from LLM output: {raw!r}")
 
 
+def _invoked_tool_names(action: Any) -> List[str]:
+    actions = action if isinstance(action, list) else [action]
+    return [a["tool"] for a in actions if isinstance(a, dict) and isinstance(a.get("tool"), str)]
+
+
+def failure_reason(observation: Any) -> Optional[str]:
+    """Why a tool / agent observation is a failure, or None when it is not one."""
+    if isinstance(observation, str) and observation.startswith("Failed to execute tool"):
+        return observation
+    if isinstance(observation, dict):
+        if observation.get("tool_executed") is False:
+            return observation.get("error") or "The tool raised an error."
+        if observation.get("tool") == "Error":
+            return observation.get("args", {}).get("message", "No tool chosen.")
+    return None
+
+
+def rule_based_feedback(action: Any = None, observation: Any = None,
+                        resources: ResourceRegistry = None) -> Optional[Tuple[TaskStatus, str]]:
+    """
+    Decide the feedback for turns whose outcome is mechanical, without an LLM call:
+    an unknown tool or a failed execution is FAILED, a terminal tool that ran is COMPLETED.
+    Returns (status, reasoning), or None when the outcome needs the feedback LLM.
+    """
+    names = _invoked_tool_names(action)
+    if not names:
+        return None
+
+    if resources is not None:
+        unknown = [name for name in names if resources.get_tool(name) is None]
+        if unknown:
+            return TaskStatus.FAILED, f"Unknown tool(s) {unknown}; choose one of the available tools."
+
+    observations = observation if isinstance(observation, list) else [observation]
+    failures = [reason for reason in map(failure_reason, observations) if reason]
+    if failures and len(failures) == len(observations):
+        return TaskStatus.FAILED, f"Tool execution failed: {failures[0]}"
+    if failures:
+        return None
+
+    if resources is not None and any(getattr(resources.get_tool(name), "terminal", False) for name in names):
+        return TaskStatus.COMPLETED, "A terminal tool was executed successfully; its result answers the task."
+    return None
+
+
 class FeedbackBuilder:
-    def __init__(self, prompt_store: Optional[PromptStore] = None):
+    def __init__(self, prompt_store: Optional[PromptStore] = None, provider: Union[str, LLMProvider] = None,
+                 model_policy: ModelPolicy = None, fast_path: bool = True):
+        """
+        `fast_path` decides obvious outcomes with `rule_based_feedback` and only calls the feedback LLM
+        for the remaining (ambiguous) turns.
+        """
         feedback_id = uuid.uuid4()
         self.agent_feedback = AgentFeedback(id=feedback_id)
         self.prompt_store = prompt_store or PromptStore()
+        self.provider = provider
+        self.model_policy = model_policy
+        self.fast_path = fast_path
+        self.fast_path_stats = {"rules": 0, "llm": 0}
 
     def format_tools(self, tools: List[Tool], limit=1024) -> List[Dict]:
         tools = [
@@ -87,17 +144,16 @@ class FeedbackBuilder:
     def format_action(self, action: ResourceRegistry) -> List[Dict]:
         pass
 
-    def build_agent_feedback(self, task: str, action: ResourceRegistry = None, observation: Any = None,
-                             resources: ResourceRegistry = None) -> AgentFeedback:
+    def _feedback_prompt(self, task: str, action: ResourceRegistry = None, observation: Any = None) -> str:
         prompt_values = {
             "task": task,
             "action": action,
             "observation": observation,
         }
 
-        agent_feedback_builder_prompt = self.prompt_store.get_prompt("agent_feedback_builder_instruction",
-                                                                     **prompt_values)
-        res = infer_llm_json(agent_feedback_builder_prompt)
+        return self.prompt_store.get_prompt("agent_feedback_builder_instruction", **prompt_values)
+
+    def _set_feedback(self, task: str, res: Any) -> AgentFeedback:
         parsed_agent_feedback = normalize_feedback(res)
 
         self.agent_feedback = AgentFeedback(
@@ -108,3 +164,41 @@ class FeedbackBuilder:
         )
 
         return self.agent_feedback
+
+    def _fast_feedback(self, task: str, action: Any, observation: Any,
+                       resources: ResourceRegistry) -> Optional[AgentFeedback]:
+        decision = rule_based_feedback(action=action, observation=observation,
+                                       resources=resources) if self.fast_path else None
+        if decision is None:
+            self.fast_path_stats["llm"] += 1
+            return None
+
+        self.fast_path_stats["rules"] += 1
+        status, reasoning = decision
+        self.agent_feedback = AgentFeedback(id=self.agent_feedback.id, task=task, status=status,
+                                            reasoning=reasoning, source="rules")
+        return self.agent_feedback
+
+    def build_agent_feedback(self, task: str, action: ResourceRegistry = None, observation: Any = None,
+                             resources: ResourceRegistry = None) -> AgentFeedback:
+        fast_feedback = self._fast_feedback(task, action, observation, resources)
+        if fast_feedback is not None:
+            return fast_feedback
+
+        agent_feedback_builder_prompt = self._feedback_prompt(task=task, action=action, observation=observation)
+        res = get_model_policy(self.model_policy).call("feedback", lambda step: infer_llm_json(
+            agent_feedback_builder_prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout,
+            provider=self.provider, call_site="feedback", validator=normalize_feedback))
+        return self._set_feedback(task=task, res=res)
+
+    async def abuild_agent_feedback(self, task: str, action: ResourceRegistry = None, observation: Any = None,
+                                    resources: ResourceRegistry = None) -> AgentFeedback:
+        fast_feedback = self._fast_feedback(task, action, observation, resources)
+        if fast_feedback is not None:
+            return fast_feedback
+
+        agent_feedback_builder_prompt = self._feedback_prompt(task=task, action=action, observation=observation)
+        res = await get_model_policy(self.model_policy).acall("feedback", lambda step: ainfer_llm_json(
+            agent_feedback_builder_prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout,
+            provider=self.provider, call_site="feedback", validator=normalize_feedback))
+        return self._set_feedback(task=task, res=res)
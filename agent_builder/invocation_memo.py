@@ -0,0 +1,100 @@
+import json
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from agent_builder.feedback_builder import failure_reason
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def invocation_key(invocation: Any) -> Optional[str]:
+    """
+    Key identifying a tool call ({"tool", "args"}) or an agent call ({"agent", "task"}) up to formatting:
+    whitespace in strings, argument order, None arguments and integral floats do not matter.
+    """
+    if not isinstance(invocation, dict):
+        return None
+    if isinstance(invocation.get("tool"), str):
+        call = {"tool": invocation["tool"], "args": _normalize(invocation.get("args") or {})}
+    elif isinstance(invocation.get("agent"), str):
+        call = {"agent": invocation["agent"], "task": _normalize(invocation.get("task"))}
+    else:
+        return None
+    return json.dumps(call, sort_keys=True, default=str)
+
+
+def is_memoized(observation: Any) -> bool:
+    return isinstance(observation, dict) and observation.get("memoized") is True
+
+
+class InvocationMemo:
+    """
+    Per-run memo of tool and agent calls. An identical call (see `invocation_key`) that already succeeded
+    in the run is answered from the earlier observation instead of being executed again; failed calls are
+    not memoized. `max_identical_calls` bounds how often one call may be issued in a run (None: no bound).
+    """
+
+    def __init__(self, max_identical_calls: Optional[int] = 2, stats: Dict[str, int] = None):
+        self.max_identical_calls = max_identical_calls
+        self.stats = stats if stats is not None else {"hits": 0, "limit_stops": 0}
+        self._calls = Counter()
+        self._observations: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def recall(self, invocation: Any) -> Optional[Dict[str, Any]]:
+        """Count the call; return the earlier observation, marked as memoized, when it already succeeded."""
+        key = invocation_key(invocation)
+        if key is None:
+            return None
+        with self._lock:
+            self._calls[key] += 1
+            if key not in self._observations:
+                return None
+            self.stats["hits"] += 1
+            count = self._calls[key]
+        earlier = self._observations[key]
+        marker = {
+            "memoized": True,
+            "call_count": count,
+            "note": f"Identical call already made in this run; reusing its result instead of calling it "
+                    f"again (call #{count}). Do not repeat this call.",
+        }
+        if isinstance(earlier, dict):
+            return {**earlier, **marker}
+        return {**marker, "result": earlier}
+
+    def remember(self, invocation: Any, observation: Any):
+        """Store the recorded observation of a successful call (a list of calls stores each one)."""
+        if isinstance(invocation, list) and isinstance(observation, list):
+            for single_invocation, single_observation in zip(invocation, observation):
+                self.remember(single_invocation, single_observation)
+            return
+        key = invocation_key(invocation)
+        if key is None or is_memoized(observation) or failure_reason(observation) is not None:
+            return
+        with self._lock:
+            self._observations.setdefault(key, observation)
+
+    def over_limit(self, invocation: Any) -> bool:
+        """Whether the call (or any call of a list) was issued more than `max_identical_calls` times."""
+        if self.max_identical_calls is None:
+            return False
+        invocations = invocation if isinstance(invocation, list) else [invocation]
+        keys = [key for key in map(invocation_key, invocations) if key is not None]
+        with self._lock:
+            exceeded = any(self._calls[key] > self.max_identical_calls for key in keys)
+            if exceeded:
+                self.stats["limit_stops"] += 1
+        return exceeded
@@ -1,33 +1,528 @@
+import bisect
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
 import uuid
-from typing import List, Dict, Any
+import weakref
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from collections.abc import Sequence
+from dataclasses import dataclass, field, replace
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
+
+# Named views maintained at append time: name -> entry kinds (see `classify_memory`).
+MEMORY_VIEWS = {
+    # What the plan and turn-context builders show the LLM: the tasks, the tool calls and their results.
+    "progress": ("user", "tool_call", "tool_result"),
+}
+
+
+def _structured_content(content: Any) -> List[Dict]:
+    """The records an entry's content holds: the dict (or JSON object) itself, or the dicts of a list."""
+    if isinstance(content, str):
+        if not content.lstrip().startswith(("{", "[")):
+            return []
+        try:
+            content = json.loads(content)
+        except ValueError:
+            return []
+    if isinstance(content, dict):
+        return [content]
+    if isinstance(content, list):
+        return [record for record in content if isinstance(record, dict)]
+    return []
+
+
+def classify_memory(item: Dict) -> str:
+    """
+    The kind of a memory entry, from its structured fields: an explicit "kind", else "tool_call" for an
+    agent entry whose content is a tool invocation (records with a "tool" / "tool_name"), "tool_result" for
+    an environment entry whose content is a tool execution (records with "tool_executed" / "result"), else
+    the entry's type. Free text is never classified by what it mentions.
+    """
+    entry_type = item.get("type")
+    if item.get("kind"):
+        return item["kind"]
+    if entry_type == "agent":
+        records = _structured_content(item.get("content"))
+        if any(isinstance(record.get("tool", record.get("tool_name")), str) for record in records):
+            return "tool_call"
+    elif entry_type == "environment":
+        records = _structured_content(item.get("content"))
+        if any("tool_executed" in record or "result" in record for record in records):
+            return "tool_result"
+    return entry_type
+
+
+@dataclass
+class CompactionPolicy:
+    """
+    max_tokens: estimated size of the prompt history (rolling summary plus verbatim entries of `view`)
+        above which the older entries are summarized.
+    keep_recent_tokens: the most recent entries of at most this size always stay verbatim.
+    min_entries: fewest entries worth a summarization.
+    summary_words: length limit of the rolling summary.
+    """
+    max_tokens: int = 6000
+    keep_recent_tokens: int = 2000
+    min_entries: int = 4
+    summary_words: int = 300
+    view: str = "progress"
+
+
+@dataclass
+class MemorySummary:
+    """
+    Rolling summary standing in for every entry with an id below `until_id`. Provenance: `entry_ids` are
+    the entries folded in by this summary, `previous` the index of the summary it extends, and
+    `source_tokens` / `summary_tokens` the estimated sizes it replaced and has.
+    """
+    content: str
+    until_id: int
+    entry_ids: List[int]
+    previous: Optional[int]
+    source_tokens: int
+    summary_tokens: int
+    model: str = ""
+    created_at: float = field(default_factory=time.time)
+
+
+class MemoryView(Sequence):
+    """
+    Read-only, copy-free sequence over some of a `Memory`'s entries, fixed to the entries that existed
+    when it was taken. The entries themselves are the memory's dicts and must not be modified.
+    """
+
+    def __init__(self, items: List[Dict], positions: Union[List[int], range], start: int = 0, stop: int = None):
+        self._items = items
+        self._positions = positions
+        self._start = start
+        self._stop = len(positions) if stop is None else stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return MemoryView(self._items, self._positions, self._start + start, self._start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("memory view index out of range")
+        return self._items[self._positions[self._start + index]]
+
+    def __iter__(self) -> Iterator[Dict]:
+        items, positions = self._items, self._positions
+        for i in range(self._start, self._stop):
+            yield items[positions[i]]
+
+    def ids(self) -> List[int]:
+        """Memory ids (positions in the memory) of the entries in the view."""
+        return list(self._positions[self._start:self._stop])
 
 
 class Memory:
-    def __init__(self):
+    """
+    Append-only memory of a conversation. Entries are classified once, when they are added, by type and
+    kind (see `classify_memory`) and into the named `MEMORY_VIEWS`; an entry's id is its position. Entries
+    appended to `items` directly are indexed on the next read. `view`
+    and `since` return copy-free `MemoryView`s, so consumers read only the entries they need.
+
+    With a `compaction` policy, `prompt_view` shows the latest rolling summary in place of the entries it
+    covers; the summaries are produced by `agent_builder.memory_compaction.MemoryCompactor`. The entries
+    themselves are never removed, and `summaries` keeps every summary written, oldest first.
+    """
+
+    def __init__(self, compaction: CompactionPolicy = None):
+        self.compaction = compaction
+        self.summaries: List[MemorySummary] = []
         self.items = []
+        self._index: Dict[str, List[int]] = defaultdict(list)
+        self._indexed = 0
+        self._lock = threading.Lock()
+
+    def _classify_from(self, start: int) -> Iterator[Tuple[int, str, str]]:
+        """(id, type, kind) of every entry from id `start` on."""
+        for position in range(start, len(self.items)):
+            item = self.items[position]
+            yield position, item.get("type"), classify_memory(item)
+
+    def _sync(self):
+        """Index the entries appended since the last call (also those appended to `items` directly)."""
+        with self._lock:
+            if len(self.items) < self._indexed:
+                self._index, self._indexed = defaultdict(list), 0
+            for position, entry_type, kind in self._classify_from(self._indexed):
+                self._index[entry_type].append(position)
+                if kind != entry_type:
+                    self._index[kind].append(position)
+                for name, kinds in MEMORY_VIEWS.items():
+                    if kind in kinds or entry_type in kinds:
+                        self._index[name].append(position)
+                self._indexed = position + 1
 
-    def add_memory(self, memory: dict):
+    def add_memory(self, memory: dict) -> int:
+        """Append an entry, classifying and indexing it, and return its id."""
         self.items.append(memory)
+        self._sync()
+        return len(self.items) - 1
 
     def get_memories(self, limit: int = None) -> List[Dict]:
+        """A copy of the entries; prefer `view` / `since`, which do not copy."""
         return self.items[:limit]
 
+    def cursor(self) -> int:
+        """The id the next entry will get: pass it to `since` to read only what is added from now on."""
+        return len(self.items)
+
+    def view(self, *kinds: str) -> MemoryView:
+        """
+        The entries of the given types, kinds or named views (e.g. view("progress"), view("tool_call",
+        "user")), in order; all entries when none is given.
+        """
+        return self.since(0, *kinds)
+
+    def since(self, memory_id: int, *kinds: str) -> MemoryView:
+        """Like `view`, restricted to the entries with an id of at least `memory_id`."""
+        self._sync()
+        if not kinds:
+            stop = self._indexed
+            return MemoryView(self.items, range(stop), min(max(memory_id, 0), stop), stop)
+        if len(kinds) == 1:
+            positions = self._index.get(kinds[0], [])
+        else:
+            merged = set()
+            for kind in kinds:
+                merged.update(self._index.get(kind, []))
+            positions = sorted(merged)
+        return MemoryView(self.items, positions, bisect.bisect_left(positions, memory_id), len(positions))
+
+    def last_id(self, *kinds: str) -> int:
+        """Id of the latest entry of the given types / kinds, or -1 when there is none."""
+        self._sync()
+        if not kinds:
+            return self._indexed - 1
+        return max((self._index[kind][-1] for kind in kinds if self._index.get(kind)), default=-1)
+
+    @property
+    def compacted_until(self) -> int:
+        """Id of the first entry not covered by the rolling summary (0 without one)."""
+        return self.summaries[-1].until_id if self.summaries else 0
+
+    def add_summary(self, summary: MemorySummary) -> bool:
+        """Make `summary` the rolling summary, unless another one was added since the one it extends."""
+        with self._lock:
+            if summary.previous != (len(self.summaries) - 1 if self.summaries else None):
+                return False
+            self.summaries.append(summary)
+            return True
+
+    def prompt_view(self, *kinds: str) -> List[Dict]:
+        """The entries of `view(*kinds)` for a prompt: the rolling summary followed by the entries after it."""
+        summary = [{"type": "summary", "content": self.summaries[-1].content}] if self.summaries else []
+        return summary + list(self.since(self.compacted_until, *kinds))
+
     def copy_without_system_memories(self):
-        filtered_items = [m for m in self.items if m["type"] != "system"]
-        memory = Memory()
-        memory.items = filtered_items
+        memory = Memory(compaction=self.compaction)
+        memory.items = [m for m in self.items if m["type"] != "system"]
+        if self.summaries:
+            until_id = sum(1 for m in self.items[:self.compacted_until] if m["type"] != "system")
+            memory.summaries = [replace(self.summaries[-1], until_id=until_id, entry_ids=[], previous=None)]
         return memory
 
 
+def _serialize_payload(payload: Any) -> bytes:
+    """Canonical serialization of a payload: key order and formatting do not change it."""
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class _CompressedPayload:
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
 class PayloadMemory:
-    def __init__(self):
-        self.items = {}
+    """
+    Store of large tool results, referenced from memory entries by payload id.
+
+    Payloads are stored as their canonical JSON serialization and accounted by its size; every retrieval
+    returns a fresh copy (the JSON round trip), wherever the payload is kept. The resident ones (`items`)
+    are kept in LRU order within `max_bytes`; the least recently used are spilled to a sqlite file
+    (`spill_path`, by default a temporary file removed by `close`) and loaded back when retrieved. A
+    payload larger than `max_bytes` goes straight to disk. Payloads whose serialization exceeds
+    `compress_threshold` bytes are kept zlib-compressed, in RAM and on disk, and accounted by their
+    compressed size.
+
+    With `content_addressed`, a payload's id is the hash of its canonical serialization: adding a payload
+    equal to a stored one stores nothing and returns the stored payload's id.
+
+    The agent registers which payloads each `Memory` references (`add_references`, or the `holder` of
+    `add_payload`; `share_references` for the memory copies given to sub-agents). A payload that is not
+    referenced, because it never was or because its last referencing memory was garbage collected or
+    released (`release`), is reclaimed from RAM and disk once it has stayed so for `orphan_grace` seconds,
+    which leaves time for a sub-agent's payloads to be referenced by the invoking agent's memory. The
+    reclamation runs on a timer, so memory is freed also when no more payloads are added. `stats`
+    reports the occupancy.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = 64 * 1024 * 1024, spill_path: str = None,
+                 orphan_grace: float = 60.0, content_addressed: bool = False,
+                 compress_threshold: Optional[int] = 32 * 1024):
+        self.max_bytes = max_bytes
+        self.content_addressed = content_addressed
+        self.compress_threshold = compress_threshold
+        self.spill_path = spill_path
+        self.orphan_grace = orphan_grace
+        self.items: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._spilled: Dict[str, int] = {}
+        self._refs: Dict[str, int] = {}
+        self._orphaned: Dict[str, float] = {}
+        self._holders: "weakref.WeakKeyDictionary[Any, Counter]" = weakref.WeakKeyDictionary()
+        self._finalizers: Dict[int, weakref.finalize] = {}
+        self.resident_bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "spills": 0, "spill_reads": 0, "reclaimed": 0,
+                         "reclaimed_bytes": 0, "added": 0, "added_bytes": 0, "dedup_hits": 0,
+                         "dedup_bytes_saved": 0, "compressed": 0, "compressed_bytes_saved": 0}
+        self._lock = threading.RLock()
+        self._conn = None
+        self._temporary_spill = None
+        self._collector: Optional[threading.Timer] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if not self.spill_path:
+                fd, self.spill_path = tempfile.mkstemp(prefix="payloads-", suffix=".sqlite")
+                os.close(fd)
+                self._temporary_spill = self.spill_path
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.spill_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS payloads ("
+                "id TEXT PRIMARY KEY, data BLOB NOT NULL, compressed INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _write(self, payload_id: str, payload: Union[bytes, _CompressedPayload]):
+        compressed = isinstance(payload, _CompressedPayload)
+        data = payload.data if compressed else payload
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO payloads (id, data, compressed) VALUES (?, ?, ?)",
+                     (payload_id, data, int(compressed)))
+        conn.commit()
+        self._spilled[payload_id] = self._sizes[payload_id]
+        self.counters["spills"] += 1
+
+    def _spill(self, payload_id: str, payload: Union[bytes, _CompressedPayload]):
+        """Move a resident payload to disk (its disk copy is kept when it was loaded from there)."""
+        if payload_id not in self._spilled:
+            self._write(payload_id, payload)
+        del self.items[payload_id]
+        self.resident_bytes -= self._sizes[payload_id]
 
-    def add_payload(self, payload: Any):
-        payload_id = str(uuid.uuid4())
+    def _admit(self, payload_id: str, payload: Union[bytes, _CompressedPayload]):
+        """Make the payload resident (most recently used), spilling others to stay within `max_bytes`."""
+        size = self._sizes[payload_id]
+        if self.max_bytes is not None and size > self.max_bytes:
+            if payload_id not in self._spilled:
+                self._write(payload_id, payload)
+            return
         self.items[payload_id] = payload
+        self.resident_bytes += size
+        while self.max_bytes is not None and self.resident_bytes > self.max_bytes:
+            lru_id, lru_payload = next(iter(self.items.items()))
+            self._spill(lru_id, lru_payload)
+
+    def add_payload(self, payload: Any, holder: Any = None):
+        """
+        Store `payload` and return its id. With a `holder` (a `Memory`) the reference is registered at once;
+        otherwise the payload is reclaimed unless referenced within `orphan_grace` seconds.
+        """
+        serialized = _serialize_payload(payload)
+        if self.content_addressed:
+            payload_id = hashlib.sha256(serialized).hexdigest()[:32]
+        else:
+            payload_id = str(uuid.uuid4())
+        with self._lock:
+            self.collect()
+            self.counters["added"] += 1
+            self.counters["added_bytes"] += len(serialized)
+            if payload_id in self._sizes:
+                self.counters["dedup_hits"] += 1
+                self.counters["dedup_bytes_saved"] += len(serialized)
+                if payload_id in self.items:
+                    self.items.move_to_end(payload_id)
+            else:
+                self._store(payload_id, serialized)
+            # Within the lock of the lookup, so that the payload cannot be reclaimed before it is referenced.
+            if holder is not None:
+                self.add_references(holder, [payload_id])
+            elif payload_id not in self._refs:
+                self._orphan(payload_id)
         return payload_id
 
+    def _store(self, payload_id: str, serialized: bytes):
+        stored, size = serialized, len(serialized)
+        if self.compress_threshold is not None and len(serialized) > self.compress_threshold:
+            data = zlib.compress(serialized)
+            if len(data) < len(serialized):
+                stored, size = _CompressedPayload(data), len(data)
+                self.counters["compressed"] += 1
+                self.counters["compressed_bytes_saved"] += len(serialized) - len(data)
+        self._sizes[payload_id] = size
+        self._admit(payload_id, stored)
+
     def retrieve_payload(self, payload_id: str):
-        result = self.items.get(payload_id.strip(), None)
-        return result
\ No newline at end of file
+        payload_id = payload_id.strip()
+        with self._lock:
+            if payload_id in self.items:
+                self.items.move_to_end(payload_id)
+                self.counters["hits"] += 1
+                stored = self.items[payload_id]
+            elif payload_id in self._spilled:
+                data, compressed = self._connection().execute(
+                    "SELECT data, compressed FROM payloads WHERE id = ?", (payload_id,)).fetchone()
+                self.counters["spill_reads"] += 1
+                stored = _CompressedPayload(data) if compressed else data
+                self._admit(payload_id, stored)
+            else:
+                self.counters["misses"] += 1
+                return None
+        return json.loads(zlib.decompress(stored.data) if isinstance(stored, _CompressedPayload) else stored)
+
+    def add_references(self, holder: Any, payload_ids: List[str]):
+        """Record that `holder` (a `Memory`) references the payloads, until it is garbage collected or released."""
+        with self._lock:
+            payload_ids = [p.strip() for p in payload_ids if isinstance(p, str) and p.strip() in self._sizes]
+            if not payload_ids:
+                return
+            counts = self._holders.get(holder)
+            if counts is None:
+                counts = self._holders[holder] = Counter()
+                self._finalizers[id(holder)] = weakref.finalize(holder, self._release_counts, counts, id(holder))
+            for payload_id in payload_ids:
+                counts[payload_id] += 1
+                self._refs[payload_id] = self._refs.get(payload_id, 0) + 1
+                self._orphaned.pop(payload_id, None)
+
+    def share_references(self, source: Any, holder: Any):
+        """Let `holder` (e.g. a sub-agent's copy of `source`) reference every payload `source` references."""
+        with self._lock:
+            counts = self._holders.get(source)
+            if counts:
+                self.add_references(holder, list(counts))
+
+    def release(self, holder: Any):
+        """Drop every reference `holder` holds, e.g. once a conversation's memory is discarded."""
+        with self._lock:
+            counts = self._holders.pop(holder, None)
+            finalizer = self._finalizers.get(id(holder))
+            if finalizer is not None:
+                finalizer.detach()
+            if counts is not None:
+                self._release_counts(counts, id(holder))
+
+    def _release_counts(self, counts: Counter, holder_id: int):
+        with self._lock:
+            self._finalizers.pop(holder_id, None)
+            now = time.monotonic()
+            for payload_id, count in counts.items():
+                if payload_id not in self._refs:
+                    continue
+                self._refs[payload_id] -= count
+                if self._refs[payload_id] <= 0:
+                    del self._refs[payload_id]
+                    self._orphan(payload_id, now)
+
+    def _orphan(self, payload_id: str, now: float = None):
+        """Start (or restart) the grace period of an unreferenced payload and make sure a collection follows."""
+        self._orphaned[payload_id] = time.monotonic() if now is None else now
+        self._schedule_collection()
+
+    def _schedule_collection(self):
+        with self._lock:
+            if self._collector is not None or not self._orphaned:
+                return
+            delay = max(min(self._orphaned.values()) + self.orphan_grace - time.monotonic(), 0.0)
+            self._collector = threading.Timer(delay, self._collect_scheduled)
+            self._collector.daemon = True
+            self._collector.start()
+
+    def _collect_scheduled(self):
+        with self._lock:
+            self._collector = None
+            self.collect()
+            self._schedule_collection()
+
+    def _discard(self, payload_id: str):
+        size = self._sizes.pop(payload_id, 0)
+        if self.items.pop(payload_id, None) is not None:
+            self.resident_bytes -= size
+        if self._spilled.pop(payload_id, None) is not None:
+            self._conn.execute("DELETE FROM payloads WHERE id = ?", (payload_id,))
+            self._conn.commit()
+        self.counters["reclaimed"] += 1
+        self.counters["reclaimed_bytes"] += size
+
+    def collect(self, grace: float = None) -> int:
+        """Reclaim the payloads unreferenced for at least `grace` seconds (`orphan_grace` by default)."""
+        grace = self.orphan_grace if grace is None else grace
+        with self._lock:
+            cutoff = time.monotonic() - grace
+            expired = [payload_id for payload_id, since in self._orphaned.items() if since <= cutoff]
+            for payload_id in expired:
+                del self._orphaned[payload_id]
+                self._discard(payload_id)
+            return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Occupancy and counters. `dedup_ratio` is the share of added payloads that were duplicates,
+        `compression_savings` the share of the serialized bytes of the stored payloads saved by compression.
+        """
+        with self._lock:
+            unique_bytes = self.counters["added_bytes"] - self.counters["dedup_bytes_saved"]
+            return {
+                "payloads": len(self._sizes),
+                "resident": len(self.items),
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "spilled": len(self._spilled),
+                "spilled_bytes": sum(self._spilled.values()),
+                "referenced": len(self._refs),
+                "orphaned": len(self._orphaned),
+                **self.counters,
+                "dedup_ratio": round(self.counters["dedup_hits"] / self.counters["added"], 4)
+                if self.counters["added"] else 0.0,
+                "compression_savings": round(self.counters["compressed_bytes_saved"] / unique_bytes, 4)
+                if unique_bytes else 0.0,
+            }
+
+    def close(self):
+        """Close the spill file; a temporary one is removed, together with the payloads spilled to it."""
+        with self._lock:
+            if self._collector is not None:
+                self._collector.cancel()
+                self._collector = None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            if self._temporary_spill:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(self._temporary_spill + suffix):
+                        os.remove(self._temporary_spill + suffix)
+                for payload_id in self._spilled:
+                    self._sizes.pop(payload_id, None)
+                self._spilled.clear()
+                self._temporary_spill = self.spill_path = None
@@ -0,0 +1,138 @@
+import contextvars
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Dict, List, Optional, Tuple, Union
+from weakref import WeakKeyDictionary
+
+from agent_builder.memory_builder import Memory, MemorySummary
+from utils.llm_api import infer_llm_generation, is_llm_error
+from utils.llm_providers import LLMProvider
+from utils.llm_tokens import count_tokens
+from utils.model_policy import ModelPolicy, get_model_policy
+from utils.prompt_store import PromptStore
+from utils.token_ledger import ledger_scope
+
+
+def _prompt_entry(item: Dict) -> Dict[str, Any]:
+    return {"type": item["type"], "content": item["content"]}
+
+
+class MemoryCompactor:
+    """
+    Applies a memory's `CompactionPolicy`. Once the estimated size of its prompt history (rolling summary
+    plus verbatim entries) crosses `max_tokens`, the verbatim entries older than the most recent
+    `keep_recent_tokens` are folded into the rolling summary by the "compaction" step, on a background
+    thread. The prompts use the verbatim entries until the new summary has been written.
+    """
+
+    def __init__(self, provider: Union[str, LLMProvider] = None, model_policy: ModelPolicy = None,
+                 prompt_store: PromptStore = None):
+        self.provider = provider
+        self.model_policy = model_policy
+        self.prompt_store = prompt_store or PromptStore()
+        self.stats = {"compactions": 0, "entries_compacted": 0, "tokens_compacted": 0, "summary_tokens": 0,
+                      "failures": 0}
+        self._executor = None
+        self._pending: "WeakKeyDictionary[Memory, Future]" = WeakKeyDictionary()
+        self._tokens: "WeakKeyDictionary[Memory, Dict[int, int]]" = WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-compaction")
+        return self._executor
+
+    def _entry_tokens(self, memory: Memory, memory_id: int, item: Dict) -> int:
+        cache = self._tokens.setdefault(memory, {})
+        if memory_id not in cache:
+            cache[memory_id] = count_tokens(json.dumps(_prompt_entry(item), default=str))
+        return cache[memory_id]
+
+    def history_tokens(self, memory: Memory) -> int:
+        """Estimated size of what `memory.prompt_view` puts in a prompt."""
+        view = memory.since(memory.compacted_until, memory.compaction.view if memory.compaction else "progress")
+        summary_tokens = memory.summaries[-1].summary_tokens if memory.summaries else 0
+        return summary_tokens + sum(self._entry_tokens(memory, i, item) for i, item in zip(view.ids(), view))
+
+    def _segment(self, memory: Memory) -> Optional[Tuple[List[int], List[Dict], int]]:
+        """The verbatim entries to fold into the summary (ids, entries, tokens), or None when under the threshold."""
+        policy = memory.compaction
+        view = memory.since(memory.compacted_until, policy.view)
+        ids = view.ids()
+        tokens = [self._entry_tokens(memory, i, item) for i, item in zip(ids, view)]
+        summary_tokens = memory.summaries[-1].summary_tokens if memory.summaries else 0
+        if summary_tokens + sum(tokens) <= policy.max_tokens:
+            return None
+
+        cut, recent = len(ids), 0
+        while cut > 0 and recent + tokens[cut - 1] <= policy.keep_recent_tokens:
+            cut -= 1
+            recent += tokens[cut]
+        if cut < policy.min_entries:
+            return None
+        return ids[:cut], list(view[:cut]), sum(tokens[:cut])
+
+    def maybe_compact(self, memory: Memory, session_id: str = None) -> Optional[Future]:
+        """
+        Start a background compaction of `memory` when its policy calls for one. Returns the future of the
+        compaction in progress, if any.
+        """
+        if memory.compaction is None:
+            return None
+        with self._lock:
+            pending = self._pending.get(memory)
+            if pending is not None and not pending.done():
+                return pending
+            segment = self._segment(memory)
+            if segment is None:
+                return None
+            # A fresh context: the compaction belongs to the session, not to the run budget or cancellation
+            # of the run that happened to trigger it.
+            future = self._pool().submit(contextvars.Context().run, self._compact, memory, session_id, *segment)
+            self._pending[memory] = future
+            return future
+
+    def _compact(self, memory: Memory, session_id: Optional[str], entry_ids: List[int], entries: List[Dict],
+                 source_tokens: int) -> Optional[MemorySummary]:
+        previous_index = len(memory.summaries) - 1 if memory.summaries else None
+        previous = memory.summaries[previous_index] if previous_index is not None else None
+        prompt = self.prompt_store.get_prompt("memory_compaction_instruction",
+                                              max_words=memory.compaction.summary_words,
+                                              previous_summary=previous.content if previous else "",
+                                              memory=[_prompt_entry(item) for item in entries])
+        models = []
+
+        def summarize(step):
+            models.append(step.model)
+            return infer_llm_generation(prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout,
+                                        provider=self.provider, call_site="compaction")
+
+        with ledger_scope(session_id=session_id, agent="memory-compaction"):
+            content = get_model_policy(self.model_policy).call("compaction", summarize)
+        if is_llm_error(content) or not isinstance(content, str) or not content.strip():
+            with self._lock:
+                self.stats["failures"] += 1
+            print(f"[WARN] memory compaction failed; keeping the entries verbatim: {content}")
+            return None
+
+        content = content.strip()
+        summary = MemorySummary(
+            content=content,
+            until_id=entry_ids[-1] + 1,
+            entry_ids=entry_ids,
+            previous=previous_index,
+            source_tokens=source_tokens + (previous.summary_tokens if previous is not None else 0),
+            summary_tokens=count_tokens(content),
+            model=models[-1] if models else "",
+        )
+        if not memory.add_summary(summary):
+            return None
+        with self._lock:
+            self.stats["compactions"] += 1
+            self.stats["entries_compacted"] += len(entry_ids)
+            self.stats["tokens_compacted"] += source_tokens
+            self.stats["summary_tokens"] += summary.summary_tokens
+        print(f"[INFO] memory compacted: {len(entry_ids)} entries ({summary.source_tokens} tokens) "
+              f"-> {summary.summary_tokens}-token summary")
+        return summary
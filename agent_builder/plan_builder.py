@@ -1,12 +1,16 @@
+import ast
 import json
+import re
 import uuid
-from dataclasses import dataclass, field
-from typing import Any, Optional, Dict, List
+from dataclasses import dataclass, field, replace
+from typing import Any, Optional, Dict, List, Union, Tuple
 
 from agent_builder.agent_factory import AgentContext
 from agent_builder.memory_builder import Memory
 from agent_builder.resource_registry import ResourceRegistry, Tool
-from utils.llm_api import infer_llm_json
+from utils.llm_api import infer_llm_json, ainfer_llm_json
+from utils.llm_providers import LLMProvider
+from utils.model_policy import ModelPolicy, get_model_policy
 from utils.prompt_store import PromptStore
 
 
@@ -17,6 +21,202 @@ class Plan:
     plan: Any = field(default=None)
 
 
+@dataclass
+class PlanStep:
+    """
+    A plan step resolved against the resource registry. `tool` (or `agent`) and `args` are set only when
+    the step is a concrete call of a registered tool / sub-agent with complete arguments; otherwise
+    `reason` says why it is not. Argument values of the form "$<id>" refer to the result of a step
+    listed in `depends_on`.
+    """
+    action: Any
+    description: str = ""
+    id: str = ""
+    depends_on: List[str] = field(default_factory=list)
+    tool: Optional[str] = None
+    agent: Optional[str] = None
+    args: Optional[Dict[str, Any]] = None
+    reason: str = ""
+
+    @property
+    def executable(self) -> bool:
+        return self.tool is not None or self.agent is not None
+
+
+_CALL_PATTERN = re.compile(r"^\s*[A-Za-z_][\w.]*\s*\(.*\)\s*$", re.DOTALL)
+_PLACEHOLDER_PATTERN = re.compile(r"^\s*(<.*>|\{.*\}|\$\w+|\.\.\.|tbd|unknown|n/a)\s*$", re.IGNORECASE | re.DOTALL)
+_REFERENCE_PATTERN = re.compile(r"^\$\{?([\w-]+)\}?$")
+_CALL_NAME_PATTERN = re.compile(r"^\s*([A-Za-z_][\w.]*)\s*\(")
+_JSON_TYPES = {"string": str, "integer": int, "number": (int, float), "boolean": bool, "array": list,
+               "object": dict}
+
+
+def _parse_call(action: Any) -> Tuple[Optional[str], Optional[Dict[str, Any]], str]:
+    """Read (tool_name, args, reason) from a `tool(key=value, ...)` string or a {"tool", "args"} dict."""
+    if isinstance(action, dict):
+        name = action.get("tool") or action.get("name")
+        args = action.get("args", action.get("arguments", action.get("parameters", {})))
+        if not isinstance(name, str) or not isinstance(args, dict):
+            return None, None, "action is not a tool call"
+        return name, args, ""
+
+    if not isinstance(action, str) or not _CALL_PATTERN.match(action):
+        return None, None, "action is not a tool call"
+    try:
+        call = ast.parse(action.strip(), mode="eval").body
+    except SyntaxError:
+        return None, None, "action is not a valid call expression"
+    if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Name):
+        return None, None, "action is not a tool call"
+    if call.args or any(keyword.arg is None for keyword in call.keywords):
+        return None, None, "positional or unpacked arguments"
+    try:
+        args = {keyword.arg: ast.literal_eval(keyword.value) for keyword in call.keywords}
+    except ValueError:
+        return None, None, "arguments are not literals"
+    return call.func.id, args, ""
+
+
+def action_resource_name(action: Any) -> Optional[str]:
+    """Name of the tool / agent a step's action calls, also when its arguments are incomplete."""
+    if isinstance(action, dict):
+        name = action.get("tool") or action.get("name")
+        return name if isinstance(name, str) else None
+    match = _CALL_NAME_PATTERN.match(action) if isinstance(action, str) else None
+    return match.group(1) if match else None
+
+
+def step_reference(value: Any) -> Optional[str]:
+    """The step id referenced by an argument value such as "$2" / "${fetch}", else None."""
+    match = _REFERENCE_PATTERN.match(value) if isinstance(value, str) else None
+    return match.group(1) if match else None
+
+
+def _invalid_args(args: Dict[str, Any], parameters: Dict[str, Any], depends_on: List[str] = ()) -> str:
+    properties = (parameters or {}).get("properties", {})
+    missing = [name for name in (parameters or {}).get("required", []) if name not in args]
+    if missing:
+        return f"missing required arguments {missing}"
+    unknown = [name for name in args if properties and name not in properties]
+    if unknown:
+        return f"unknown arguments {unknown}"
+    for name, value in args.items():
+        if step_reference(value) in depends_on:
+            continue
+        if isinstance(value, str) and _PLACEHOLDER_PATTERN.match(value):
+            return f"argument {name!r} is a placeholder"
+        expected = _JSON_TYPES.get(properties.get(name, {}).get("type"))
+        if expected and (not isinstance(value, expected) or (expected is not bool and isinstance(value, bool))):
+            return f"argument {name!r} does not match its schema"
+    return ""
+
+
+def resolve_plan_steps(plan: Plan, resources: ResourceRegistry) -> List[PlanStep]:
+    """
+    Resolve every step of a structured plan against `resources`. Plans written as free text have no
+    resolvable steps.
+    """
+    raw_steps = plan.plan if isinstance(plan.plan, list) else []
+    step_ids = {str(raw_step.get("id")) for raw_step in raw_steps if isinstance(raw_step, dict)}
+    steps = []
+    for i, raw_step in enumerate(raw_steps):
+        if not isinstance(raw_step, dict):
+            steps.append(PlanStep(action=raw_step, id=str(i + 1), reason="step is not an object"))
+            continue
+        action = raw_step.get("action")
+        step = PlanStep(action=action, description=raw_step.get("description", ""),
+                        id=str(raw_step.get("id", i + 1)), depends_on=[str(d) for d in raw_step.get("depends_on", [])])
+        name, args, step.reason = _parse_call(action)
+        unknown_dependencies = [d for d in step.depends_on if d not in step_ids]
+        if unknown_dependencies:
+            step.reason = f"unknown dependencies {unknown_dependencies}"
+        elif name is not None and resources.get_agent(name) is not None:
+            step.reason = _invalid_args(args, {"properties": {"task": {"type": "string"}}, "required": ["task"]},
+                                        step.depends_on)
+            if not step.reason:
+                step.agent, step.args = name, args
+        elif name is not None:
+            tool = resources.get_tool(name)
+            if tool is None:
+                step.reason = f"unknown tool {name!r}"
+            else:
+                step.reason = _invalid_args(args, tool.parameters, step.depends_on)
+                if not step.reason:
+                    step.tool, step.args = name, args
+        steps.append(step)
+    return steps
+
+
+def order_plan_steps(steps: List[PlanStep]) -> Optional[List[PlanStep]]:
+    """Topological order of the step graph (stable w.r.t. plan order), or None when it has a cycle."""
+    remaining = {step.id: set(step.depends_on) for step in steps}
+    ordered = []
+    while remaining:
+        ready = [step for step in steps if step.id in remaining and not remaining[step.id]]
+        if not ready:
+            return None
+        for step in ready:
+            del remaining[step.id]
+            ordered.append(step)
+        for dependencies in remaining.values():
+            dependencies.difference_update(step.id for step in ready)
+    return ordered
+
+
+def sequential_plan_steps(steps: List[PlanStep]) -> List[PlanStep]:
+    """
+    Replace the step graph by a chain in plan order: each step depends on the previous one and keeps its
+    dependencies on earlier steps, so its "$<id>" arguments still bind. A step whose arguments refer to a
+    later step cannot be bound, and is made non-executable.
+    """
+    chained, earlier = [], set()
+    for i, step in enumerate(steps):
+        depends_on = [d for d in step.depends_on if d in earlier]
+        if i and steps[i - 1].id not in depends_on:
+            depends_on.append(steps[i - 1].id)
+        step = replace(step, depends_on=depends_on)
+        references = [step_reference(value) for value in (step.args or {}).values()]
+        unbound = [ref for ref in references if ref is not None and ref not in earlier]
+        if step.executable and unbound:
+            step = replace(step, tool=None, agent=None, args=None,
+                           reason=f"arguments refer to steps {unbound}, which do not run before it")
+        chained.append(step)
+        earlier.add(step.id)
+    return chained
+
+
+def critical_path(steps: List[PlanStep], durations: Dict[str, float]) -> Tuple[float, List[str]]:
+    """Longest duration-weighted dependency chain through the steps in `durations` (topologically ordered)."""
+    finish: Dict[str, Tuple[float, List[str]]] = {}
+    for step in steps:
+        if step.id not in durations:
+            continue
+        before = max((finish[d] for d in step.depends_on if d in finish), key=lambda f: f[0], default=(0.0, []))
+        finish[step.id] = (before[0] + durations[step.id], before[1] + [step.id])
+    return max(finish.values(), key=lambda f: f[0], default=(0.0, []))
+
+
+def _normalize_step_graph(plan: List[Any]) -> List[Any]:
+    """
+    Give every step of a structured plan a string `id` and a `depends_on` list. Plans that declare no
+    dependencies at all keep their sequential meaning: each step depends on the previous one.
+    """
+    steps = [dict(step) if isinstance(step, dict) else step for step in plan]
+    declared = any(isinstance(step, dict) and "depends_on" in step for step in steps)
+    previous_id = None
+    for i, step in enumerate(steps):
+        if not isinstance(step, dict):
+            continue
+        step["id"] = str(step.get("id", i + 1))
+        if declared:
+            depends_on = step.get("depends_on") or []
+            step["depends_on"] = [str(d) for d in (depends_on if isinstance(depends_on, list) else [depends_on])]
+        else:
+            step["depends_on"] = [previous_id] if previous_id is not None else []
+        previous_id = step["id"]
+    return steps
+
+
 def normalize_plan(raw: Any) -> Dict[str, Any]:
     if isinstance(raw, str):
         try:
@@ -28,7 +228,7 @@ def normalize_plan(raw: Any) -> Dict[str, Any]:
         raise ValueError(f"Expected a dict with 'task' and 'plan', got {type(raw)}: {raw!r}")
 
     if "task" not in raw or "plan" not in raw:
-        raise KeyError(f"Missing 'task' or 'plan' in LLM output: {raw!r}")
+        raise ValueError(f"Missing 'task' or 'plan' in LLM output: {raw!r}")
 
     task = raw["task"]
     plan = raw["plan"]
@@ -41,14 +241,20 @@ def normalize_plan(raw: Any) -> Dict[str, Any]:
             except json.JSONDecodeError:
                 pass
 
+    if isinstance(plan, list):
+        plan = _normalize_step_graph(plan)
+
     return {"task": task, "plan": plan}
 
 
 class PlanBuilder:
-    def __init__(self, prompt_store: Optional[PromptStore] = None):
+    def __init__(self, prompt_store: Optional[PromptStore] = None, provider: Union[str, LLMProvider] = None,
+                 model_policy: ModelPolicy = None):
         plan_id = uuid.uuid4()
         self.plan: Plan = Plan(id=plan_id)
         self.prompt_store = prompt_store or PromptStore()
+        self.provider = provider
+        self.model_policy = model_policy
 
     def format_tools(self, tools: List[Tool], limit=1024) -> List[Dict]:
         tools = [
@@ -76,22 +282,13 @@ class PlanBuilder:
             formatted_agents.append(context_item)
         return formatted_agents
 
-    def build_plan(self,
-                   task: str,
-                   resources: ResourceRegistry = None,
-                   memory: Memory = None,
-                   ) -> Plan:
+    def _plan_prompt(self, task: str, resources: ResourceRegistry, memory: Memory) -> str:
         tools = resources.get_tools()
         agents = resources.get_agents()
 
         mem_items = [
             {"type": m["type"], "content": m["content"]}
-            for m in memory.get_memories()
-            if (
-                    m.get("type") == "user"
-                    or (m.get("type") == "agent" and "tool" in m.get("content", ""))
-                    or (m.get("type") == "environment" and "tool_executed" in m.get("content", ""))
-            )
+            for m in memory.prompt_view("progress")
         ]
 
         prompt_values = {
@@ -100,8 +297,9 @@ class PlanBuilder:
             "agents": self.format_agents(agents) if agents else None,
             "memory": mem_items
         }
-        agent_goal_builder_prompt = self.prompt_store.get_prompt("agent_plan_builder_instruction", **prompt_values)
-        raw = infer_llm_json(agent_goal_builder_prompt)
+        return self.prompt_store.get_prompt("agent_plan_builder_instruction", **prompt_values)
+
+    def _set_plan(self, raw: Any) -> Plan:
         parsed_plan = normalize_plan(raw)
 
         self.plan = Plan(
@@ -111,3 +309,25 @@ class PlanBuilder:
         )
 
         return self.plan
+
+    def build_plan(self,
+                   task: str,
+                   resources: ResourceRegistry = None,
+                   memory: Memory = None,
+                   ) -> Plan:
+        agent_goal_builder_prompt = self._plan_prompt(task=task, resources=resources, memory=memory)
+        raw = get_model_policy(self.model_policy).call("plan", lambda step: infer_llm_json(
+            agent_goal_builder_prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout,
+            provider=self.provider, call_site="plan", validator=normalize_plan))
+        return self._set_plan(raw)
+
+    async def abuild_plan(self,
+                          task: str,
+                          resources: ResourceRegistry = None,
+                          memory: Memory = None,
+                          ) -> Plan:
+        agent_goal_builder_prompt = self._plan_prompt(task=task, resources=resources, memory=memory)
+        raw = await get_model_policy(self.model_policy).acall("plan", lambda step: ainfer_llm_json(
+            agent_goal_builder_prompt, model=step.model, max_tokens=step.max_tokens, timeout=step.timeout,
+            provider=self.provider, call_site="plan", validator=normalize_plan))
+        return self._set_plan(raw)
@@ -6,12 +6,13 @@ from typing import List, Callable, Dict, Any, Optional
 
 
 class Tool:
-    def __init__(self, name: str, function: Callable, description: str, parameters: Dict, input_schema: Dict = None, output_schema: Dict = None, terminal: bool = False):
+    def __init__(self, name: str, function: Callable, description: str, parameters: Dict, input_schema: Dict = None, output_schema: Dict = None, terminal: bool = False, side_effect_free: bool = False):
         self.name = name
         self.function = function
         self.description = description
         self.parameters = parameters
         self.terminal = terminal
+        self.side_effect_free = side_effect_free
         self.input_schema = input_schema
         self.output_schema = output_schema
 
@@ -79,7 +80,8 @@ class ExecutableResourceRegistry(ResourceRegistry):
                 parameters=tool_desc.get("parameters", {}),
                 input_schema=tool_desc.get("input_schema"),
                 output_schema=tool_desc.get("output_schema"),
-                terminal=tool_desc.get("terminal", False)
+                terminal=tool_desc.get("terminal", False),
+                side_effect_free=tool_desc.get("side_effect_free", False)
             ))
 
         if agents:
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+from weakref import WeakKeyDictionary
+
+from agent_builder.environment_builder import Environment
+from agent_builder.invocation_memo import invocation_key
+from agent_builder.memory_builder import Memory
+from agent_builder.plan_builder import PlanStep, action_resource_name
+from agent_builder.resource_registry import ResourceRegistry, Tool
+
+
+def call_key(tool_name: str, args: Dict[str, Any]) -> str:
+    """The `InvocationMemo` key of a tool call, so speculated calls and memoized ones compare equal."""
+    return invocation_key({"tool": tool_name, "args": args})
+
+
+def recorded_calls(memory: Memory, since: int = 0) -> Set[str]:
+    """Keys of the tool calls recorded in `memory` from id `since` on."""
+    keys = set()
+    for item in memory.since(since, "tool_call"):
+        try:
+            invocation = json.loads(item["content"])
+        except (TypeError, ValueError):
+            continue
+        for call in invocation if isinstance(invocation, list) else [invocation]:
+            if isinstance(call, dict) and isinstance(call.get("tool"), str):
+                keys.add(call_key(call["tool"], call.get("args", {})))
+    return keys
+
+
+@dataclass
+class Speculation:
+    key: str
+    tool: Tool
+    args: Dict[str, Any]
+    future: Any
+    started_at: float
+    claimed: bool = False
+    discarded: bool = False
+
+
+class ToolSpeculator:
+    """
+    Runs the side-effect-free tool call the plan predicts next while the routing completion is in flight.
+    The result is used only when the router selects exactly that call; otherwise it is discarded. Once
+    more than `max_waste_ratio` of the launched speculations (after `min_samples`) were discarded, no new
+    speculation is started.
+    """
+
+    def __init__(self, resources: ResourceRegistry, environment: Environment, max_waste_ratio: float = 0.3,
+                 min_samples: int = 3):
+        self.resources = resources
+        self.environment = environment
+        self.max_waste_ratio = max_waste_ratio
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self.stats = {"launched": 0, "hits": 0, "wasted": 0, "wasted_seconds": 0.0, "throttled": 0}
+        self._recorded: "WeakKeyDictionary[Memory, Tuple[int, Set[str]]]" = WeakKeyDictionary()
+
+    def _recorded_calls(self, memory: Memory) -> Set[str]:
+        """`recorded_calls(memory)`, reading only the tool calls recorded since the previous turn."""
+        end = memory.cursor()
+        with self._lock:
+            start, keys = self._recorded.get(memory, (0, set()))
+        keys.update(recorded_calls(memory, start))
+        with self._lock:
+            self._recorded[memory] = (end, keys)
+        return keys
+
+    def _speculable(self, tool_name: Optional[str]) -> Optional[Tool]:
+        tool = self.resources.get_tool(tool_name) if tool_name else None
+        return tool if tool is not None and getattr(tool, "side_effect_free", False) else None
+
+    def _task_query_args(self, tool: Tool, task: str) -> Optional[Dict[str, Any]]:
+        """Arguments for a tool whose only required parameter is a string, filled with the task."""
+        parameters = tool.parameters or {}
+        required = parameters.get("required", [])
+        if len(required) != 1 or parameters.get("properties", {}).get(required[0], {}).get("type") != "string":
+            return None
+        return {required[0]: task}
+
+    def predict(self, steps: List[PlanStep], task: str, seen: Set[str]) -> Optional[Tuple[Tool, Dict[str, Any]]]:
+        """
+        The next plan step's call, if it targets a side-effect-free tool: its own arguments when the step
+        is concrete, else the task as the query of a single-string-argument tool the action calls (with
+        incomplete arguments). Calls in `seen` (already run or speculated) are skipped.
+        """
+        for step in steps:
+            tool = self._speculable(step.tool)
+            if tool is not None:
+                args = step.args
+            else:
+                tool = self._speculable(action_resource_name(step.action))
+                args = self._task_query_args(tool, task) if tool is not None else None
+            if tool is None or args is None:
+                continue
+            if call_key(tool.name, args) not in seen:
+                return tool, args
+        return None
+
+    def _allow(self) -> bool:
+        with self._lock:
+            launched, wasted = self.stats["launched"], self.stats["wasted"]
+            if launched >= self.min_samples and wasted > self.max_waste_ratio * launched:
+                self.stats["throttled"] += 1
+                return False
+            self.stats["launched"] += 1
+            return True
+
+    def start(self, steps: List[PlanStep], task: str, memory: Memory, speculated: Set[str]) -> Optional[Speculation]:
+        """
+        Launch the predicted call on the environment's worker pool. `speculated` collects the calls
+        speculated during the current run, so that each is tried at most once.
+        """
+        prediction = self.predict(steps, task, speculated | self._recorded_calls(memory))
+        if prediction is None or not self._allow():
+            return None
+        tool, args = prediction
+        key = call_key(tool.name, args)
+        speculated.add(key)
+        return Speculation(key=key, tool=tool, args=args, future=self.environment.submit_tool(tool, args),
+                           started_at=time.monotonic())
+
+    def astart(self, steps: List[PlanStep], task: str, memory: Memory, speculated: Set[str]) -> Optional[Speculation]:
+        prediction = self.predict(steps, task, speculated | self._recorded_calls(memory))
+        if prediction is None or not self._allow():
+            return None
+        tool, args = prediction
+        key = call_key(tool.name, args)
+        speculated.add(key)
+        future = asyncio.wrap_future(self.environment.submit_tool(tool, args))
+        return Speculation(key=key, tool=tool, args=args, future=future, started_at=time.monotonic())
+
+    def _matches(self, speculation: Optional[Speculation], invocation: Dict[str, Any]) -> bool:
+        if speculation is None or speculation.claimed or speculation.discarded:
+            return False
+        return call_key(invocation.get("tool"), invocation.get("args", {})) == speculation.key
+
+    def claim(self, speculation: Optional[Speculation], invocation: Dict[str, Any]) -> Optional[Any]:
+        """The speculative result when `invocation` is the speculated call, else None."""
+        if not self._matches(speculation, invocation):
+            return None
+        speculation.claimed = True
+        with self._lock:
+            self.stats["hits"] += 1
+        return self.environment.result_of(speculation.tool, speculation.future)
+
+    async def aclaim(self, speculation: Optional[Speculation], invocation: Dict[str, Any]) -> Optional[Any]:
+        if not self._matches(speculation, invocation):
+            return None
+        speculation.claimed = True
+        with self._lock:
+            self.stats["hits"] += 1
+        return await speculation.future
+
+    def discard(self, speculation: Optional[Speculation]):
+        """Drop an unclaimed speculation; a call already running finishes in the background."""
+        if speculation is None or speculation.claimed or speculation.discarded:
+            return
+        speculation.discarded = True
+        speculation.future.cancel()
+
+        def record_waste(_):
+            with self._lock:
+                self.stats["wasted"] += 1
+                self.stats["wasted_seconds"] += time.monotonic() - speculation.started_at
+
+        speculation.future.add_done_callback(record_waste)
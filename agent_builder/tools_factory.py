@@ -9,7 +9,7 @@ class ToolsFactory:
 
 
     def get_tool_metadata(self, func, tool_name=None, description=None, parameters_override=None, terminal=False,
-                          tags=None, input_schema=None, output_schema=None):
+                          tags=None, input_schema=None, output_schema=None, side_effect_free=False):
         """
            Extracts metadata for a function to use in tool registration.
 
@@ -20,6 +20,7 @@ class ToolsFactory:
                parameters_override (dict, optional): Override for the argument schema. Defaults to dynamically inferred schema.
                terminal (bool, optional): Whether the tool is terminal. Defaults to False.
                tags (List[str], optional): List of tags to associate with the tool.
+               side_effect_free (bool, optional): Whether calling the tool only reads data. Defaults to False.
 
            Returns:
                dict: A dictionary containing metadata about the tool, including description, args schema, and the function.
@@ -76,10 +77,11 @@ class ToolsFactory:
             "terminal": terminal,
             "tags": tags or [],
             "input_schema": input_schema,
-            "output_schema": output_schema
+            "output_schema": output_schema,
+            "side_effect_free": side_effect_free
         }
 
-    def register_tool(self, tool_name=None, description=None, parameters_override=None, terminal=False, tags=None, input_schema=None, output_schema=None):
+    def register_tool(self, tool_name=None, description=None, parameters_override=None, terminal=False, tags=None, input_schema=None, output_schema=None, side_effect_free=False):
         """
         A decorator to dynamically register a function in the tools dictionary with its parameters, schema, and docstring.
 
@@ -91,6 +93,8 @@ class ToolsFactory:
             tags (List[str], optional): List of tags to associate with the tool.
             input_schema (dict, optional): Input schema. Defaults to None.
             output_schema (dict, optional): Output schema. Defaults to None.
+            side_effect_free (bool, optional): Whether calling the tool only reads data, so that it may be
+                executed speculatively and its result discarded. Defaults to False.
 
         Returns:
             function: The wrapped function.
@@ -105,7 +109,8 @@ class ToolsFactory:
                 terminal=terminal,
                 tags=tags,
                 input_schema=input_schema,
-                output_schema=output_schema
+                output_schema=output_schema,
+                side_effect_free=side_effect_free
             )
 
             self.tools[metadata["tool_name"]] = {
@@ -115,7 +120,8 @@ class ToolsFactory:
                 "terminal": metadata["terminal"],
                 "tags": metadata["tags"] or [],
                 "input_schema": metadata["input_schema"] or None,
-                "output_schema": metadata["output_schema"] or None
+                "output_schema": metadata["output_schema"] or None,
+                "side_effect_free": metadata["side_effect_free"]
             }
 
             for tag in metadata["tags"]:
@@ -10,7 +10,7 @@ from agent_builder.resource_registry import ExecutableResourceRegistry, Resource
 from agent_builder.agent import Agent, prompt_adaptor
 from agent_builder.agent_language_builder import AgentFunctionCallingActionLanguage
 from agent_builder.environment_builder import Environment
-from agent_builder.memory_builder import Memory, PayloadMemory
+from agent_builder.memory_builder import Memory, PayloadMemory, CompactionPolicy
 from utils.llm_api import infer_llm_generation
 
 from agent_builder.agent import Agent
@@ -26,7 +26,7 @@ logger = logging.getLogger('agent_log')
 initialize_logging(logger)
 
 
-PAYLOAD_MEMORY = PayloadMemory()
+PAYLOAD_MEMORY = PayloadMemory(content_addressed=True)
 
 
 GENERATE_SCHEMA = {
@@ -300,7 +300,7 @@ def main():
     #     print(final_memory.get_memories())
     #     print(f"\n\n************************\nRan {i+1} iterations successfully!!\n\n")
 
-    memory = Memory()
+    memory = Memory(compaction=CompactionPolicy())
 
     RED = "\033[31m"
     RESET = "\033[0m"
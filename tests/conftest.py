@@ -0,0 +1,124 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import llm_api
+from utils.llm_cache import ResponseCache
+from utils.llm_providers import FakeProvider
+from utils.llm_retry import RetryPolicy
+
+LOOKUP_THEN_ANSWER = [
+    {"type": "tool", "name": "lookup", "reframed_task": "look up x"},
+    {"type": "generate_response_and_terminate", "name": "", "response": {"text": "done", "payload_ids": []}},
+]
+LOOKUP_FOREVER = [{"type": "tool", "name": "lookup", "reframed_task": "look up x"}]
+
+
+class ScriptedLLM:
+    """
+    `FakeProvider` responder playing every step of the agent loop, told apart by its prompt. Routing
+    decisions are taken from `routes` in order (the last one repeats); `plan` is the plan it proposes.
+    `steps` records the steps asked for, `on_step` is called with each step name before it is answered.
+    """
+
+    def __init__(self, routes=None, plan=None, on_step=None):
+        self.routes = list(routes or LOOKUP_THEN_ANSWER)
+        self.plan = plan or [{"action": "lookup(query='x')", "description": "look it up"}]
+        self.on_step = on_step
+        self.steps = []
+
+    def _step(self, name: str):
+        self.steps.append(name)
+        if self.on_step:
+            self.on_step(name)
+
+    def __call__(self, messages, model, **params):
+        text = json.dumps(messages)
+        if params.get("functions") or params.get("tools"):
+            self._step("selection")
+            return {"function_call": {"name": "lookup", "arguments": json.dumps({"query": "x"})}}
+        if "expert strategist" in text:
+            self._step("plan")
+            return json.dumps({"task": "t", "plan": self.plan})
+        if "Progress" in text:
+            self._step("context")
+            return json.dumps({"task": "t", "context": {}, "payload_ids": [], "comments": "c"})
+        if "feedback assessor" in text:
+            self._step("feedback")
+            return json.dumps({"task": "t", "status": "pending", "reasoning": "r"})
+        if "orchestration controller" in text:
+            self._step("routing")
+            route = self.routes.pop(0) if len(self.routes) > 1 else self.routes[0]
+            return json.dumps(route)
+        if "memory organizer" in text:
+            self._step("payload")
+            return json.dumps({"description": "desc"})
+        self._step("generation")
+        return "final answer text"
+
+
+def run_agent(agent, mode: str, task: str = "question", **kwargs):
+    """Run `agent` through `run` or `arun` depending on `mode`."""
+    if mode == "run":
+        return agent.run(task, **kwargs)
+    return asyncio.run(agent.arun(task, **kwargs))
+
+
+@pytest.fixture(autouse=True)
+def isolated_llm_api(monkeypatch):
+    """Module-level llm_api configuration (providers, cache, retry policies) is restored after each test."""
+    monkeypatch.setattr(llm_api, "providers", {})
+    monkeypatch.setattr(llm_api, "default_provider_name", llm_api.default_provider_name)
+    monkeypatch.setattr(llm_api, "response_cache", ResponseCache(disk_path=None))
+    monkeypatch.setattr(llm_api, "cached_functions", set())
+    monkeypatch.setattr(llm_api, "retry_policies", {})
+    monkeypatch.setattr(llm_api, "default_retry_policy", RetryPolicy(base_delay=0.0, max_delay=0.0))
+
+
+@pytest.fixture
+def make_agent():
+    """
+    Build an agent with the `lookup` and terminal `finish` tools, answered by a `ScriptedLLM`; `fused=True`
+    gives it the fused routing adaptors.
+    """
+    from agent_builder.agent import Agent, prompt_adaptor, async_prompt_adaptor
+    from agent_builder.agent_factory import AgentCard
+    from agent_builder.agent_language_builder import AgentFunctionCallingActionLanguage
+    from agent_builder.environment_builder import Environment
+    from agent_builder.memory_builder import PayloadMemory
+    from agent_builder.resource_registry import ExecutableResourceRegistry
+    from agent_builder.tools_factory import ToolsFactory
+
+    def build(script: ScriptedLLM, fused: bool = False, **kwargs):
+        provider = FakeProvider(responder=script)
+        llm_api.set_default_provider(provider)
+        tools = ToolsFactory()
+
+        @tools.register_tool(tags=["test"])
+        def lookup(query: str) -> str:
+            """Look something up."""
+            return f"result for {query}"
+
+        @tools.register_tool(tags=["test"], terminal=True)
+        def finish(message: str) -> str:
+            """Finish with a message."""
+            return message
+
+        return Agent(agent_card=AgentCard(name="tester", persona="p", description="d"),
+                     agent_language=AgentFunctionCallingActionLanguage(),
+                     resources=ExecutableResourceRegistry(tools_factory=tools, tags=["test"]),
+                     generate_response_routing=prompt_adaptor(tools),
+                     generate_response_tool_selection=prompt_adaptor(tools, task="selection"),
+                     async_generate_response_routing=async_prompt_adaptor(tools),
+                     async_generate_response_tool_selection=async_prompt_adaptor(tools, task="selection"),
+                     generate_response_fused=prompt_adaptor(tools, task="fused") if fused else None,
+                     async_generate_response_fused=async_prompt_adaptor(tools, task="fused") if fused else None,
+                     generate_response=llm_api.infer_llm_generation, environment=Environment(),
+                     payload_memory=PayloadMemory(), **kwargs)
+
+    return build
@@ -0,0 +1,17 @@
+import pytest
+
+from agent_builder.memory_builder import Memory
+
+from conftest import ScriptedLLM, run_agent
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_run_and_arun_take_the_same_steps(make_agent, mode):
+    script = ScriptedLLM()
+    agent = make_agent(script)
+
+    answer = run_agent(agent, mode, memory=Memory())
+
+    assert answer == {"text": "done", "payload_ids": []}
+    assert agent.last_run_report.stop_reason == "completed"
+    assert script.steps == ["plan", "context", "routing", "selection", "feedback", "context", "routing"]
@@ -0,0 +1,32 @@
+import pytest
+
+from agent_builder.memory_builder import Memory
+from utils.cancellation import CancellationToken
+
+from conftest import LOOKUP_FOREVER, ScriptedLLM, run_agent
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_cancellation_stops_the_run_at_the_next_phase(make_agent, mode):
+    token = CancellationToken()
+    script = ScriptedLLM(routes=LOOKUP_FOREVER,
+                         on_step=lambda step: token.cancel("caller left") if step == "selection" else None)
+    agent = make_agent(script)
+
+    answer = run_agent(agent, mode, memory=Memory(), cancel_token=token, max_iterations=10)
+
+    assert agent.last_run_report.stop_reason == "cancelled"
+    assert answer["text"].startswith("The run stopped early (cancelled)")
+    assert answer["cancelled"]["reason"] == "caller left"
+    assert script.steps.count("selection") == 1
+    assert "feedback" not in script.steps
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_uncancelled_token_changes_nothing(make_agent, mode):
+    agent = make_agent(ScriptedLLM())
+
+    answer = run_agent(agent, mode, memory=Memory(), cancel_token=CancellationToken())
+
+    assert answer == {"text": "done", "payload_ids": []}
+    assert agent.last_run_report.stop_reason == "completed"
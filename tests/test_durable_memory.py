@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+from agent_builder.durable_memory import SqliteMemory
+from agent_builder.memory_builder import MemorySummary
+
+TYPES = ["user", "agent", "environment", "system"]
+
+
+def entry(i):
+    entry_type = TYPES[i % 4]
+    if entry_type == "agent":
+        content = json.dumps({"tool": "lookup", "args": {"i": i}})
+    elif entry_type == "environment":
+        content = json.dumps({"tool_executed": True, "result": i})
+    else:
+        content = f"message {i}"
+    return {"type": entry_type, "content": content}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "memory.sqlite")
+
+
+def open_memory(path, session_id="s1"):
+    return SqliteMemory(path, session_id=session_id, tail_size=10, page_size=8, max_pages=2)
+
+
+def filled(path, count=200):
+    memory = open_memory(path)
+    for i in range(count):
+        memory.add_memory(entry(i))
+    return memory
+
+
+def test_session_is_restored_with_its_index_and_summaries(path):
+    memory = filled(path)
+    memory.add_summary(MemorySummary("summary", until_id=100, entry_ids=[1, 2], previous=None, source_tokens=10,
+                                     summary_tokens=2))
+    tool_calls = memory.view("tool_call").ids()
+    memory.close()
+
+    restored = open_memory(path)
+
+    assert len(restored.items) == 200
+    assert restored.view("tool_call").ids() == tool_calls
+    assert restored.last_id("user") == 196
+    assert restored.compacted_until == 100
+    assert restored.items[5] == entry(5) and restored.items[-1] == entry(199)
+    assert SqliteMemory.sessions(path) == ["s1"]
+
+
+def test_restore_reads_only_the_tail(path):
+    filled(path).close()
+
+    restored = open_memory(path)
+
+    assert restored.residency()["resident"] == 10
+    assert restored.residency()["page_loads"] == 0
+
+
+def test_old_entries_are_paged_within_the_bound(path):
+    filled(path).close()
+    restored = open_memory(path)
+
+    assert [item["content"] for item in restored.view("user")][:3] == ["message 0", "message 4", "message 8"]
+    assert restored.get_memories(3) == [entry(0), entry(1), entry(2)]
+    for i in range(0, 190, 7):
+        assert restored.items[i] == entry(i)
+
+    residency = restored.residency()
+    assert residency["resident"] <= 10 + 2 * 8
+    assert residency["page_loads"] > 0
+
+
+def test_appends_are_persisted_and_sessions_are_separate(path):
+    memory = filled(path, count=20)
+    new_id = memory.add_memory({"type": "user", "content": "new"})
+    other = open_memory(path, session_id="s2")
+    other.add_memory({"type": "user", "content": "elsewhere"})
+    memory.close()
+
+    restored = open_memory(path)
+
+    assert new_id == 20 and restored.items[20]["content"] == "new"
+    assert len(other.items) == 1
+    restored.clear()
+    assert len(restored.items) == 0 and len(open_memory(path).view("user")) == 0
+
+
+def test_sub_agent_copy_stays_bounded_and_leaves_the_session_alone(path):
+    memory = filled(path, count=1000)
+    memory.add_summary(MemorySummary("summary", until_id=500, entry_ids=[], previous=None, source_tokens=10,
+                                     summary_tokens=2))
+
+    copy = memory.copy_without_system_memories()
+
+    assert memory.residency()["resident"] <= 10 + 2 * 8
+    assert copy.residency() == {"entries": 750, "resident": 0}
+    assert copy.compacted_until == 375
+    assert copy.view("system").ids() == []
+    assert copy.view("tool_call").ids()[:2] == [1, 4]
+    assert [item["content"] for item in copy.get_memories(3)] == ["message 0", entry(1)["content"],
+                                                                  entry(2)["content"]]
+    assert sum(1 for _ in copy.view("progress")) == 750
+
+    new_id = copy.add_memory({"type": "user", "content": "from the sub-agent"})
+
+    assert new_id == 750 and copy.view("user").ids()[-1] == 750
+    assert copy.residency()["resident"] == 1
+    assert memory.residency()["resident"] <= 10 + 2 * 8
+    assert len(memory.items) == 1000 and len(open_memory(path).items) == 1000
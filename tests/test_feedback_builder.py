@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from agent_builder.feedback_builder import TaskStatus, rule_based_feedback
+from agent_builder.memory_builder import Memory
+from agent_builder.resource_registry import ExecutableResourceRegistry
+from agent_builder.tools_factory import ToolsFactory
+
+from conftest import ScriptedLLM, run_agent
+
+
+@pytest.fixture
+def resources():
+    tools = ToolsFactory()
+
+    @tools.register_tool(tags=["rules"])
+    def lookup(query: str) -> str:
+        """Look something up."""
+        return query
+
+    @tools.register_tool(tags=["rules"], terminal=True)
+    def finish(message: str) -> str:
+        """Finish with a message."""
+        return message
+
+    return ExecutableResourceRegistry(tools_factory=tools, tags=["rules"])
+
+
+def ok(result):
+    return {"tool_executed": True, "result": result}
+
+
+def test_mechanical_outcomes_are_decided_by_rules(resources):
+    unknown = rule_based_feedback({"tool": "nope", "args": {}}, ok(1), resources)
+    failed = rule_based_feedback({"tool": "lookup", "args": {}}, {"tool_executed": False, "error": "boom"}, resources)
+    finished = rule_based_feedback({"tool": "finish", "args": {}}, ok("bye"), resources)
+
+    assert unknown[0] == TaskStatus.FAILED and "nope" in unknown[1]
+    assert failed == (TaskStatus.FAILED, "Tool execution failed: boom")
+    assert finished[0] == TaskStatus.COMPLETED
+
+
+def test_ambiguous_outcomes_are_left_to_the_llm(resources):
+    assert rule_based_feedback({"tool": "lookup", "args": {}}, ok(1), resources) is None
+    assert rule_based_feedback("a sentence, not a call", "observation", resources) is None
+    partly_failed = [ok(1), {"tool_executed": False, "error": "boom"}]
+    assert rule_based_feedback([{"tool": "lookup"}, {"tool": "lookup"}], partly_failed, resources) is None
+
+
+class SelectsFinish(ScriptedLLM):
+    def __init__(self):
+        super().__init__(routes=[{"type": "tool", "name": "finish", "reframed_task": "finish"}])
+
+    def __call__(self, messages, model, **params):
+        if params.get("functions") or params.get("tools"):
+            self._step("selection")
+            return {"function_call": {"name": "finish", "arguments": json.dumps({"message": "bye"})}}
+        return super().__call__(messages, model, **params)
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_terminal_tool_ends_the_run_without_the_feedback_llm(make_agent, mode):
+    script = SelectsFinish()
+    agent = make_agent(script)
+
+    answer = run_agent(agent, mode, memory=Memory())
+
+    assert answer == "bye"
+    assert "feedback" not in script.steps
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_fast_path_can_be_turned_off(make_agent, mode):
+    script = SelectsFinish()
+    agent = make_agent(script, fast_feedback=False)
+
+    run_agent(agent, mode, memory=Memory(), max_iterations=2)
+
+    assert "feedback" in script.steps
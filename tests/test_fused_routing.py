@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from agent_builder.memory_builder import Memory
+from utils.llm_api import _parse_fused_routing
+
+from conftest import ScriptedLLM, run_agent
+
+
+def tool_calls(name, **args):
+    return {"tool_calls": [{"id": "call-1", "type": "function",
+                            "function": {"name": name, "arguments": json.dumps(args)}}]}
+
+
+class FusedRouting(ScriptedLLM):
+    """Answers the fused routing request from `decisions` in order (the last one repeats)."""
+
+    def __init__(self, decisions, **kwargs):
+        super().__init__(**kwargs)
+        self.decisions = list(decisions)
+        self.fused_params = []
+
+    def __call__(self, messages, model, **params):
+        if "RESPONSE MODE" in json.dumps(messages):
+            self._step("fused")
+            self.fused_params.append(params)
+            return self.decisions.pop(0) if len(self.decisions) > 1 else self.decisions[0]
+        return super().__call__(messages, model, **params)
+
+
+def test_tool_calls_are_parsed_like_selection_answers():
+    tool = _parse_fused_routing({"content": None, "function_call": None,
+                                 "tool_calls": [{"name": "lookup",
+                                                 "arguments": '{"tool": "lookup", "args": {"query": "x"}}'}]})
+    prefixed = _parse_fused_routing({"content": None, "function_call": None,
+                                     "tool_calls": [{"name": "functions.lookup", "arguments": '{"query": "x"}'}]})
+    done = _parse_fused_routing({"content": None, "function_call": None, "tool_calls": [
+        {"name": "generate_response_and_terminate", "arguments": '{"response": "bye", "payload_ids": ["p"]}'}]})
+    routed = _parse_fused_routing({"content": '{"type": "agent", "name": "helper"}', "function_call": None,
+                                   "tool_calls": None})
+
+    assert tool == prefixed == {"type": "tool", "name": "lookup", "tool_call": {"tool": "lookup", "args": {"query": "x"}}}
+    assert done["type"] == "generate_response_and_terminate"
+    assert done["response"] == {"text": "bye", "payload_ids": ["p"]}
+    assert routed == {"type": "agent", "name": "helper"}
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_one_request_routes_and_selects(make_agent, mode):
+    script = FusedRouting([tool_calls("lookup", query="x"),
+                           tool_calls("generate_response_and_terminate", response="all done")])
+    agent = make_agent(script, fused=True)
+    memory = Memory()
+
+    answer = run_agent(agent, mode, memory=memory)
+
+    assert answer == {"text": "all done", "payload_ids": []}
+    assert "routing" not in script.steps and "selection" not in script.steps
+    params = script.fused_params[0]
+    assert "functions" not in params and params["tool_choice"] == "auto"
+    names = [tool["function"]["name"] for tool in params["tools"]]
+    assert {"lookup", "finish", "generate_response_and_terminate"} <= set(names)
+    assert "result for x" in memory.view("tool_result")[0]["content"]
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_unknown_tool_falls_back_to_two_phase_routing(make_agent, mode):
+    script = FusedRouting([tool_calls("nonexistent")])
+    agent = make_agent(script, fused=True)
+
+    run_agent(agent, mode, memory=Memory())
+
+    assert script.steps[:5] == ["plan", "context", "fused", "routing", "selection"]
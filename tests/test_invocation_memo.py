@@ -0,0 +1,75 @@
+import pytest
+
+from agent_builder.invocation_memo import InvocationMemo, invocation_key, is_memoized
+from agent_builder.memory_builder import Memory
+
+from conftest import ScriptedLLM, run_agent, LOOKUP_FOREVER
+
+
+def is_memoized_entry(entry):
+    return '"memoized": true' in entry["content"]
+
+
+def test_key_ignores_formatting_of_the_arguments():
+    messy = {"tool": "t", "args": {"b": " a  b ", "a": 1.0, "c": None}}
+    clean = {"tool": "t", "args": {"a": 1, "b": "a b"}}
+
+    assert invocation_key(messy) == invocation_key(clean)
+    assert invocation_key({"tool": "t", "args": {"a": 2}}) != invocation_key(clean)
+    assert invocation_key({"agent": "helper", "task": "do  it"}) == invocation_key({"agent": "helper", "task": "do it"})
+    assert invocation_key("not a call") is None
+
+
+def test_successful_calls_are_recalled_and_failures_are_not():
+    memo = InvocationMemo()
+    call, failing = {"tool": "t", "args": {"a": 1}}, {"tool": "t", "args": {"a": 2}}
+    memo.recall(call)
+    memo.remember(call, {"tool_executed": True, "result": 1})
+    memo.recall(failing)
+    memo.remember(failing, {"tool_executed": False, "error": "boom"})
+
+    recalled = memo.recall(call)
+    assert is_memoized(recalled) and recalled["result"] == 1 and recalled["call_count"] == 2
+    assert memo.recall(failing) is None
+    assert memo.stats["hits"] == 1
+
+
+def test_repeat_limit_counts_identical_calls():
+    memo = InvocationMemo(max_identical_calls=2)
+    call = {"tool": "t", "args": {}}
+    for _ in range(2):
+        memo.recall(call)
+    assert not memo.over_limit(call)
+
+    memo.recall(call)
+    assert memo.over_limit([{"tool": "other", "args": {}}, call])
+    assert not InvocationMemo(max_identical_calls=None).over_limit(call)
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_repeated_call_is_answered_from_the_memo_then_stopped(make_agent, mode):
+    agent = make_agent(ScriptedLLM(routes=LOOKUP_FOREVER))
+    executed = []
+    agent.resources.get_tool("lookup").function = lambda query: executed.append(query) or f"result for {query}"
+    memory = Memory()
+
+    run_agent(agent, mode, memory=memory, max_iterations=6)
+
+    assert executed == ["x"]
+    assert agent.last_run_report.stop_reason == "repeat_limit"
+    assert agent.invocation_stats == {"hits": 2, "limit_stops": 1}
+    assert [is_memoized_entry(entry) for entry in memory.view("tool_result")] == [False, True, True]
+
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_per_resource_limit_stops_before_a_second_call(make_agent, mode):
+    script = ScriptedLLM(routes=LOOKUP_FOREVER)
+    agent = make_agent(script, max_calls_per_resource=1)
+    memory = Memory()
+
+    run_agent(agent, mode, memory=memory, max_iterations=6)
+
+    assert agent.last_run_report.stop_reason == "repeat_limit"
+    assert len(memory.view("tool_result")) == 1
+    assert script.steps.count("selection") == 1
@@ -0,0 +1,42 @@
+import pytest
+
+from utils import llm_api
+from utils.json_repair import parse_json_object, repair_json_object, repair_stats
+from utils.llm_providers import FakeProvider
+from utils.llm_retry import LLMContentError
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('Sure! ```json\n{"status": "done"}\n``` hope this helps', {"status": "done"}),
+    ('{"items": [1, 2,], "ok": true,}', {"items": [1, 2], "ok": True}),
+    ('{"text": "line one\nline two"}', {"text": "line one\nline two"}),
+    ('{"items": [1, 2}', {"items": [1, 2]}),
+    ('{"task": "t", "reasoning": "cut off mid', {"task": "t", "reasoning": "cut off mid"}),
+    ('{"task": "t", "plan": [{"action": "a"}, {"act', {"task": "t", "plan": [{"action": "a"}]}),
+])
+def test_common_llm_mistakes_are_repaired(text, expected):
+    assert repair_json_object(text) == expected
+
+
+def test_text_without_an_object_is_not_repaired():
+    assert repair_json_object("no json here") is None
+    with pytest.raises(LLMContentError):
+        parse_json_object("no json here")
+
+
+def test_repairs_are_counted():
+    before = repair_stats.summary()
+
+    parse_json_object('{"a": 1}')
+    parse_json_object('{"a": 1,')
+
+    after = repair_stats.summary()
+    assert after["clean"] - before["clean"] == 1
+    assert after["repaired"] - before["repaired"] == 1
+
+
+def test_repaired_answer_needs_no_second_request():
+    provider = FakeProvider(responses=['Here you go: {"answer": 1, "notes": "trunc', '{"answer": 2}'])
+
+    assert llm_api.infer_llm_json("question", provider=provider) == {"answer": 1, "notes": "trunc"}
+    assert len(provider.calls) == 1
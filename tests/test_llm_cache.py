@@ -0,0 +1,46 @@
+from utils import llm_api
+from utils.llm_providers import FakeProvider
+
+
+def test_repeated_prompt_is_answered_from_the_cache():
+    provider = FakeProvider(default_response='{"answer": 1}')
+
+    first = llm_api.infer_llm_json("question", provider=provider, use_cache=True)
+    second = llm_api.infer_llm_json("question", provider=provider, use_cache=True)
+
+    assert first == second == {"answer": 1}
+    assert len(provider.calls) == 1
+    stats = llm_api.get_cache_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_different_prompt_or_model_misses():
+    provider = FakeProvider(default_response='{"answer": 1}')
+
+    llm_api.infer_llm_json("question", provider=provider, use_cache=True)
+    llm_api.infer_llm_json("another question", provider=provider, use_cache=True)
+    llm_api.infer_llm_json("question", model="gpt-4o-mini", provider=provider, use_cache=True)
+
+    assert len(provider.calls) == 3
+    assert llm_api.get_cache_stats()["hits"] == 0
+
+
+def test_caching_is_opt_in_per_function():
+    provider = FakeProvider(default_response='{"answer": 1}')
+
+    llm_api.infer_llm_json("question", provider=provider)
+    llm_api.infer_llm_json("question", provider=provider)
+    assert len(provider.calls) == 2
+
+    llm_api.configure_cache(functions=["infer_llm_json"])
+    llm_api.infer_llm_json("question", provider=provider)
+    llm_api.infer_llm_json("question", provider=provider)
+    assert len(provider.calls) == 3
+
+
+def test_unusable_cached_answer_is_replaced():
+    provider = FakeProvider(responses=["not json", '{"answer": 2}'])
+
+    assert llm_api.infer_llm_json("question", provider=provider, use_cache=True) == {"answer": 2}
+    assert llm_api.infer_llm_json("question", provider=provider, use_cache=True) == {"answer": 2}
+    assert len(provider.calls) == 2
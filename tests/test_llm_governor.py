@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.cancellation import CancellationToken, use_cancellation_token
+from utils.llm_governor import LLMGovernor, ModelLimits, TokenBucket
+from utils.llm_retry import RunCancelledError
+
+
+def queued(governor: LLMGovernor) -> int:
+    return sum(governor.stats()["queue_depth"].values())
+
+
+def wait_until(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate_per_minute=60)
+    bucket.consume(60)
+
+    assert 0.9 < bucket.wait_time(1) <= 1.0
+    assert TokenBucket(rate_per_minute=None).wait_time(10 ** 9) == 0.0
+
+
+def test_token_limit_holds_back_requests_of_that_model_only():
+    governor = LLMGovernor(limits={"small": ModelLimits(tokens_per_minute=600)})
+    with governor.acquire("small", estimated_tokens=600):
+        pass
+
+    started = time.monotonic()
+    with governor.acquire("other", estimated_tokens=600):
+        assert time.monotonic() - started < 0.1
+    assert governor._model_wait("small", 100) > 5
+
+
+def test_waiters_are_admitted_by_priority_then_order():
+    governor = LLMGovernor(max_concurrency=1)
+    admitted = []
+    held = governor.acquire("m", "feedback")
+
+    def request(call_site):
+        with governor.acquire("m", call_site):
+            admitted.append(call_site)
+
+    threads = []
+    for call_site in ("payload", "feedback", "routing"):
+        threads.append(threading.Thread(target=request, args=(call_site,)))
+        threads[-1].start()
+        wait_until(lambda: queued(governor) == len(threads))
+    governor.release(held)
+    for thread in threads:
+        thread.join(2)
+
+    assert admitted == ["routing", "payload", "feedback"]
+    assert governor.stats()["granted"] == {"LOW": 3, "CRITICAL": 1}
+
+
+def test_cancelled_waiter_leaves_the_queue_and_blocks_nobody():
+    governor = LLMGovernor(max_concurrency=1)
+    held = governor.acquire("m", "routing")
+    token = CancellationToken()
+    errors, admitted = [], []
+
+    def cancelled_request():
+        with use_cancellation_token(token):
+            try:
+                governor.acquire("m", "routing")
+            except RunCancelledError as e:
+                errors.append(e)
+
+    def later_request():
+        with governor.acquire("m", "payload"):
+            admitted.append("payload")
+
+    first = threading.Thread(target=cancelled_request)
+    first.start()
+    wait_until(lambda: queued(governor) == 1)
+    second = threading.Thread(target=later_request)
+    second.start()
+    wait_until(lambda: queued(governor) == 2)
+
+    token.cancel("stop")
+    first.join(2)
+    assert errors and queued(governor) == 1
+
+    governor.release(held)
+    second.join(2)
+    assert admitted == ["payload"]
+    assert queued(governor) == 0
+
+
+def test_failed_wait_is_withdrawn(monkeypatch):
+    governor = LLMGovernor(max_concurrency=2)
+    held = governor.acquire("m")
+
+    def broken(model, tokens):
+        raise RuntimeError("limits misconfigured")
+
+    monkeypatch.setattr(governor, "_model_wait", broken)
+    with pytest.raises(RuntimeError):
+        governor.acquire("m")
+
+    assert queued(governor) == 0
+    governor.release(held)
+
+
+def test_async_waiter_cancelled_as_a_task_is_withdrawn():
+    governor = LLMGovernor(max_concurrency=1)
+    held = governor.acquire("m")
+
+    async def scenario():
+        task = asyncio.ensure_future(governor.aacquire("m", "routing"))
+        await asyncio.sleep(0.05)
+        assert queued(governor) == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert queued(governor) == 0
+    governor.release(held)
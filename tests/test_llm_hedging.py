@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.llm_hedging import HedgePolicy, Hedger, LatencyTracker
+
+KEY = ("m", "routing")
+
+
+def eager_policy(**overrides):
+    settings = dict(min_delay=0.0, default_delay=0.05, max_extra_ratio=1.0, min_samples=1)
+    settings.update(overrides)
+    return HedgePolicy(**settings)
+
+
+def test_percentile_needs_enough_samples():
+    tracker = LatencyTracker()
+    for latency in (0.1, 0.2, 0.3, 0.4):
+        tracker.record(KEY, latency)
+
+    assert tracker.percentile(KEY, 0.5) == 0.3
+    assert tracker.percentile(KEY, 0.5, min_samples=5) is None
+
+
+def test_learned_delay_is_clamped():
+    hedger = Hedger(eager_policy(max_delay=1.0))
+    assert hedger.hedge_delay(KEY) == 0.05
+
+    hedger.latencies.record(KEY, 30.0)
+    assert hedger.hedge_delay(KEY) == 1.0
+
+
+def test_slow_blocking_request_is_hedged_and_the_fast_copy_wins():
+    hedger = Hedger(eager_policy())
+    copies = []
+    release = threading.Event()
+
+    def request():
+        copies.append(len(copies))
+        if len(copies) == 1:
+            release.wait(2)
+            return "slow"
+        return "fast"
+
+    try:
+        assert hedger.call(request, *KEY) == "fast"
+    finally:
+        release.set()
+
+    stats = hedger.stats()["m:routing"]
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    assert hedger.latencies.percentile(KEY, 0.5) >= 0.05
+
+
+def test_fast_request_is_not_hedged():
+    hedger = Hedger(eager_policy(default_delay=1.0))
+
+    assert hedger.call(lambda: "ok", *KEY) == "ok"
+    assert hedger.stats()["m:routing"]["hedges"] == 0
+
+
+def test_hedges_respect_the_extra_request_budget():
+    hedger = Hedger(eager_policy(max_extra_ratio=0.0))
+
+    def slow():
+        time.sleep(0.1)
+        return "slow"
+
+    assert hedger.call(slow, *KEY) == "slow"
+    assert hedger.stats()["m:routing"]["hedges"] == 0
+
+
+def test_async_hedge_wins_and_the_slow_copy_is_cancelled():
+    hedger = Hedger(eager_policy())
+    cancelled = []
+    copies = []
+
+    async def request():
+        copies.append(len(copies))
+        if len(copies) == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append("primary")
+                raise
+        return "fast"
+
+    assert asyncio.run(hedger.acall(request, *KEY)) == "fast"
+    assert cancelled == ["primary"]
+    assert hedger.stats()["m:routing"]["hedge_wins"] == 1
+
+
+@pytest.mark.parametrize("hedged", [False, True])
+def test_cancelling_the_caller_cancels_every_copy(hedged):
+    hedger = Hedger(eager_policy(default_delay=0.01 if hedged else 5.0))
+    started, cancelled = [], []
+
+    async def request():
+        started.append(1)
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def scenario():
+        caller = asyncio.ensure_future(hedger.acall(request, *KEY))
+        await asyncio.sleep(0.1)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        # Checked before asyncio.run tears down the loop, which would cancel leftovers itself.
+        assert len(started) == (2 if hedged else 1)
+        assert len(cancelled) == len(started)
+
+    asyncio.run(scenario())
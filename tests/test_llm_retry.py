@@ -0,0 +1,65 @@
+from utils import llm_api
+from utils.llm_providers import FakeProvider
+from utils.llm_retry import RetryPolicy
+
+
+class APIConnectionError(Exception):
+    """Named like the SDK's transient error, which is how the retry layer recognises it."""
+
+
+class CountingProvider(FakeProvider):
+    def __init__(self, fail_times: int = None, response: str = '{"answer": 1}'):
+        super().__init__(responder=self._respond)
+        self.fail_times = fail_times
+        self.response = response
+
+    def _respond(self, messages, model, **params):
+        if self.fail_times is None or len(self.calls) <= self.fail_times:
+            raise APIConnectionError("connection reset")
+        return self.response
+
+
+def test_call_site_policy_sets_the_attempts():
+    provider = CountingProvider()
+    llm_api.configure_retry_policy(RetryPolicy(max_attempts=5, base_delay=0.0, max_delay=0.0), call_site="json")
+
+    result = llm_api.infer_llm_json("question", provider=provider)
+
+    assert "Error" in result
+    assert len(provider.calls) == 5
+
+
+def test_explicit_num_retries_overrides_the_policy():
+    provider = CountingProvider()
+    llm_api.configure_retry_policy(RetryPolicy(max_attempts=5, base_delay=0.0, max_delay=0.0), call_site="json")
+
+    result = llm_api.infer_llm_json("question", provider=provider, num_retries=2)
+
+    assert "Error" in result
+    assert len(provider.calls) == 2
+
+
+def test_transient_failure_then_success():
+    provider = CountingProvider(fail_times=2)
+
+    assert llm_api.infer_llm_json("question", provider=provider) == {"answer": 1}
+    assert len(provider.calls) == 3
+
+
+def test_unusable_answer_is_asked_again_once():
+    provider = FakeProvider(responses=["not json at all", '{"answer": 2}'])
+
+    assert llm_api.infer_llm_json("question", provider=provider) == {"answer": 2}
+    assert len(provider.calls) == 2
+
+
+def test_validator_bug_is_not_retried():
+    provider = FakeProvider(default_response='{"answer": 1}')
+
+    def validator(result):
+        return result["missing"]
+
+    result = llm_api.infer_llm_json("question", provider=provider, validator=validator)
+
+    assert "Error" in result
+    assert len(provider.calls) == 1
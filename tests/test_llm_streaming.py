@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from utils import llm_api
+from utils.llm_providers import FakeProvider
+
+from conftest import ScriptedLLM
+
+
+class APIConnectionError(Exception):
+    """Named like the SDK's transient error, which is how the retry layer recognises it."""
+
+
+async def collect(stream):
+    return [delta async for delta in stream]
+
+
+def test_deltas_arrive_in_order_and_the_whole_answer_is_cached():
+    provider = FakeProvider(responses=["the final answer"])
+
+    deltas = list(llm_api.infer_llm_generation_stream("question", provider=provider, use_cache=True))
+    replayed = list(llm_api.infer_llm_generation_stream("question", provider=provider, use_cache=True))
+
+    assert deltas == ["the ", "final ", "answer"]
+    assert replayed == ["the final answer"]
+    assert len(provider.calls) == 1
+
+
+def test_async_stream_yields_the_same_deltas():
+    provider = FakeProvider(responses=["the final answer"])
+
+    deltas = asyncio.run(collect(llm_api.ainfer_llm_generation_stream("question", provider=provider)))
+
+    assert deltas == ["the ", "final ", "answer"]
+
+
+def test_failure_before_the_first_delta_is_retried():
+    attempts = []
+
+    def flaky(messages, model, **params):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise APIConnectionError("connection reset")
+        return "recovered"
+
+    deltas = list(llm_api.infer_llm_generation_stream("question", provider=FakeProvider(responder=flaky)))
+
+    assert deltas == ["recovered"]
+    assert len(attempts) == 2
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_answer_generated_from_a_payload_is_streamed_to_on_token(make_agent, mode):
+    agent = make_agent(ScriptedLLM())
+    payload_id = agent.payload_memory.add_payload({"rows": [1, 2]})
+    received = []
+
+    async def on_token(delta):
+        received.append(delta)
+
+    response = {"payload_ids": [payload_id]}
+    if mode == "run":
+        answer = agent.generate_response_from_payload("question", response, on_token=received.append)
+    else:
+        answer = asyncio.run(agent.agenerate_response_from_payload("question", response, on_token=on_token))
+
+    assert answer == "final answer text"
+    assert received == ["final ", "answer ", "text"]
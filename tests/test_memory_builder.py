@@ -0,0 +1,31 @@
+import json
+
+from agent_builder.memory_builder import Memory, classify_memory
+
+
+def test_entries_are_classified_from_their_structured_content():
+    memory = Memory()
+    memory.add_memory({"type": "user", "content": "which tool should I use?"})
+    memory.add_memory({"type": "agent", "content": "I will try the search tool"})
+    call = memory.add_memory({"type": "agent", "content": json.dumps({"tool": "lookup", "args": {"query": "x"}})})
+    calls = memory.add_memory({"type": "agent", "content": json.dumps([{"tool": "a"}, {"tool": "b"}])})
+    memory.add_memory({"type": "environment", "content": "no tool_executed in here"})
+    result = memory.add_memory({"type": "environment", "content": json.dumps({"tool_executed": True, "result": 1})})
+
+    assert memory.view("tool_call").ids() == [call, calls]
+    assert memory.view("tool_result").ids() == [result]
+    assert memory.view("progress").ids() == [0, call, calls, result]
+
+
+def test_explicit_kind_wins():
+    assert classify_memory({"type": "agent", "kind": "note", "content": json.dumps({"tool": "x"})}) == "note"
+
+
+def test_views_are_fixed_when_taken():
+    memory = Memory()
+    memory.add_memory({"type": "user", "content": "first"})
+    view = memory.view("user")
+    memory.add_memory({"type": "user", "content": "second"})
+
+    assert [entry["content"] for entry in view] == ["first"]
+    assert [entry["content"] for entry in memory.since(1, "user")] == ["second"]
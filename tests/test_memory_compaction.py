@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from agent_builder.memory_builder import CompactionPolicy, Memory
+from agent_builder.memory_compaction import MemoryCompactor
+from utils.llm_providers import FakeProvider
+
+from conftest import ScriptedLLM
+
+
+def long_memory(entries: int = 6) -> Memory:
+    memory = Memory(compaction=CompactionPolicy(max_tokens=60, keep_recent_tokens=30, min_entries=2))
+    memory.add_memory({"type": "system", "content": "system prompt"})
+    for i in range(entries):
+        memory.add_memory({"type": "user", "content": f"question number {i} with a few more words"})
+    return memory
+
+
+def test_history_under_the_threshold_is_left_alone():
+    memory = Memory(compaction=CompactionPolicy(max_tokens=1000))
+    memory.add_memory({"type": "user", "content": "short"})
+
+    assert MemoryCompactor(provider=FakeProvider()).maybe_compact(memory) is None
+    assert memory.summaries == []
+
+
+def test_older_entries_are_folded_into_a_rolling_summary():
+    provider = FakeProvider(responses=["first summary", "second summary"])
+    compactor = MemoryCompactor(provider=provider)
+    memory = long_memory()
+
+    first = compactor.maybe_compact(memory).result()
+
+    assert memory.compacted_until == first.until_id == first.entry_ids[-1] + 1
+    view = memory.prompt_view("progress")
+    assert view[0] == {"type": "summary", "content": "first summary"}
+    assert compactor.history_tokens(memory) <= 60 + first.summary_tokens
+
+    for i in range(6, 12):
+        memory.add_memory({"type": "user", "content": f"question number {i} with a few more words"})
+    second = compactor.maybe_compact(memory).result()
+
+    assert second.previous == 0 and second.entry_ids[0] >= first.until_id
+    assert "first summary" in str(provider.calls[1]["messages"])
+    assert memory.prompt_view("progress")[0]["content"] == "second summary"
+    assert compactor.stats["compactions"] == 2
+
+
+def test_failed_summary_keeps_the_entries_verbatim():
+    def broken(messages, model, **params):
+        raise ValueError("no summary today")
+
+    compactor = MemoryCompactor(provider=FakeProvider(responder=broken))
+    memory = long_memory()
+
+    assert compactor.maybe_compact(memory).result() is None
+    assert memory.summaries == [] and compactor.stats["failures"] == 1
+    assert len(memory.prompt_view("progress")) == 6
+
+
+def test_sub_agent_copy_keeps_the_summary_aligned():
+    memory = long_memory()
+    MemoryCompactor(provider=FakeProvider(responses=["summary"])).maybe_compact(memory).result()
+
+    copy = memory.copy_without_system_memories()
+
+    assert copy.compacted_until == memory.compacted_until - 1
+    assert copy.prompt_view("progress") == memory.prompt_view("progress")
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_agent_runs_compact_their_memory_in_the_background(make_agent, mode):
+    agent = make_agent(ScriptedLLM())
+    memory = Memory(compaction=CompactionPolicy(max_tokens=60, keep_recent_tokens=30, min_entries=2))
+
+    for i in range(3):
+        task = f"question {i}"
+        agent.run(task, memory=memory) if mode == "run" else asyncio.run(agent.arun(task, memory=memory))
+        pending = agent.memory_compactor._pending.get(memory)
+        if pending is not None:
+            pending.result()
+
+    assert memory.summaries
+    assert memory.prompt_view("progress")[0]["type"] == "summary"
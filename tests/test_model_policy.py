@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from agent_builder.memory_builder import Memory
+from utils import llm_api
+from utils.llm_providers import FakeProvider
+from utils.llm_retry import RetryPolicy
+from utils.model_policy import ModelPolicy, StepConfig
+
+from conftest import ScriptedLLM, run_agent
+
+
+def test_tiered_policy_moves_only_the_small_steps():
+    policy = ModelPolicy.tiered(small_model="small", steps={"routing": StepConfig("route-mini", timeout=5)})
+
+    assert [step.model for step in policy.step("feedback").chain()] == ["small", "gpt-4o"]
+    assert policy.step("routing") == StepConfig("route-mini", timeout=5)
+    assert policy.step("plan").model == "gpt-4o"
+    assert policy.step("unknown") is policy.default
+
+
+def test_error_result_falls_back_to_the_next_model():
+    policy = ModelPolicy(steps={"feedback": StepConfig("small", fallbacks=["large"])})
+    tried = []
+
+    def ask(step):
+        tried.append(step.model)
+        return {"Error": "bad"} if step.model == "small" else {"status": "pending"}
+
+    assert policy.call("feedback", ask) == {"status": "pending"}
+    assert tried == ["small", "large"]
+    report = policy.report()["feedback"]
+    assert report["calls"] == 2 and report["failures"] == 1 and report["fallbacks"] == 1
+    assert report["models"] == {"small": 1, "large": 1}
+
+
+def test_last_model_raises_what_it_raised():
+    policy = ModelPolicy(steps={"plan": StepConfig("a", fallbacks=["b"])})
+
+    def ask(step):
+        raise ValueError(step.model)
+
+    with pytest.raises(ValueError, match="b"):
+        policy.call("plan", ask)
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_agent_steps_use_the_policy_and_fall_back(make_agent, mode):
+    llm_api.configure_retry_policy(RetryPolicy(max_attempts=1, base_delay=0.0, max_delay=0.0))
+    script = ScriptedLLM()
+    models = []
+
+    def responder(messages, model, **params):
+        models.append(model)
+        if model == "small" and "feedback assessor" in json.dumps(messages):
+            raise ConnectionError("small model unavailable")
+        return script(messages, model, **params)
+
+    agent = make_agent(script)
+    llm_api.set_default_provider(FakeProvider(responder=responder))
+    agent.model_policy = ModelPolicy.tiered(small_model="small", large_model="large",
+                                            steps={"routing": StepConfig("route-mini")})
+
+    run_agent(agent, mode, memory=Memory())
+
+    assert script.steps.count("feedback") == 1
+    report = agent.model_policy.report()
+    assert report["feedback"]["models"] == {"small": 1, "large": 1}
+    assert report["feedback"]["fallbacks"] == 1
+    assert report["routing"]["models"] == {"route-mini": 2}
+    assert "route-mini" in models
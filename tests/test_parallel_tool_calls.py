@@ -0,0 +1,67 @@
+import json
+import time
+
+import pytest
+
+from agent_builder.memory_builder import Memory
+
+from conftest import ScriptedLLM, run_agent
+
+
+def tool_call(call_id, name, **args):
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+
+
+class ParallelSelection(ScriptedLLM):
+    """Selects several tool calls in one turn."""
+
+    def __init__(self, calls, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = calls
+        self.selection_params = []
+
+    def __call__(self, messages, model, **params):
+        if params.get("tools"):
+            self._step("selection")
+            self.selection_params.append(params)
+            return {"tool_calls": self.calls}
+        return super().__call__(messages, model, **params)
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_calls_of_one_turn_run_concurrently_and_are_recorded_together(make_agent, mode):
+    script = ParallelSelection([tool_call("1", "lookup", query="a"), tool_call("2", "lookup", query="b"),
+                                tool_call("3", "lookup", query="c")])
+    agent = make_agent(script)
+
+    def slow_lookup(query):
+        time.sleep(0.2)
+        return f"result for {query}"
+
+    agent.resources.get_tool("lookup").function = slow_lookup
+    memory = Memory()
+
+    started = time.monotonic()
+    run_agent(agent, mode, memory=memory)
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 0.5
+    assert script.selection_params[0]["parallel_tool_calls"] is True
+    invocations = json.loads(memory.view("tool_call")[0]["content"])
+    assert [call["args"]["query"] for call in invocations] == ["a", "b", "c"]
+    results = json.loads(memory.view("tool_result")[0]["content"])
+    assert [result["result"] for result in results] == ["result for a", "result for b", "result for c"]
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_unknown_tool_in_a_batch_is_reported_and_the_rest_still_run(make_agent, mode):
+    script = ParallelSelection([tool_call("1", "lookup", query="a"), tool_call("2", "missing")])
+    agent = make_agent(script)
+    memory = Memory()
+
+    run_agent(agent, mode, memory=memory)
+
+    found, missing = json.loads(memory.view("tool_result")[0]["content"])
+    assert found["result"] == "result for a"
+    assert missing["tool"] == "Error"
+    assert "feedback" not in script.steps
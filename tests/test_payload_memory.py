@@ -0,0 +1,92 @@
+import gc
+import time
+
+import pytest
+
+from agent_builder.memory_builder import Memory, PayloadMemory
+
+
+@pytest.fixture
+def payloads():
+    store = PayloadMemory(max_bytes=1000, orphan_grace=60.0, compress_threshold=None)
+    yield store
+    store.close()
+
+
+def record(i):
+    return {"rows": "x" * 300, "i": i}
+
+
+def test_least_recently_used_payloads_spill_to_disk_and_come_back(payloads):
+    holder = Memory()
+    ids = [payloads.add_payload(record(i), holder=holder) for i in range(10)]
+
+    stats = payloads.stats()
+    assert stats["resident_bytes"] <= 1000
+    assert stats["spilled"] == 7 and stats["resident"] == 3
+
+    assert payloads.retrieve_payload(ids[0]) == record(0)
+    assert payloads.stats()["spill_reads"] == 1
+    assert payloads.retrieve_payload(ids[9]) == record(9)
+    assert payloads.retrieve_payload("unknown") is None
+
+
+def test_retrieval_returns_a_fresh_copy_wherever_the_payload_is(payloads):
+    holder = Memory()
+    small = payloads.add_payload({"values": [1, 2]}, holder=holder)
+    large = payloads.add_payload({"values": ["y" * 2000]}, holder=holder)
+
+    for payload_id in (small, large):
+        payloads.retrieve_payload(payload_id)["values"].append("changed")
+        assert "changed" not in payloads.retrieve_payload(payload_id)["values"]
+
+
+def test_released_payloads_are_reclaimed_after_the_grace_period(payloads):
+    kept, dropped = Memory(), Memory()
+    shared = payloads.add_payload(record(1), holder=kept)
+    payloads.add_references(dropped, [shared])
+    own = payloads.add_payload(record(2), holder=dropped)
+
+    payloads.release(dropped)
+    assert payloads.collect() == 0
+    assert payloads.collect(grace=0) == 1
+
+    assert payloads.retrieve_payload(own) is None
+    assert payloads.retrieve_payload(shared) == record(1)
+
+
+def test_garbage_collected_memory_releases_its_payloads(payloads):
+    memory = Memory()
+    payload_id = payloads.add_payload(record(1), holder=memory)
+
+    del memory
+    gc.collect()
+
+    assert payloads.stats()["orphaned"] == 1
+    assert payloads.collect(grace=0) == 1
+    assert payloads.retrieve_payload(payload_id) is None
+
+
+def test_payload_never_referenced_is_reclaimed_without_further_activity():
+    store = PayloadMemory(orphan_grace=0.05)
+    try:
+        payload_id = store.add_payload(record(1))
+        deadline = time.monotonic() + 2.0
+        while store.stats()["payloads"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.retrieve_payload(payload_id) is None
+        assert store.stats()["reclaimed"] == 1
+    finally:
+        store.close()
+
+
+def test_sub_agent_copy_keeps_the_payloads_alive(payloads):
+    memory = Memory()
+    payload_id = payloads.add_payload(record(1), holder=memory)
+    sub_memory = memory.copy_without_system_memories()
+    payloads.share_references(memory, sub_memory)
+
+    payloads.release(memory)
+
+    assert payloads.collect(grace=0) == 0
+    assert payloads.retrieve_payload(payload_id) == record(1)
@@ -0,0 +1,46 @@
+from agent_builder.memory_builder import Memory, PayloadMemory
+
+
+def record(i):
+    return {"rows": "x" * 300, "i": i}
+
+
+def test_equal_payloads_are_stored_once_when_content_addressed():
+    store = PayloadMemory(content_addressed=True)
+    try:
+        holder = Memory()
+        first = store.add_payload({"b": 1, "a": [1, 2]}, holder=holder)
+        second = store.add_payload({"a": [1, 2], "b": 1}, holder=holder)
+        other = store.add_payload({"a": [2, 1], "b": 1}, holder=holder)
+
+        assert first == second != other
+        stats = store.stats()
+        assert (stats["payloads"], stats["dedup_hits"]) == (2, 1)
+        assert stats["dedup_ratio"] == round(1 / 3, 4)
+    finally:
+        store.close()
+
+
+def test_deduplicated_payload_is_pinned_by_its_new_holder():
+    store = PayloadMemory(content_addressed=True, orphan_grace=60.0)
+    try:
+        first_holder, second_holder = Memory(), Memory()
+        payload_id = store.add_payload(record(1), holder=first_holder)
+        store.release(first_holder)
+
+        assert store.add_payload(record(1), holder=second_holder) == payload_id
+        assert store.collect(grace=0) == 0
+        assert store.retrieve_payload(payload_id) == record(1)
+    finally:
+        store.close()
+
+
+def test_large_payloads_are_compressed():
+    store = PayloadMemory(compress_threshold=100)
+    try:
+        payload_id = store.add_payload({"text": "z" * 5000}, holder=Memory())
+        stats = store.stats()
+        assert stats["compressed"] == 1 and stats["compressed_bytes_saved"] > 4000
+        assert store.retrieve_payload(payload_id) == {"text": "z" * 5000}
+    finally:
+        store.close()
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from agent_builder.memory_builder import Memory
+from utils import llm_api
+from utils.llm_providers import FakeProvider
+
+from conftest import LOOKUP_FOREVER, ScriptedLLM, run_agent
+
+VOLATILE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+                      r"|\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?")
+
+
+class RecordingLLM(ScriptedLLM):
+    """`ScriptedLLM` that also records the prompt of each step (ids and timestamps masked)."""
+
+    def __init__(self, feedback_status: str = "pending", **kwargs):
+        super().__init__(**kwargs)
+        self.feedback_status = feedback_status
+        self.prompts = {}
+        self.last = threading.local()
+        self._lock = threading.Lock()
+
+    def __call__(self, messages, model, **params):
+        with self._lock:
+            response = super().__call__(messages, model, **params)
+            step = self.steps[-1]
+            self.prompts.setdefault(step, []).append(VOLATILE.sub("*", json.dumps(messages)))
+        self.last.step = step
+        if step == "feedback":
+            return json.dumps({"task": "t", "status": self.feedback_status, "reasoning": "not there yet"})
+        return response
+
+
+class SlowProvider(FakeProvider):
+    """Answers the plan, context and feedback steps of `script` after `delay` seconds, as a remote LLM would."""
+
+    def __init__(self, script: RecordingLLM, delay: float):
+        super().__init__(responder=script)
+        self.script = script
+        self.delay = delay
+
+    def _slow(self) -> bool:
+        return self.script.last.step in ("plan", "context", "feedback")
+
+    def chat(self, messages, model, **params):
+        response = super().chat(messages, model, **params)
+        if self._slow():
+            time.sleep(self.delay)
+        return response
+
+    async def achat(self, messages, model, **params):
+        response = FakeProvider.chat(self, messages, model, **params)
+        if self._slow():
+            await asyncio.sleep(self.delay)
+        return response
+
+
+def timed_run(make_agent, mode, script, pipelined, **kwargs):
+    agent = make_agent(script, pipelined=pipelined)
+    llm_api.set_default_provider(SlowProvider(script, delay=0.1))
+    started = time.monotonic()
+    answer = run_agent(agent, mode, memory=Memory(), **kwargs)
+    return agent, answer, time.monotonic() - started
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_pipelined_run_sends_the_serial_prompts_with_fewer_waits(make_agent, mode):
+    serial_script, pipelined_script = RecordingLLM(), RecordingLLM()
+
+    _, serial_answer, serial_time = timed_run(make_agent, mode, serial_script, pipelined=False)
+    agent, pipelined_answer, pipelined_time = timed_run(make_agent, mode, pipelined_script, pipelined=True)
+
+    assert pipelined_answer == serial_answer
+    assert pipelined_script.prompts["routing"] == serial_script.prompts["routing"]
+    assert pipelined_script.prompts["context"] == serial_script.prompts["context"]
+    assert Counter(pipelined_script.steps) == Counter(serial_script.steps)
+    assert agent.pipeline_stats == {"speculative_contexts": 2, "reused": 2, "discarded": 0}
+    assert pipelined_time < serial_time - 0.15
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_context_ahead_of_decisive_feedback_is_rebuilt(make_agent, mode):
+    serial_script, pipelined_script = RecordingLLM(feedback_status="failed"), RecordingLLM(feedback_status="failed")
+
+    run_agent(make_agent(serial_script), mode, memory=Memory())
+    agent = make_agent(pipelined_script, pipelined=True)
+    run_agent(agent, mode, memory=Memory())
+
+    assert pipelined_script.prompts["routing"] == serial_script.prompts["routing"]
+    assert [p for p in pipelined_script.prompts["context"] if "not there yet" in p] == \
+        [p for p in serial_script.prompts["context"] if "not there yet" in p]
+    assert agent.pipeline_stats["discarded"] == 1
+    assert agent.pipeline_stats["reused"] == 1
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_unused_context_ahead_is_discarded_at_the_iteration_limit(make_agent, mode):
+    script = RecordingLLM(routes=LOOKUP_FOREVER)
+    agent = make_agent(script, pipelined=True)
+
+    run_agent(agent, mode, memory=Memory(), max_iterations=2)
+
+    stats = agent.pipeline_stats
+    assert stats["speculative_contexts"] == stats["reused"] + stats["discarded"]
+    assert stats["discarded"] == 1
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from agent_builder.memory_builder import Memory
+from agent_builder.plan_builder import PlanStep, order_plan_steps, sequential_plan_steps, step_reference
+
+from conftest import ScriptedLLM
+
+
+def step(step_id, depends_on=(), args=None):
+    return PlanStep(action=f"lookup(query='{step_id}')", id=step_id, depends_on=list(depends_on), tool="lookup",
+                    args=args if args is not None else {"query": step_id})
+
+
+def test_steps_are_ordered_after_their_dependencies():
+    steps = [step("c", ["a", "b"]), step("b", ["a"]), step("a"), step("d")]
+
+    ordered = [s.id for s in order_plan_steps(steps)]
+
+    assert ordered == ["a", "d", "b", "c"]
+
+
+def test_cycle_has_no_order():
+    assert order_plan_steps([step("a", ["b"]), step("b", ["a"])]) is None
+
+
+def test_sequential_fallback_keeps_dependencies_for_binding():
+    steps = [step("1"), step("2"), step("3", ["1"], args={"query": "$1"})]
+
+    chained = sequential_plan_steps(steps)
+
+    assert [s.depends_on for s in chained] == [[], ["1"], ["1", "2"]]
+    assert chained[2].executable and chained[2].args == {"query": "$1"}
+
+
+def test_sequential_fallback_disables_steps_referring_to_later_steps():
+    steps = [step("1", ["2"], args={"query": "$2"}), step("2", ["1"])]
+
+    chained = sequential_plan_steps(steps)
+
+    assert not chained[0].executable
+    assert "do not run before it" in chained[0].reason
+    assert chained[1].executable
+
+
+def test_step_reference():
+    assert step_reference("$2") == "2"
+    assert step_reference("${fetch}") == "fetch"
+    assert step_reference("costs $2") is None
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_plan_executor_binds_step_results(make_agent, mode):
+    plan = [
+        {"id": "a", "action": "lookup(query='x')", "depends_on": []},
+        {"id": "b", "action": "lookup(query='y')", "depends_on": []},
+        {"id": "c", "action": "finish(message='$a')", "depends_on": ["a", "b"]},
+    ]
+    script = ScriptedLLM(plan=plan)
+    agent = make_agent(script, plan_executor=True)
+
+    answer = agent.run("q", memory=Memory()) if mode == "run" else asyncio.run(agent.arun("q", memory=Memory()))
+
+    assert answer == "result for x"
+    assert script.steps == ["plan"]
+    assert agent.plan_stats["executed_steps"] == 3
+    assert agent.last_plan_report["critical_path"][-1] == "c"
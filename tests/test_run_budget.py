@@ -0,0 +1,42 @@
+import pytest
+
+from agent_builder.memory_builder import Memory
+from utils.run_budget import RunBudget
+
+from conftest import LOOKUP_FOREVER, ScriptedLLM, run_agent
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_token_budget_stops_the_run_with_a_best_effort_answer(make_agent, mode):
+    script = ScriptedLLM(routes=LOOKUP_FOREVER)
+    agent = make_agent(script)
+
+    answer = run_agent(agent, mode, memory=Memory(), budget=RunBudget(max_tokens=2500), max_iterations=10)
+
+    assert agent.last_run_report.stop_reason == "tokens"
+    assert answer["text"].startswith("The run stopped early (tokens)")
+    assert "routing" not in script.steps[script.steps.index("context") + 1:]
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_deadline_stops_the_run_before_any_request(make_agent, mode):
+    script = ScriptedLLM()
+    agent = make_agent(script)
+
+    answer = run_agent(agent, mode, memory=Memory(), budget=RunBudget(deadline=0.0))
+
+    assert agent.last_run_report.stop_reason == "deadline"
+    assert answer["text"].startswith("The run stopped early (deadline)")
+    assert script.steps == []
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_iteration_limit_answers_from_the_results_so_far(make_agent, mode):
+    script = ScriptedLLM(routes=LOOKUP_FOREVER)
+    agent = make_agent(script, max_identical_calls=None)
+
+    answer = run_agent(agent, mode, memory=Memory(), max_iterations=2)
+
+    assert agent.last_run_report.iterations == 2
+    assert agent.last_run_report.stop_reason == "max_iterations"
+    assert answer is not None
@@ -0,0 +1,62 @@
+import pytest
+
+from agent_builder.memory_builder import Memory
+from utils import llm_api
+from utils.llm_providers import FakeProvider
+from utils.token_ledger import TokenLedger, ledger_scope, set_ledger_iteration
+
+from conftest import ScriptedLLM, run_agent
+
+
+def test_entries_are_priced_and_attributed_to_the_scope():
+    ledger = TokenLedger(prices={"m": (1.0, 2.0)})
+    with ledger_scope(session_id="s", run_id="r1"):
+        set_ledger_iteration(0)
+        ledger.record("routing", "m", 1000, 500)
+        with ledger_scope(agent="sub"):
+            ledger.record("feedback", "m", 2000, 0, cached=True)
+    ledger.record("plan", "unpriced", 10, 10)
+
+    routing, feedback, plan = ledger.entries()
+    assert routing.cost == pytest.approx(0.002) and routing.iteration == 0
+    assert (feedback.cost, feedback.agent, feedback.run_id) == (0.0, "sub", "r1")
+    assert (plan.cost, plan.session_id) == (0.0, None)
+
+
+def test_totals_and_top_group_by_any_field():
+    ledger = TokenLedger(prices={"m": (1.0, 1.0)})
+    ledger.record("routing", "m", 100, 10)
+    ledger.record("routing", "m", 100, 10)
+    ledger.record("feedback", "m", 50, 5, cached=True)
+
+    totals = ledger.totals()
+    assert totals["routing"]["calls"] == 2 and totals["routing"]["total_tokens"] == 220
+    assert totals["feedback"]["cached_calls"] == 1
+    assert ledger.top(1, by=("call_site", "model"))[0][0] == ("routing", "m")
+    assert ledger.summary()["total_tokens"] == 275
+
+
+def test_provider_usage_is_preferred_over_the_estimate():
+    provider = FakeProvider(responses=[{"content": '{"a": 1}', "usage": {"prompt_tokens": 7, "completion_tokens": 3}}])
+
+    with ledger_scope(session_id="usage-test"):
+        llm_api.infer_llm_json("question", provider=provider)
+
+    entry, = llm_api.get_token_ledger().entries(session_id="usage-test")
+    assert (entry.call_site, entry.prompt_tokens, entry.completion_tokens, entry.estimated) == ("json", 7, 3, False)
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_agent_run_is_reported_per_call_site_and_iteration(make_agent, mode):
+    script = ScriptedLLM()
+    agent = make_agent(script)
+
+    run_agent(agent, mode, memory=Memory(), session_id=f"ledger-{mode}")
+
+    entries = llm_api.get_token_ledger().entries(session_id=f"ledger-{mode}")
+    assert len(entries) == len(script.steps)
+    assert {e.run_id for e in entries} == {agent.last_run_id}
+    report = agent.usage_report()
+    assert report["calls"] == len(script.steps)
+    assert report["by_call_site"]["routing"]["calls"] == script.steps.count("routing")
+    assert set(report["by_iteration"]) >= {0, 1}
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from agent_builder.memory_builder import Memory
+from agent_builder.plan_builder import PlanStep
+from agent_builder.tool_speculation import call_key
+
+from conftest import ScriptedLLM, run_agent
+
+
+def slow_routing(step):
+    if step == "routing":
+        time.sleep(0.1)
+
+
+def speculating_agent(make_agent, script):
+    agent = make_agent(script, speculative_tools=True)
+    agent.resources.get_tool("lookup").side_effect_free = True
+    calls = []
+
+    def lookup(query):
+        calls.append(query)
+        return f"result for {query}"
+
+    agent.resources.get_tool("lookup").function = lookup
+    return agent, calls
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_predicted_call_runs_during_routing_and_is_claimed(make_agent, mode):
+    agent, calls = speculating_agent(make_agent, ScriptedLLM(on_step=slow_routing))
+    memory = Memory()
+
+    run_agent(agent, mode, memory=memory)
+
+    assert calls == ["x"]
+    assert agent.tool_speculator.stats["hits"] == 1
+    assert "result for x" in memory.view("tool_result")[0]["content"]
+
+
+@pytest.mark.parametrize("mode", ["run", "arun"])
+def test_mispredicted_call_is_discarded_and_the_selection_runs(make_agent, mode):
+    script = ScriptedLLM(plan=[{"action": "lookup(query='y')", "description": "look up y"}], on_step=slow_routing)
+    agent, calls = speculating_agent(make_agent, script)
+    memory = Memory()
+
+    run_agent(agent, mode, memory=memory)
+
+    assert sorted(calls) == ["x", "y"]
+    assert agent.tool_speculator.stats["hits"] == 0
+    assert agent.tool_speculator.stats["launched"] == 1
+    assert "result for x" in memory.view("tool_result")[0]["content"]
+
+
+def test_only_side_effect_free_tools_are_predicted(make_agent):
+    agent, _ = speculating_agent(make_agent, ScriptedLLM())
+    speculator = agent.tool_speculator
+    steps = [PlanStep(action="finish(message='m')", tool="finish", args={"message": "m"}),
+             PlanStep(action="lookup()", tool=None, args=None)]
+
+    tool, args = speculator.predict(steps, "the task", seen=set())
+
+    assert (tool.name, args) == ("lookup", {"query": "the task"})
+    assert speculator.predict(steps, "the task", seen={call_key("lookup", args)}) is None
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional
+
+from utils.llm_retry import RunCancelledError
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation of a run. `cancel()` is safe to call from any thread; the run stops at its
+    next check, and the LLM requests and tool calls it is waiting on are cancelled (see `run_cancellable`,
+    `wait_cancellable` and `await_cancellable`). A token created with a `parent` is cancelled together with
+    it, and reports the work it cancelled to it as well; sub-agent runs get such a child token.
+    """
+
+    def __init__(self, parent: "CancellationToken" = None):
+        self.parent = parent
+        self.reason: Optional[str] = None
+        self.cancelled_work: List[Dict[str, Any]] = []
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], Any]] = []
+        self._lock = threading.Lock()
+        self._created_at = time.monotonic()
+        self._unlink = parent.add_callback(lambda: self.cancel(parent.reason)) if parent is not None else None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled by the caller"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[WARN] cancellation callback failed: {e}")
+
+    def add_callback(self, callback: Callable[[], Any]) -> Callable[[], None]:
+        """Call `callback` on cancellation (immediately when already cancelled). Returns a function removing it."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback: Callable[[], Any]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def detach(self):
+        """Stop following the parent token (at the end of the run the token was created for)."""
+        if self._unlink is not None:
+            self._unlink()
+            self._unlink = None
+
+    def record(self, kind: str, name: str, state: str):
+        """Note work that was abandoned in flight ("aborted") or not started ("skipped") because of the cancellation."""
+        entry = {"kind": kind, "name": name, "state": state,
+                 "at_seconds": round(time.monotonic() - self._created_at, 3)}
+        with self._lock:
+            self.cancelled_work.append(entry)
+        if self.parent is not None:
+            self.parent.record(kind, name, state)
+
+    def raise_if_cancelled(self, kind: str = None, name: str = None):
+        if self.cancelled:
+            if kind is not None:
+                self.record(kind, name, "skipped")
+            raise RunCancelledError(f"Run cancelled: {self.reason}")
+
+
+_active_token: ContextVar[Optional[CancellationToken]] = ContextVar("active_cancellation_token", default=None)
+
+
+def current_cancellation_token() -> Optional[CancellationToken]:
+    return _active_token.get()
+
+
+@contextmanager
+def use_cancellation_token(token: Optional[CancellationToken]):
+    """
+    Run the block under a child of `token` (or of the enclosing run's token). Without either, the block is
+    not cancellable and None is yielded.
+    """
+    parent = token or _active_token.get()
+    if parent is None:
+        yield None
+        return
+    run_token = CancellationToken(parent=parent)
+    context_token = _active_token.set(run_token)
+    try:
+        yield run_token
+    finally:
+        _active_token.reset(context_token)
+        run_token.detach()
+
+
+def wait_cancellable(kind: str, name: str, future: Future) -> Any:
+    """
+    Wait for `future` so that a cancellation of the active token returns control at once with
+    `RunCancelledError`. The future is cancelled as well: work queued on an executor never starts, and a
+    coroutine scheduled with `run_cancellable` is cancelled on its loop (closing its request). Work already
+    running on an executor thread cannot be interrupted; it ends on its (bounded) pool's worker.
+    """
+    token = _active_token.get()
+    if token is None:
+        return future.result()
+
+    done = threading.Event()
+    future.add_done_callback(lambda _: done.set())
+    remove_callback = token.add_callback(done.set)
+    try:
+        done.wait()
+    finally:
+        remove_callback()
+    if future.done() and not future.cancelled():
+        return future.result()
+    future.cancel()
+    token.record(kind, name, "aborted")
+    raise RunCancelledError(f"Run cancelled: {token.reason}")
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _cancellation_loop() -> asyncio.AbstractEventLoop:
+    """The process-wide event loop (one daemon thread) that `run_cancellable` schedules coroutines on."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True, name="cancellable-io").start()
+        return _loop
+
+
+def run_cancellable(kind: str, name: str, coroutine: Coroutine[Any, Any, Any]) -> Any:
+    """
+    Run `coroutine` to completion from blocking code, cancellable through the active token. Without a token
+    it simply runs in a private event loop; with one it runs as a task of the shared cancellation loop, so
+    that cancelling the token cancels the task and with it the request it is awaiting (an async HTTP client
+    closes the connection), instead of leaving a blocking call running in a thread of its own.
+    """
+    token = _active_token.get()
+    if token is None:
+        return asyncio.run(coroutine)
+    if token.cancelled:
+        coroutine.close()
+        token.raise_if_cancelled(kind, name)
+    future = asyncio.run_coroutine_threadsafe(coroutine, _cancellation_loop())
+    return wait_cancellable(kind, name, future)
+
+
+async def await_cancellable(kind: str, name: str, awaitable: Awaitable[Any]) -> Any:
+    """Await `awaitable` as a task that is cancelled (closing its request) when the active token is."""
+    token = _active_token.get()
+    if token is None:
+        return await awaitable
+    if token.cancelled:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        token.raise_if_cancelled(kind, name)
+
+    task = asyncio.ensure_future(awaitable)
+    loop = asyncio.get_running_loop()
+    remove_callback = token.add_callback(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not (token.cancelled and task.cancelled()):
+            raise
+        token.record(kind, name, "aborted")
+        raise RunCancelledError(f"Run cancelled: {token.reason}")
+    finally:
+        remove_callback()
@@ -0,0 +1,131 @@
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.llm_retry import LLMContentError
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class RepairStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clean = 0
+        self.repaired = 0
+        self.failed = 0
+
+    def record(self, outcome: str):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            return {"clean": self.clean, "repaired": self.repaired, "failed": self.failed}
+
+
+repair_stats = RepairStats()
+
+
+def _close(fragment: str, stack: List[str], in_string: bool = False, escaped: bool = False) -> str:
+    """Terminate a truncated fragment: close the open string, drop a dangling comma, then close every bracket."""
+    if in_string:
+        fragment = (fragment[:-1] if escaped else fragment) + '"'
+    fragment = fragment.rstrip()
+    if fragment.endswith(","):
+        fragment = fragment[:-1]
+    elif fragment.endswith(":"):
+        fragment += " null"
+    return fragment + "".join(reversed(stack))
+
+
+def _scan_object(text: str, start: int) -> Tuple[str, List[Tuple[int, List[str]]], Optional[str]]:
+    """
+    Single pass over `text` from the `{` at `start`, dropping trailing commas and fixing mismatched
+    closers. Returns (complete_object_or_truncated_fragment, comma_cut_points, closed_candidate), where
+    closed_candidate is None when the object was complete.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    cut_points: List[Tuple[int, List[str]]] = []
+    in_string = escaped = False
+
+    for ch in text[start:]:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            out.append(stack.pop())
+            if not stack:
+                return "".join(out), cut_points, None
+            continue
+        elif ch == ",":
+            cut_points.append((len(out), list(stack)))
+        out.append(ch)
+
+    fragment = "".join(out)
+    return fragment, cut_points, _close(fragment, stack, in_string, escaped)
+
+
+def _loads_object(text: str) -> Optional[Dict[str, Any]]:
+    try:
+        value = json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def repair_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Salvage the first JSON object in an LLM response: prose or markdown fences around it, trailing
+    commas, raw newlines inside strings, mismatched closers and truncated output (unterminated string,
+    missing closers). A truncated object that still does not parse is cut back to its last complete
+    member. Returns None when nothing usable is found.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    fragment, cut_points, closed = _scan_object(text, start)
+    if closed is None:
+        return _loads_object(fragment)
+
+    value = _loads_object(closed)
+    if value is not None:
+        return value
+    for position, stack in reversed(cut_points):
+        value = _loads_object(_close(fragment[:position], stack))
+        if value is not None:
+            return value
+    return None
+
+
+def parse_json_object(text: str) -> Dict[str, Any]:
+    """Parse an LLM response as a JSON object, repairing it locally when needed. Raises LLMContentError."""
+    text = (text or "").strip()
+    value = _loads_object(text)
+    if value is not None:
+        repair_stats.record("clean")
+        return value
+
+    value = repair_json_object(text)
+    if value is not None:
+        repair_stats.record("repaired")
+        return value
+
+    repair_stats.record("failed")
+    raise LLMContentError(f"Could not parse a JSON object from LLM output: {text[:200]!r}")
@@ -1,21 +1,341 @@
+import itertools
 import json
 import os
-from typing import List, Dict, Any
-
-from openai import OpenAI
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Union, Callable, Iterator, AsyncIterator
 
 from agent_builder.tools_factory import ToolsFactory
+from utils.llm_cache import ResponseCache, make_cache_key, DEFAULT_CACHE_PATH
+from utils.json_repair import parse_json_object, repair_stats
+from utils.llm_governor import LLMGovernor, ModelLimits
+from utils.llm_hedging import Hedger, HedgePolicy
+from utils.llm_providers import LLMProvider, OpenAIProvider
+from utils.llm_retry import RetryPolicy, LLMContentError, call_with_retry, acall_with_retry, retry_stats, \
+    with_attempts, BudgetExhaustedError, RunCancelledError
+from utils.llm_tokens import estimate_message_tokens, count_tokens
+from utils.cancellation import current_cancellation_token, run_cancellable, await_cancellable
+from utils.run_budget import current_run_budget
+from utils.token_ledger import TokenLedger
 from utils.prompt_store import PromptStore
 
 os.environ[
     "OPENAI_API_KEY"] = "********"
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY")
-)
-
 prompt_store = PromptStore()
 
+# Named backends. The "openai" provider is created on first use so that importing this module
+# (or running against a FakeProvider / local endpoint) never requires OpenAI credentials.
+providers: Dict[str, LLMProvider] = {}
+default_provider_name = "openai"
+
+
+def register_provider(name: str, provider: LLMProvider, default: bool = False) -> LLMProvider:
+    providers[name] = provider
+    if default:
+        set_default_provider(name)
+    return provider
+
+
+def set_default_provider(provider: Union[str, LLMProvider]):
+    global default_provider_name
+    if isinstance(provider, LLMProvider):
+        register_provider(provider.name, provider)
+        provider = provider.name
+    default_provider_name = provider
+
+
+def get_provider(provider: Union[str, LLMProvider] = None) -> LLMProvider:
+    if isinstance(provider, LLMProvider):
+        return provider
+    name = provider or default_provider_name
+    if name not in providers:
+        if name != "openai":
+            raise ValueError(f"LLM provider '{name}' is not registered.")
+        providers[name] = OpenAIProvider(api_key=os.environ.get("OPENAI_API_KEY"))
+    return providers[name]
+
+
+response_cache = ResponseCache(disk_path=DEFAULT_CACHE_PATH)
+
+# Caching is opt-in per inference function, e.g. configure_cache(functions=["infer_llm_task_routing"]).
+cached_functions = set()
+
+
+def configure_cache(functions: List[str] = None,
+                    max_entries: int = None,
+                    ttl: float = None,
+                    disk_path: str = None,
+                    max_disk_entries: int = None):
+    global response_cache
+    if functions is not None:
+        cached_functions.clear()
+        cached_functions.update(functions)
+    if any(v is not None for v in (max_entries, ttl, disk_path, max_disk_entries)):
+        response_cache.close()
+        response_cache = ResponseCache(
+            max_entries=max_entries if max_entries is not None else response_cache.max_entries,
+            ttl=ttl if ttl is not None else response_cache.ttl,
+            disk_path=disk_path if disk_path is not None else response_cache.disk_path,
+            max_disk_entries=max_disk_entries if max_disk_entries is not None else response_cache.max_disk_entries
+        )
+    return response_cache
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    return response_cache.stats()
+
+
+# Admission control shared by every helper in this module; see configure_governor().
+governor = LLMGovernor()
+
+
+def configure_governor(limits: Dict[str, ModelLimits] = None,
+                       default_limits: ModelLimits = None,
+                       max_concurrency: int = None) -> LLMGovernor:
+    global governor
+    governor = LLMGovernor(
+        limits=limits if limits is not None else governor.limits,
+        default_limits=default_limits or governor.default_limits,
+        max_concurrency=max_concurrency or governor.max_concurrency
+    )
+    return governor
+
+
+def get_governor_stats() -> Dict[str, Any]:
+    return governor.stats()
+
+
+# Default retry policy plus optional per call site overrides; see configure_retry_policy().
+default_retry_policy = RetryPolicy()
+retry_policies: Dict[str, RetryPolicy] = {}
+
+
+def configure_retry_policy(policy: RetryPolicy, call_site: str = None):
+    global default_retry_policy
+    if call_site:
+        retry_policies[call_site] = policy
+    else:
+        default_retry_policy = policy
+
+
+def get_retry_stats() -> Dict[str, Any]:
+    return retry_stats.summary()
+
+
+def _retry_policy(call_site: str, num_retries: Optional[int]) -> RetryPolicy:
+    """The call site's policy; an explicit `num_retries` overrides its `max_attempts`."""
+    policy = retry_policies.get(call_site, default_retry_policy)
+    return policy if num_retries is None else with_attempts(policy, num_retries)
+
+
+def _pause_model(model: str) -> Callable[[float], None]:
+    return lambda seconds: governor.pause(model, seconds)
+
+
+def _usage_tokens(message: Dict[str, Any]):
+    usage = message.get("usage") or {}
+    return usage.get("total_tokens")
+
+
+# Request hedging is opt-in per call site, e.g. configure_hedging(call_sites=["routing", "selection"]).
+hedger = Hedger()
+hedged_call_sites = set()
+
+
+def configure_hedging(call_sites: List[str] = None, policy: HedgePolicy = None) -> Hedger:
+    global hedger
+    if call_sites is not None:
+        hedged_call_sites.clear()
+        hedged_call_sites.update(call_sites)
+    if policy is not None:
+        hedger = Hedger(policy=policy)
+    return hedger
+
+
+def get_hedging_stats() -> Dict[str, Any]:
+    return hedger.stats()
+
+
+# Every completion (cache hits included) is recorded here, attributed to the current ledger_scope().
+token_ledger = TokenLedger()
+
+
+def get_token_ledger() -> TokenLedger:
+    return token_ledger
+
+
+# Every completion made inside a track_usage() block is appended to that block's list (blocks nest).
+_usage_collectors: ContextVar[tuple] = ContextVar("llm_usage_collectors", default=())
+
+
+@contextmanager
+def track_usage() -> Iterator[List[Dict[str, Any]]]:
+    """
+    Collect {"call_site", "model", "prompt_tokens", "completion_tokens", "cached"} for each completion
+    made in the block. Token counts come from the provider's usage when reported, else from an estimate.
+    """
+    records = []
+    token = _usage_collectors.set(_usage_collectors.get() + (records,))
+    try:
+        yield records
+    finally:
+        _usage_collectors.reset(token)
+
+
+def _record_usage(call_site: str, params: Dict[str, Any], message: Dict[str, Any], cached: bool,
+                  latency: float = 0.0):
+    usage = message.get("usage") or {}
+    model = params["model"]
+    estimated = "prompt_tokens" not in usage or "completion_tokens" not in usage
+    if "prompt_tokens" in usage:
+        prompt_tokens = usage["prompt_tokens"]
+    else:
+        prompt_tokens = estimate_message_tokens(params["messages"], model,
+                                                params.get("functions") or params.get("tools"))
+    if "completion_tokens" in usage:
+        completion_tokens = usage["completion_tokens"]
+    else:
+        output = message.get("content") or json.dumps(message.get("tool_calls") or message.get("function_call") or "")
+        completion_tokens = count_tokens(output, model)
+    entry = token_ledger.record(call_site, model, prompt_tokens, completion_tokens, latency=latency, cached=cached,
+                                estimated=estimated)
+    budget = current_run_budget()
+    if budget is not None and not cached:
+        budget.record(prompt_tokens + completion_tokens, entry.cost)
+
+    record = {
+        "call_site": call_site,
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached": cached,
+    }
+    for records in _usage_collectors.get():
+        records.append(record)
+
+
+def _enforce_run_budget(params: Dict[str, Any], call_site: str = None):
+    """
+    Refuse new requests once the active run is cancelled or its budget is used up, and cap the request
+    timeout at the time left.
+    """
+    token = current_cancellation_token()
+    if token is not None:
+        token.raise_if_cancelled("llm", call_site)
+    budget = current_run_budget()
+    if budget is None:
+        return
+    budget.check()
+    remaining = budget.remaining_seconds()
+    if remaining is not None:
+        params["timeout"] = min(params.get("timeout") or remaining, remaining)
+
+
+def _stream_cancelled(call_site: str) -> bool:
+    token = current_cancellation_token()
+    if token is None or not token.cancelled:
+        return False
+    token.record("llm", call_site, "aborted")
+    return True
+
+
+def is_llm_error(result: Any) -> bool:
+    """True for the error values the helpers below return once retries are exhausted."""
+    if not isinstance(result, dict):
+        return False
+    return "Error" in result or str(result.get("tool", "")).lower() == "error"
+
+
+def _cache_lookup(function_name: str, backend: LLMProvider, use_cache: bool, refresh_cache: bool,
+                  params: Dict[str, Any]):
+    if use_cache is None:
+        use_cache = function_name in cached_functions
+    if not use_cache:
+        return None, None
+
+    cache_key = make_cache_key(provider=backend.name, **{k: v for k, v in params.items() if k != "timeout"})
+    cached = None if refresh_cache else response_cache.get(cache_key)
+    return cache_key, cached
+
+
+def _create_chat_completion(function_name: str, use_cache: bool = None, refresh_cache: bool = False,
+                            provider: Union[str, LLMProvider] = None, call_site: str = None,
+                            **params) -> Dict[str, Any]:
+    """
+    Run a chat completion and return the first choice as a plain dict
+    ({"content": ..., "function_call": {"name": ..., "arguments": ...} or None}),
+    going through the response cache when enabled for `function_name`.
+    `refresh_cache` skips the lookup but still stores the fresh response, which is what
+    retries use so that an unusable cached answer gets overwritten.
+    Requests that miss the cache are admitted through the governor under `call_site`'s priority class,
+    and hedged when `call_site` is in `hedged_call_sites`.
+    """
+    backend = get_provider(provider)
+    cache_key, cached = _cache_lookup(function_name, backend, use_cache, refresh_cache, params)
+    if cached is not None:
+        _record_usage(call_site, params, cached, cached=True)
+        return cached
+
+    _enforce_run_budget(params, call_site)
+    started_at = time.monotonic()
+    estimated_tokens = estimate_message_tokens(params["messages"], params["model"],
+                                               params.get("functions") or params.get("tools"))
+
+    def send() -> Dict[str, Any]:
+        with governor.acquire(params["model"], call_site,
+                              estimated_tokens + (params.get("max_tokens") or 0)) as ticket:
+            if current_cancellation_token() is None:
+                response = backend.chat(**params)
+            else:
+                response = run_cancellable("llm", call_site, backend.achat(**params))
+            ticket.actual_tokens = _usage_tokens(response)
+        return response
+
+    if call_site in hedged_call_sites:
+        message = hedger.call(send, params["model"], call_site)
+    else:
+        message = send()
+
+    _record_usage(call_site, params, message, cached=False, latency=time.monotonic() - started_at)
+    if cache_key:
+        response_cache.set(cache_key, message)
+    return message
+
+
+async def _acreate_chat_completion(function_name: str, use_cache: bool = None, refresh_cache: bool = False,
+                                   provider: Union[str, LLMProvider] = None, call_site: str = None,
+                                   **params) -> Dict[str, Any]:
+    backend = get_provider(provider)
+    cache_key, cached = _cache_lookup(function_name, backend, use_cache, refresh_cache, params)
+    if cached is not None:
+        _record_usage(call_site, params, cached, cached=True)
+        return cached
+
+    _enforce_run_budget(params, call_site)
+    started_at = time.monotonic()
+    estimated_tokens = estimate_message_tokens(params["messages"], params["model"],
+                                               params.get("functions") or params.get("tools"))
+
+    async def send() -> Dict[str, Any]:
+        ticket = await governor.aacquire(params["model"], call_site,
+                                         estimated_tokens + (params.get("max_tokens") or 0))
+        async with ticket:
+            response = await await_cancellable("llm", call_site, backend.achat(**params))
+            ticket.actual_tokens = _usage_tokens(response)
+        return response
+
+    if call_site in hedged_call_sites:
+        message = await hedger.acall(send, params["model"], call_site)
+    else:
+        message = await send()
+
+    _record_usage(call_site, params, message, cached=False, latency=time.monotonic() - started_at)
+    if cache_key:
+        response_cache.set(cache_key, message)
+    return message
+
 
 def extract_markdown_block(response: str, block_type: str = "json") -> str:
     if not '```' in response:
@@ -47,36 +367,119 @@ def to_openai_functions(tools_factory: ToolsFactory):
     return openai_funcs
 
 
+def _json_messages(prompt: str) -> List[Dict[str, Any]]:
+    return [
+        {"role": "system",
+         "content": "You are a helpful assistant. Always respond with a valid JSON object. Remove any backticks or line breaks from the output json string."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _parse_json_content(content: str, validator: Callable[[Dict[str, Any]], Any] = None) -> Dict[str, Any]:
+    """
+    Parse (and locally repair) the JSON object in `content`. When `validator` rejects the object's
+    shape the error is reported as a content error, so the retry loop re-asks the model.
+    """
+    res = parse_json_object(content)
+    if validator is not None:
+        try:
+            validator(res)
+        except ValueError as e:
+            raise LLMContentError(f"LLM output failed validation: {e}") from e
+    return res
+
+
+def get_json_repair_stats() -> Dict[str, int]:
+    return repair_stats.summary()
+
+
 def infer_llm_json(prompt: str,
                    model="gpt-4o",
                    temperature=0.2,
                    max_tokens=None,
-                   num_retries=3):
-    for i in range(num_retries):
-        try:
-            chat_completion = client.chat.completions.create(
-                messages=(
-                    {"role": "system",
-                     "content": "You are a helpful assistant. Always respond with a valid JSON object. Remove any backticks or line breaks from the output json string."},
-                    {"role": "user", "content": prompt}
-                ),
-                model=model,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                response_format={"type": "json_object"}
-            )
-            res_str = chat_completion.choices[0].message.content
-            res_str = res_str.replace("`", "")
-            res_str = res_str.replace("\n", "")
-            res_str = res_str.replace("json", "")
-            res = json.loads(res_str)
-            if type(res) == dict:
-                return res
-        except Exception as e:
-            if i == num_retries - 1:
-                return {
-                    "Error": {"message": f"LLM call failed: {e}"}
-                }
+                   timeout: float = None,
+                   num_retries: Optional[int] = None,
+                   use_cache: bool = None,
+                   provider: Union[str, LLMProvider] = None,
+                   call_site: str = "json",
+                   validator: Callable[[Dict[str, Any]], Any] = None):
+    """
+    `validator` (e.g. `normalize_plan`) checks the parsed object's shape; a rejected object is re-asked
+    under the retry policy instead of being returned.
+    """
+    def attempt(i: int) -> Dict[str, Any]:
+        message = _create_chat_completion(
+            "infer_llm_json",
+            use_cache=use_cache,
+            refresh_cache=i > 0,
+            provider=provider,
+            call_site=call_site,
+            messages=_json_messages(prompt),
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            response_format={"type": "json_object"}
+        )
+        return _parse_json_content(message["content"], validator)
+
+    try:
+        return call_with_retry(attempt, _retry_policy(call_site, num_retries), call_site, _pause_model(model))
+    except (BudgetExhaustedError, RunCancelledError):
+        raise
+    except Exception as e:
+        return {
+            "Error": {"message": f"LLM call failed: {e}"}
+        }
+
+
+async def ainfer_llm_json(prompt: str,
+                          model="gpt-4o",
+                          temperature=0.2,
+                          max_tokens=None,
+                          timeout: float = None,
+                          num_retries: Optional[int] = None,
+                          use_cache: bool = None,
+                          provider: Union[str, LLMProvider] = None,
+                          call_site: str = "json",
+                          validator: Callable[[Dict[str, Any]], Any] = None):
+    async def attempt(i: int) -> Dict[str, Any]:
+        message = await _acreate_chat_completion(
+            "infer_llm_json",
+            use_cache=use_cache,
+            refresh_cache=i > 0,
+            provider=provider,
+            call_site=call_site,
+            messages=_json_messages(prompt),
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            response_format={"type": "json_object"}
+        )
+        return _parse_json_content(message["content"], validator)
+
+    try:
+        return await acall_with_retry(attempt, _retry_policy(call_site, num_retries), call_site, _pause_model(model))
+    except (BudgetExhaustedError, RunCancelledError):
+        raise
+    except Exception as e:
+        return {
+            "Error": {"message": f"LLM call failed: {e}"}
+        }
+
+
+def _routing_prompt(task: str, plan: Dict, tools: List[Dict], agents: List[Dict] = None,
+                    turn_context: Dict[str, Any] = None, feedback: Dict[str, Any] = None) -> str:
+    prompt_values = {
+        "task": task,
+        "plan": plan,
+        "feedback": feedback,
+        "tools": tools,
+        "agents": agents,
+        "turn_context": turn_context if turn_context else None
+    }
+    return prompt_store.get_prompt("agent_routing_prompt", **prompt_values)
 
 
 def infer_llm_task_routing(
@@ -89,31 +492,47 @@ def infer_llm_task_routing(
         feedback: Dict[str, Any] = None,
         model: str = "gpt-4.1",
         max_tokens: int = None,
-        num_retries: int = 3
+        timeout: float = None,
+        num_retries: Optional[int] = None,
+        use_cache: bool = None,
+        provider: Union[str, LLMProvider] = None
 ):
-    prompt_values = {
-        "task": task,
-        "plan": plan,
-        "feedback": feedback,
-        "tools": tools,
-        "agents": agents,
-        "turn_context": turn_context if turn_context else None
-    }
-    formatted_prompt = prompt_store.get_prompt("agent_routing_prompt", **prompt_values)
+    formatted_prompt = _routing_prompt(task, plan, tools, agents, turn_context, feedback)
+    if use_cache is None:
+        use_cache = "infer_llm_task_routing" in cached_functions
     routing_response = infer_llm_json(prompt=formatted_prompt, model=model, temperature=0.0, max_tokens=max_tokens,
-                                      num_retries=num_retries)
+                                      timeout=timeout, num_retries=num_retries, use_cache=use_cache,
+                                      provider=provider, call_site="routing")
     return routing_response
 
 
-def infer_llm_tool_selection(
+async def ainfer_llm_task_routing(
         task: str,
         plan: Dict,
-        tools_factory: ToolsFactory,
+        tools: List[Dict],
+        agents: List[Dict] = None,
+        memory: List[Dict] = None,
         turn_context: Dict[str, Any] = None,
-        model: str = "gpt-4o",
-        max_tokens: int = 8096,
-        num_retries: int = 3
-) -> Dict[str, Any]:
+        feedback: Dict[str, Any] = None,
+        model: str = "gpt-4.1",
+        max_tokens: int = None,
+        timeout: float = None,
+        num_retries: Optional[int] = None,
+        use_cache: bool = None,
+        provider: Union[str, LLMProvider] = None
+):
+    formatted_prompt = _routing_prompt(task, plan, tools, agents, turn_context, feedback)
+    if use_cache is None:
+        use_cache = "infer_llm_task_routing" in cached_functions
+    routing_response = await ainfer_llm_json(prompt=formatted_prompt, model=model, temperature=0.0,
+                                             max_tokens=max_tokens, timeout=timeout, num_retries=num_retries,
+                                             use_cache=use_cache, provider=provider, call_site="routing")
+    return routing_response
+
+
+def _tool_selection_params(task: str, plan: Dict, tools_factory: ToolsFactory, turn_context: Dict[str, Any],
+                           model: str, max_tokens: int, timeout: float = None,
+                           parallel_tool_calls: bool = True) -> Dict[str, Any]:
     system_instruction = (
         f"Your task : {task}\n\n"
         "Remove any backticks or line breaks from the output. "
@@ -121,7 +540,8 @@ def infer_llm_tool_selection(
         "RULES:\n"
         "- Your function_call arguments must be a JSON object containing *only* that function’s parameters.\n"
         "- Do NOT wrap any other keys (like “tool” or “args”) inside the arguments object.\n"
-        "- Invoke exactly one tool per response.\n"
+        "- When several tool calls are independent of each other (none needs another's result), invoke them "
+        "together in the same response; otherwise invoke exactly one tool.\n"
         "- Do not invent new tools.\n"
         "- Given the memory and the previous responses from the tool calls, you can reframe the task with additional information. If not, return the original `task` as the `reframed_task` value.\n"
         "- Except for any termination tool, do not call a tool multiple times."
@@ -142,14 +562,16 @@ def infer_llm_tool_selection(
         memory_block
     ]
 
-    functions = to_openai_functions(tools_factory)
+    tools = [{"type": "function", "function": function} for function in to_openai_functions(tools_factory)]
 
-    params = {
+    return {
         "model": model,
         "messages": messages,
-        "functions": functions,
-        "function_call": "auto",
+        "tools": tools,
+        "tool_choice": "auto",
+        "parallel_tool_calls": parallel_tool_calls,
         "max_tokens": max_tokens,
+        "timeout": timeout,
         "temperature": 0,
         "top_p": 1.0,
         "n": 1,
@@ -157,57 +579,292 @@ def infer_llm_tool_selection(
         "presence_penalty": 0,
     }
 
-    for attempt in range(num_retries):
+
+def _parse_function_call(call: Dict[str, Any]) -> Dict[str, Any]:
+    tool = call["name"]
+    raw_args = parse_json_object(call["arguments"] or "{}")
+
+    if (
+            isinstance(raw_args, dict)
+            and "tool" in raw_args
+            and "args" in raw_args
+            and raw_args["tool"] == tool
+    ):
+        args = raw_args["args"]
+    else:
+        args = raw_args
+
+    if isinstance(tool, str) and tool.startswith("functions."):
+        tool = tool.split(".", 1)[1]
+    return {"tool": tool, "args": args}
+
+
+def _parse_tool_selection(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns {"tool", "args"} for the (first) selected tool. When the model issued several tool calls in
+    one response, all of them are listed, in order, under "parallel_calls".
+    """
+    calls = msg.get("tool_calls") or ([msg["function_call"]] if msg["function_call"] else [])
+    if calls:
+        invocations = [_parse_function_call(call) for call in calls]
+        selection = dict(invocations[0])
+        if len(invocations) > 1:
+            selection["parallel_calls"] = invocations
+        return selection
+    else:
+        content = (msg["content"] or "").strip()
         try:
-            resp = client.chat.completions.create(**params)
-            msg = resp.choices[0].message
-
-            if msg.function_call:
-                call = msg.function_call
-                tool = call.name
-                raw_args = json.loads(call.arguments or "{}")
-
-                if (
-                        isinstance(raw_args, dict)
-                        and "tool" in raw_args
-                        and "args" in raw_args
-                        and raw_args["tool"] == tool
-                ):
-                    args = raw_args["args"]
-                else:
-                    args = raw_args
+            invocation = parse_json_object(content)
+            tool = invocation.get("tool") or invocation.get("name")
+            args = invocation.get("args") or invocation.get("arguments") or {}
+        except LLMContentError as e:
+            return {
+                "tool": "Error",
+                "args": {"message": f"error message : {e}\nmessage content : {content}"}
+            }
 
-            else:
-                content = (msg.content or "").strip()
-                try:
-                    invocation = json.loads(content)
-                    tool = invocation.get("tool") or invocation.get("name")
-                    args = invocation.get("args") or invocation.get("arguments") or {}
-                except json.JSONDecodeError as e:
-                    return {
-                        "tool": "Error",
-                        "args": {"message": f"error message : {e}\nmessage content : {content}"}
-                    }
-
-            if isinstance(tool, str) and tool.startswith("functions."):
-                tool = tool.split(".", 1)[1]
-
-            return {"tool": tool, "args": args}
-
-        except Exception as e:
-            if attempt == num_retries - 1:
-                return {
-                    "tool": "error",
-                    "args": {"message": f"LLM call failed: {e}"}
-                }
-    return {"tool": "error", "args": {"message": "Unknown inference error"}}
+    if isinstance(tool, str) and tool.startswith("functions."):
+        tool = tool.split(".", 1)[1]
 
+    return {"tool": tool, "args": args}
 
-def infer_llm_generation(prompt: str,
-                         model="gpt-4o",
-                         temperature=0.2,
-                         max_tokens=None,
-                         num_retries=3):
+
+def infer_llm_tool_selection(
+        task: str,
+        plan: Dict,
+        tools_factory: ToolsFactory,
+        turn_context: Dict[str, Any] = None,
+        model: str = "gpt-4o",
+        max_tokens: int = 8096,
+        timeout: float = None,
+        num_retries: Optional[int] = None,
+        use_cache: bool = None,
+        provider: Union[str, LLMProvider] = None,
+        parallel_tool_calls: bool = True
+) -> Dict[str, Any]:
+    params = _tool_selection_params(task, plan, tools_factory, turn_context, model, max_tokens, timeout,
+                                    parallel_tool_calls)
+
+    def attempt(i: int) -> Dict[str, Any]:
+        msg = _create_chat_completion("infer_llm_tool_selection", use_cache=use_cache,
+                                      refresh_cache=i > 0, provider=provider,
+                                      call_site="selection", **params)
+        return _parse_tool_selection(msg)
+
+    try:
+        return call_with_retry(attempt, _retry_policy("selection", num_retries), "selection", _pause_model(model))
+    except (BudgetExhaustedError, RunCancelledError):
+        raise
+    except Exception as e:
+        return {
+            "tool": "error",
+            "args": {"message": f"LLM call failed: {e}"}
+        }
+
+
+async def ainfer_llm_tool_selection(
+        task: str,
+        plan: Dict,
+        tools_factory: ToolsFactory,
+        turn_context: Dict[str, Any] = None,
+        model: str = "gpt-4o",
+        max_tokens: int = 8096,
+        timeout: float = None,
+        num_retries: Optional[int] = None,
+        use_cache: bool = None,
+        provider: Union[str, LLMProvider] = None,
+        parallel_tool_calls: bool = True
+) -> Dict[str, Any]:
+    params = _tool_selection_params(task, plan, tools_factory, turn_context, model, max_tokens, timeout,
+                                    parallel_tool_calls)
+
+    async def attempt(i: int) -> Dict[str, Any]:
+        msg = await _acreate_chat_completion("infer_llm_tool_selection", use_cache=use_cache,
+                                             refresh_cache=i > 0, provider=provider,
+                                             call_site="selection", **params)
+        return _parse_tool_selection(msg)
+
+    try:
+        return await acall_with_retry(attempt, _retry_policy("selection", num_retries), "selection",
+                                      _pause_model(model))
+    except (BudgetExhaustedError, RunCancelledError):
+        raise
+    except Exception as e:
+        return {
+            "tool": "error",
+            "args": {"message": f"LLM call failed: {e}"}
+        }
+
+
+FUSED_ROUTING_INSTRUCTION = (
+    "RESPONSE MODE: instead of the JSON dictionary described above, answer with exactly one function call.\n"
+    "- To use a tool, call that tool's function directly, with arguments containing only that tool's parameters.\n"
+    "- To delegate to an agent, call `delegate_to_agent`.\n"
+    "- To respond to the user and stop, call `generate_response_and_terminate`.\n"
+    "All routing rules above still apply."
+)
+
+
+def _control_functions(agents: List[Dict] = None) -> List[Dict[str, Any]]:
+    terminate = {
+        "name": "generate_response_and_terminate",
+        "description": "Respond to the user and end the run.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "response": {"type": "string", "description": "The response to the user."},
+                "payload_ids": {"type": "array", "items": {"type": "string"},
+                                "description": "Payload ids whose data is needed to generate the response."},
+                "explanation": {"type": "string", "description": "Why the run ends here."}
+            },
+            "required": ["response"]
+        }
+    }
+    if not agents:
+        return [terminate]
+
+    delegate = {
+        "name": "delegate_to_agent",
+        "description": "Hand the task over to one of the available agents.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string", "enum": [agent["name"] for agent in agents]},
+                "reframed_task": {"type": "string", "description": "The task, reframed with any new information."},
+                "payload_ids": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["name", "reframed_task"]
+        }
+    }
+    return [delegate, terminate]
+
+
+def _fused_routing_params(task: str, plan: Dict, tools: List[Dict], tools_factory: ToolsFactory,
+                          agents: List[Dict] = None, turn_context: Dict[str, Any] = None,
+                          feedback: Dict[str, Any] = None, model: str = "gpt-4.1", max_tokens: int = None,
+                          timeout: float = None) -> Dict[str, Any]:
+    allowed = {tool["function"]["name"] for tool in tools or []}
+    functions = [f for f in to_openai_functions(tools_factory) if not allowed or f["name"] in allowed]
+    functions += _control_functions(agents)
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": _routing_prompt(task, plan, tools, agents, turn_context, feedback)},
+            {"role": "system", "content": FUSED_ROUTING_INSTRUCTION}
+        ],
+        "tools": [{"type": "function", "function": function} for function in functions],
+        "tool_choice": "auto",
+        # The decision is a single call: a tool, or one of the control functions.
+        "parallel_tool_calls": False,
+        "max_tokens": max_tokens,
+        "timeout": timeout,
+        "temperature": 0
+    }
+
+
+def _parse_fused_routing(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Map a fused routing answer onto the routing response shape used by `Agent.run`. A tool decision
+    carries the ready-to-execute invocation under "tool_call". A plain JSON answer is returned as an
+    ordinary routing response (without "tool_call"). Calls are parsed like tool selection answers; only
+    the first one is the decision.
+    """
+    calls = msg.get("tool_calls") or ([msg["function_call"]] if msg["function_call"] else [])
+    if not calls:
+        return parse_json_object(msg["content"] or "")
+
+    invocation = _parse_function_call(calls[0])
+    name, args = invocation["tool"] or "", invocation["args"]
+
+    if name == "generate_response_and_terminate":
+        return {
+            "type": "generate_response_and_terminate",
+            "name": "",
+            "response": {"text": args.get("response", ""), "payload_ids": args.get("payload_ids") or []},
+            "explanation": args.get("explanation", "")
+        }
+    if name == "delegate_to_agent":
+        return {
+            "type": "agent",
+            "name": args.get("name"),
+            "reframed_task": args.get("reframed_task"),
+            "payload_ids": args.get("payload_ids") or []
+        }
+    return {"type": "tool", "name": name, "tool_call": invocation}
+
+
+def infer_llm_fused_routing(
+        task: str,
+        plan: Dict,
+        tools: List[Dict],
+        tools_factory: ToolsFactory,
+        agents: List[Dict] = None,
+        turn_context: Dict[str, Any] = None,
+        feedback: Dict[str, Any] = None,
+        model: str = "gpt-4.1",
+        max_tokens: int = None,
+        timeout: float = None,
+        num_retries: Optional[int] = None,
+        use_cache: bool = None,
+        provider: Union[str, LLMProvider] = None
+) -> Dict[str, Any]:
+    """
+    Routing and tool selection in one function-calling request: the model either calls a tool with
+    its arguments, or one of the `delegate_to_agent` / `generate_response_and_terminate` control functions.
+    """
+    params = _fused_routing_params(task, plan, tools, tools_factory, agents, turn_context, feedback, model,
+                                   max_tokens, timeout)
+
+    def attempt(i: int) -> Dict[str, Any]:
+        msg = _create_chat_completion("infer_llm_fused_routing", use_cache=use_cache, refresh_cache=i > 0,
+                                      provider=provider, call_site="routing", **params)
+        return _parse_fused_routing(msg)
+
+    try:
+        return call_with_retry(attempt, _retry_policy("routing", num_retries), "routing", _pause_model(model))
+    except (BudgetExhaustedError, RunCancelledError):
+        raise
+    except Exception as e:
+        return {
+            "Error": {"message": f"LLM call failed: {e}"}
+        }
+
+
+async def ainfer_llm_fused_routing(
+        task: str,
+        plan: Dict,
+        tools: List[Dict],
+        tools_factory: ToolsFactory,
+        agents: List[Dict] = None,
+        turn_context: Dict[str, Any] = None,
+        feedback: Dict[str, Any] = None,
+        model: str = "gpt-4.1",
+        max_tokens: int = None,
+        timeout: float = None,
+        num_retries: Optional[int] = None,
+        use_cache: bool = None,
+        provider: Union[str, LLMProvider] = None
+) -> Dict[str, Any]:
+    params = _fused_routing_params(task, plan, tools, tools_factory, agents, turn_context, feedback, model,
+                                   max_tokens, timeout)
+
+    async def attempt(i: int) -> Dict[str, Any]:
+        msg = await _acreate_chat_completion("infer_llm_fused_routing", use_cache=use_cache, refresh_cache=i > 0,
+                                             provider=provider, call_site="routing", **params)
+        return _parse_fused_routing(msg)
+
+    try:
+        return await acall_with_retry(attempt, _retry_policy("routing", num_retries), "routing",
+                                      _pause_model(model))
+    except (BudgetExhaustedError, RunCancelledError):
+        raise
+    except Exception as e:
+        return {
+            "Error": {"message": f"LLM call failed: {e}"}
+        }
+
+
+def _generation_messages(prompt: str) -> List[Dict[str, Any]]:
     system_msg = {
         "role": "system",
         "content": (
@@ -216,22 +873,184 @@ def infer_llm_generation(prompt: str,
         )
     }
     user_msg = {"role": "user", "content": prompt}
+    return [system_msg, user_msg]
 
-    for i in range(num_retries):
-        try:
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[system_msg, user_msg],
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
-            return resp.choices[0].message.content
-
-        except Exception as e:
-            if i == num_retries - 1:
-                return {
-                    "tool": "error",
-                    "args": {"message": f"LLM call failed: {e}"}
-                }
-
-    return None
+
+def infer_llm_generation(prompt: str,
+                         model="gpt-4o",
+                         temperature=0.2,
+                         max_tokens=None,
+                         timeout: float = None,
+                         num_retries: Optional[int] = None,
+                         use_cache: bool = None,
+                         provider: Union[str, LLMProvider] = None,
+                         call_site: str = "generation"):
+    def attempt(i: int) -> str:
+        message = _create_chat_completion(
+            "infer_llm_generation",
+            use_cache=use_cache,
+            refresh_cache=i > 0,
+            provider=provider,
+            call_site=call_site,
+            model=model,
+            messages=_generation_messages(prompt),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout
+        )
+        return message["content"]
+
+    try:
+        return call_with_retry(attempt, _retry_policy(call_site, num_retries), call_site, _pause_model(model))
+    except (BudgetExhaustedError, RunCancelledError):
+        raise
+    except Exception as e:
+        return {
+            "tool": "error",
+            "args": {"message": f"LLM call failed: {e}"}
+        }
+
+
+async def ainfer_llm_generation(prompt: str,
+                                model="gpt-4o",
+                                temperature=0.2,
+                                max_tokens=None,
+                                timeout: float = None,
+                                num_retries: Optional[int] = None,
+                                use_cache: bool = None,
+                                provider: Union[str, LLMProvider] = None,
+                                call_site: str = "generation"):
+    async def attempt(i: int) -> str:
+        message = await _acreate_chat_completion(
+            "infer_llm_generation",
+            use_cache=use_cache,
+            refresh_cache=i > 0,
+            provider=provider,
+            call_site=call_site,
+            model=model,
+            messages=_generation_messages(prompt),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout
+        )
+        return message["content"]
+
+    try:
+        return await acall_with_retry(attempt, _retry_policy(call_site, num_retries), call_site, _pause_model(model))
+    except (BudgetExhaustedError, RunCancelledError):
+        raise
+    except Exception as e:
+        return {
+            "tool": "error",
+            "args": {"message": f"LLM call failed: {e}"}
+        }
+
+
+def _stream_params(model: str, prompt: str, temperature: float, max_tokens: int,
+                   timeout: float = None) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "messages": _generation_messages(prompt),
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "timeout": timeout
+    }
+
+
+def infer_llm_generation_stream(prompt: str,
+                                model="gpt-4o",
+                                temperature=0.2,
+                                max_tokens=None,
+                                timeout: float = None,
+                                num_retries: Optional[int] = None,
+                                use_cache: bool = None,
+                                provider: Union[str, LLMProvider] = None,
+                                call_site: str = "generation") -> Iterator[str]:
+    """
+    Streaming counterpart of `infer_llm_generation`: yields content deltas as they arrive.
+    Failures before the first delta are retried under the call site's retry policy; a failure
+    mid-stream is raised to the caller. A cache hit (cached under "infer_llm_generation") is
+    yielded as a single delta.
+    """
+    backend = get_provider(provider)
+    params = _stream_params(model, prompt, temperature, max_tokens, timeout)
+    cache_key, cached = _cache_lookup("infer_llm_generation", backend, use_cache, False, params)
+    if cached is not None:
+        _record_usage(call_site, params, cached, cached=True)
+        yield cached["content"]
+        return
+
+    _enforce_run_budget(params, call_site)
+    started_at = time.monotonic()
+    estimated_tokens = estimate_message_tokens(params["messages"], model)
+    chunks = []
+    with governor.acquire(model, call_site, estimated_tokens + (max_tokens or 0)):
+        def open_stream(i: int):
+            stream = iter(backend.stream(**params))
+            return next(stream, ""), stream
+
+        first, stream = call_with_retry(open_stream, _retry_policy(call_site, num_retries), call_site,
+                                        _pause_model(model))
+        for delta in itertools.chain([first], stream):
+            if _stream_cancelled(call_site):
+                getattr(stream, "close", lambda: None)()
+                raise RunCancelledError(f"Run cancelled: {current_cancellation_token().reason}")
+            if delta:
+                chunks.append(delta)
+                yield delta
+
+    message = {"content": "".join(chunks), "function_call": None, "usage": None}
+    _record_usage(call_site, params, message, cached=False, latency=time.monotonic() - started_at)
+    if cache_key:
+        response_cache.set(cache_key, message)
+
+
+async def ainfer_llm_generation_stream(prompt: str,
+                                       model="gpt-4o",
+                                       temperature=0.2,
+                                       max_tokens=None,
+                                       timeout: float = None,
+                                       num_retries: Optional[int] = None,
+                                       use_cache: bool = None,
+                                       provider: Union[str, LLMProvider] = None,
+                                       call_site: str = "generation") -> AsyncIterator[str]:
+    backend = get_provider(provider)
+    params = _stream_params(model, prompt, temperature, max_tokens, timeout)
+    cache_key, cached = _cache_lookup("infer_llm_generation", backend, use_cache, False, params)
+    if cached is not None:
+        _record_usage(call_site, params, cached, cached=True)
+        yield cached["content"]
+        return
+
+    _enforce_run_budget(params, call_site)
+    started_at = time.monotonic()
+    estimated_tokens = estimate_message_tokens(params["messages"], model)
+    chunks = []
+    ticket = await governor.aacquire(model, call_site, estimated_tokens + (max_tokens or 0))
+    async with ticket:
+        async def open_stream(i: int):
+            stream = backend.astream(**params).__aiter__()
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                first = ""
+            return first, stream
+
+        first, stream = await acall_with_retry(open_stream, _retry_policy(call_site, num_retries), call_site,
+                                               _pause_model(model))
+        if first:
+            chunks.append(first)
+            yield first
+        async for delta in stream:
+            if _stream_cancelled(call_site):
+                if hasattr(stream, "aclose"):
+                    await stream.aclose()
+                raise RunCancelledError(f"Run cancelled: {current_cancellation_token().reason}")
+            if delta:
+                chunks.append(delta)
+                yield delta
+
+    message = {"content": "".join(chunks), "function_call": None, "usage": None}
+    _record_usage(call_site, params, message, cached=False, latency=time.monotonic() - started_at)
+    if cache_key:
+        response_cache.set(cache_key, message)
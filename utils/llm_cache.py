@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent / ".cache" / "llm_cache.sqlite"
+
+
+def make_cache_key(model: str,
+                   messages: List[Dict[str, Any]],
+                   functions: List[Dict[str, Any]] = None,
+                   temperature: float = None,
+                   max_tokens: int = None,
+                   **options) -> str:
+    """
+    Build a stable cache key for a chat completion request.
+
+    The key covers the model, messages, functions, temperature and max_tokens. Any other request
+    option (response_format, function_call, ...) is folded in as well so that e.g. a JSON mode
+    request never shares an entry with a plain one.
+    """
+    key_material = {
+        "model": model,
+        "messages": list(messages),
+        "functions": functions,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "options": {k: v for k, v in options.items() if v is not None},
+    }
+    serialized = json.dumps(key_material, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match cache for LLM responses.
+
+    Two tiers: an in-process LRU (bounded by `max_entries`) in front of an optional sqlite file
+    (bounded by `max_disk_entries`). Entries older than `ttl` seconds are treated as misses and
+    dropped. Values must be JSON serializable.
+    """
+
+    def __init__(self,
+                 max_entries: int = 1024,
+                 ttl: Optional[float] = 24 * 60 * 60,
+                 disk_path: Optional[str] = None,
+                 max_disk_entries: int = 50000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = str(disk_path) if disk_path else None
+        self.max_disk_entries = max_disk_entries
+        self.items: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._conn = None
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.disk_path:
+            return None
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.disk_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self.items.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at, now):
+                    self.items.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                del self.items[key]
+
+            conn = self._connection()
+            if conn is not None:
+                row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                        conn.commit()
+                        value = json.loads(row[0])
+                        self._store_in_memory(key, value, row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._store_in_memory(key, value, now)
+            conn = self._connection()
+            if conn is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, default=str), now, now)
+                )
+                self._evict_disk(conn)
+                conn.commit()
+
+    def _store_in_memory(self, key: str, value: Any, created_at: float):
+        self.items[key] = (value, created_at)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_entries:
+            self.items.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self, conn: sqlite3.Connection):
+        if self.ttl is not None:
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,)
+            )
+            self.evictions += overflow
+
+    def clear(self):
+        with self._lock:
+            self.items.clear()
+            conn = self._connection()
+            if conn is not None:
+                conn.execute("DELETE FROM llm_cache")
+                conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.items),
+            }
@@ -0,0 +1,276 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Dict, Any, Optional
+
+from utils.cancellation import current_cancellation_token
+
+
+class Priority(IntEnum):
+    CRITICAL = 0
+    NORMAL = 1
+    LOW = 2
+
+
+# Routing and tool selection sit on the critical path of every turn; feedback and payload
+# descriptions are bookkeeping that can wait.
+CALL_SITE_PRIORITIES = {
+    "routing": Priority.CRITICAL,
+    "selection": Priority.CRITICAL,
+    "plan": Priority.NORMAL,
+    "context": Priority.NORMAL,
+    "generation": Priority.NORMAL,
+    "feedback": Priority.LOW,
+    "payload": Priority.LOW,
+}
+
+
+@dataclass
+class ModelLimits:
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate_per_minute`. A rate of None means unlimited."""
+
+    def __init__(self, rate_per_minute: Optional[float], capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0 if rate_per_minute else None
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be consumed (0 when it can be consumed now)."""
+        if self.rate is None:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        if self.rate is None:
+            return
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        if self.rate is None:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class GovernorTicket:
+    def __init__(self, governor: "LLMGovernor", model: str, call_site: str, estimated_tokens: int, waited: float):
+        self.governor = governor
+        self.model = model
+        self.call_site = call_site
+        self.estimated_tokens = estimated_tokens
+        self.waited = waited
+        self.actual_tokens = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.governor.release(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.governor.release(self)
+
+
+class LLMGovernor:
+    """
+    Process-wide admission control for LLM requests.
+
+    Each model has a request bucket and a token bucket (see `ModelLimits`); at most `max_concurrency`
+    requests are in flight across all models. Waiting requests are admitted strictly by priority class,
+    then FIFO, so routing calls overtake queued feedback / payload-description calls.
+    """
+
+    def __init__(self,
+                 limits: Dict[str, ModelLimits] = None,
+                 default_limits: ModelLimits = None,
+                 max_concurrency: int = 32,
+                 stats_window: int = 1000):
+        self.limits = dict(limits or {})
+        self.default_limits = default_limits or ModelLimits()
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._buckets: Dict[str, tuple] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._wait_samples = defaultdict(lambda: deque(maxlen=stats_window))
+        self._granted = defaultdict(int)
+        self._max_queue_depth = defaultdict(int)
+
+    def _buckets_for(self, model: str) -> tuple:
+        if model not in self._buckets:
+            limits = self.limits.get(model, self.default_limits)
+            self._buckets[model] = (TokenBucket(limits.requests_per_minute), TokenBucket(limits.tokens_per_minute))
+        return self._buckets[model]
+
+    def _model_wait(self, model: str, tokens: int) -> float:
+        request_bucket, token_bucket = self._buckets_for(model)
+        paused = self._paused_until.get(model, 0.0) - time.monotonic()
+        return max(paused, request_bucket.wait_time(1), token_bucket.wait_time(tokens))
+
+    def pause(self, model: str, seconds: float):
+        """Hold back new admissions for `model`, e.g. after the provider answered 429 with Retry-After."""
+        with self._condition:
+            self._paused_until[model] = max(self._paused_until.get(model, 0.0), time.monotonic() + seconds)
+
+    def _try_grant(self, waiter: tuple) -> float:
+        """Admit `waiter` if it is next in line. Returns 0 when granted, otherwise a suggested wait in seconds."""
+        priority, sequence, model, tokens = waiter
+        if self.in_flight >= self.max_concurrency:
+            return 0.05
+
+        for other in self._waiters:
+            if other[:2] < waiter[:2] and (other[2] == model or self._model_wait(other[2], other[3]) == 0):
+                return 0.01
+
+        wait = self._model_wait(model, tokens)
+        if wait > 0:
+            return wait
+
+        request_bucket, token_bucket = self._buckets_for(model)
+        request_bucket.consume(1)
+        token_bucket.consume(tokens)
+        self._waiters.remove(waiter)
+        heapq.heapify(self._waiters)
+        self.in_flight += 1
+        return 0.0
+
+    def _enqueue(self, priority: Priority, model: str, tokens: int) -> tuple:
+        waiter = (int(priority), next(self._sequence), model, tokens)
+        heapq.heappush(self._waiters, waiter)
+        depth = sum(1 for w in self._waiters if w[0] == priority)
+        self._max_queue_depth[Priority(priority).name] = max(self._max_queue_depth[Priority(priority).name], depth)
+        return waiter
+
+    def _granted_ticket(self, model: str, call_site: str, priority: Priority, tokens: int,
+                        started_at: float) -> GovernorTicket:
+        waited = time.monotonic() - started_at
+        self._wait_samples[call_site].append(waited)
+        self._granted[Priority(priority).name] += 1
+        return GovernorTicket(self, model, call_site, tokens, waited)
+
+    def _withdraw(self, waiter: tuple):
+        """Remove a waiter that gives up (interrupted, failed or cancelled run), so it blocks nobody behind it."""
+        with self._condition:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            self._condition.notify_all()
+
+    def _notify(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def acquire(self, model: str, call_site: str = None, estimated_tokens: int = 0,
+                priority: Priority = None) -> GovernorTicket:
+        """
+        Wait for admission. A request of a cancelled run stops queueing and raises `RunCancelledError`; a
+        waiter that leaves in any way other than being admitted is withdrawn from the queue.
+        """
+        call_site = call_site or "default"
+        priority = priority if priority is not None else CALL_SITE_PRIORITIES.get(call_site, Priority.NORMAL)
+        started_at = time.monotonic()
+        token = current_cancellation_token()
+        remove_callback = token.add_callback(self._notify) if token is not None else None
+        with self._condition:
+            waiter = self._enqueue(priority, model, estimated_tokens)
+        try:
+            with self._condition:
+                while True:
+                    if token is not None:
+                        token.raise_if_cancelled("llm", call_site)
+                    wait = self._try_grant(waiter)
+                    if wait == 0:
+                        self._condition.notify_all()
+                        return self._granted_ticket(model, call_site, priority, estimated_tokens, started_at)
+                    self._condition.wait(timeout=min(wait, 1.0))
+        except BaseException:
+            self._withdraw(waiter)
+            raise
+        finally:
+            if remove_callback is not None:
+                remove_callback()
+
+    async def aacquire(self, model: str, call_site: str = None, estimated_tokens: int = 0,
+                       priority: Priority = None) -> GovernorTicket:
+        call_site = call_site or "default"
+        priority = priority if priority is not None else CALL_SITE_PRIORITIES.get(call_site, Priority.NORMAL)
+        started_at = time.monotonic()
+        token = current_cancellation_token()
+        with self._condition:
+            waiter = self._enqueue(priority, model, estimated_tokens)
+        try:
+            while True:
+                if token is not None:
+                    token.raise_if_cancelled("llm", call_site)
+                with self._condition:
+                    wait = self._try_grant(waiter)
+                    if wait == 0:
+                        self._condition.notify_all()
+                        return self._granted_ticket(model, call_site, priority, estimated_tokens, started_at)
+                await asyncio.sleep(min(wait, 0.05))
+        except BaseException:
+            self._withdraw(waiter)
+            raise
+
+    def release(self, ticket: GovernorTicket):
+        with self._condition:
+            self.in_flight -= 1
+            if ticket.actual_tokens is not None:
+                _, token_bucket = self._buckets_for(ticket.model)
+                difference = ticket.actual_tokens - ticket.estimated_tokens
+                if difference > 0:
+                    token_bucket.consume(difference)
+                elif difference < 0:
+                    token_bucket.refund(-difference)
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            queue_depth = {p.name: 0 for p in Priority}
+            for waiter in self._waiters:
+                queue_depth[Priority(waiter[0]).name] += 1
+
+            wait_times = {}
+            for call_site, samples in self._wait_samples.items():
+                ordered = sorted(samples)
+                wait_times[call_site] = {
+                    "count": len(ordered),
+                    "mean": sum(ordered) / len(ordered),
+                    "p50": ordered[len(ordered) // 2],
+                    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "max": ordered[-1],
+                }
+
+            return {
+                "in_flight": self.in_flight,
+                "queue_depth": queue_depth,
+                "max_queue_depth": dict(self._max_queue_depth),
+                "granted": dict(self._granted),
+                "wait_times": wait_times,
+            }
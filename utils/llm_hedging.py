@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Awaitable, Tuple
+
+
+@dataclass
+class HedgePolicy:
+    """
+    percentile: latency percentile (per model and call site) after which a duplicate request is sent.
+    min_delay / max_delay: clamp for the learned hedge delay (seconds).
+    default_delay: hedge delay used until `min_samples` latencies have been observed.
+    max_extra_ratio: cap on duplicates as a fraction of all hedge-eligible requests.
+    max_inflight: cap on hedged requests whose two copies have not both finished; a blocking loser keeps
+        its provider request (and concurrency slot) until it returns.
+    """
+    percentile: float = 0.9
+    min_delay: float = 0.25
+    max_delay: float = 15.0
+    default_delay: float = 4.0
+    min_samples: int = 20
+    max_extra_ratio: float = 0.1
+    window: int = 200
+    max_inflight: int = 4
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, key: Tuple[str, str], latency: float):
+        with self._lock:
+            self._samples[key].append(latency)
+
+    def percentile(self, key: Tuple[str, str], percentile: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+
+class Hedger:
+    """
+    Sends a duplicate of a slow request once it has been outstanding longer than the learned
+    percentile latency for its (model, call site); whichever copy finishes first wins. In async
+    code the losing task is cancelled. A blocking call already running in a worker thread cannot be
+    interrupted; its result is simply discarded, and no new hedge is sent while `max_inflight` hedged
+    requests are still running.
+
+    The learned latency is that of the primary requests: when a hedge wins, the primary's elapsed time
+    is recorded as a (censored) lower bound of its latency, so hedging does not lower its own delay.
+    """
+
+    def __init__(self, policy: HedgePolicy = None, max_workers: int = 16):
+        self.policy = policy or HedgePolicy()
+        self.latencies = LatencyTracker(self.policy.window)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.hedges = defaultdict(int)
+        self.hedge_wins = defaultdict(int)
+        self.inflight = 0
+
+    def hedge_delay(self, key: Tuple[str, str]) -> float:
+        learned = self.latencies.percentile(key, self.policy.percentile, self.policy.min_samples)
+        delay = learned if learned is not None else self.policy.default_delay
+        return min(self.policy.max_delay, max(self.policy.min_delay, delay))
+
+    def _allow_hedge(self, key: Tuple[str, str]) -> bool:
+        with self._lock:
+            total_requests = sum(self.requests.values())
+            total_hedges = sum(self.hedges.values())
+            if total_hedges + 1 > self.policy.max_extra_ratio * total_requests:
+                return False
+            if self.inflight >= self.policy.max_inflight:
+                return False
+            self.hedges[key] += 1
+            self.inflight += 1
+            return True
+
+    def _release_when_done(self, *futures):
+        """Count the hedged request as in flight until both of its copies have finished."""
+        remaining = [len(futures)]
+
+        def done(_):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    self.inflight -= 1
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def _timed(self, fn: Callable[[], Any]) -> Tuple[Any, float]:
+        started_at = time.monotonic()
+        result = fn()
+        return result, time.monotonic() - started_at
+
+    def call(self, fn: Callable[[], Any], model: str, call_site: str) -> Any:
+        key = (model, call_site)
+        with self._lock:
+            self.requests[key] += 1
+
+        started_at = time.monotonic()
+        primary = self._executor.submit(contextvars.copy_context().run, self._timed, fn)
+        done, _ = wait([primary], timeout=self.hedge_delay(key))
+        if done or not self._allow_hedge(key):
+            result, latency = primary.result()
+            self.latencies.record(key, latency)
+            return result
+
+        hedge = self._executor.submit(contextvars.copy_context().run, self._timed, fn)
+        self._release_when_done(primary, hedge)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                result, latency = future.result()
+                if future is hedge:
+                    latency = time.monotonic() - started_at
+                    with self._lock:
+                        self.hedge_wins[key] += 1
+                self.latencies.record(key, latency)
+                return result
+        raise error
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], model: str, call_site: str) -> Any:
+        key = (model, call_site)
+        with self._lock:
+            self.requests[key] += 1
+
+        async def timed():
+            started_at = time.monotonic()
+            result = await fn()
+            return result, time.monotonic() - started_at
+
+        started_at = time.monotonic()
+        primary = asyncio.ensure_future(timed())
+        pending = {primary}
+        try:
+            # Cancelling the caller, at any await below, cancels whichever copies are still running.
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay(key))
+            if done or not self._allow_hedge(key):
+                result, latency = await primary
+                self.latencies.record(key, latency)
+                return result
+
+            hedge = asyncio.ensure_future(timed())
+            self._release_when_done(primary, hedge)
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    result, latency = task.result()
+                    if task is hedge:
+                        latency = time.monotonic() - started_at
+                        with self._lock:
+                            self.hedge_wins[key] += 1
+                    self.latencies.record(key, latency)
+                    return result
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = set(self.requests) | set(self.hedges)
+            return {
+                f"{model}:{call_site}": {
+                    "requests": self.requests[(model, call_site)],
+                    "hedges": self.hedges[(model, call_site)],
+                    "hedge_wins": self.hedge_wins[(model, call_site)],
+                    "hedge_delay": round(self.hedge_delay((model, call_site)), 3),
+                }
+                for model, call_site in keys
+            }
@@ -0,0 +1,312 @@
+import asyncio
+import json
+import re
+import weakref
+from collections import deque
+from typing import List, Dict, Any, Iterator, AsyncIterator, Callable, Optional, Union
+
+
+class LLMProvider:
+    """
+    Backend used by the utils/llm_api helpers.
+
+    Every method returns the first choice as a plain dict:
+        {"content": str | None, "function_call": {"name": ..., "arguments": ...} | None,
+         "tool_calls": [{"id": ..., "name": ..., "arguments": ...}, ...] | None, "usage": dict | None}
+    so the helpers (and the response cache) never depend on a particular SDK's response objects.
+    """
+    name = "base"
+
+    def chat(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def chat_json(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        return self.chat(messages, model, response_format={"type": "json_object"}, **params)
+
+    def chat_with_functions(self, messages: List[Dict[str, Any]], model: str, functions: List[Dict[str, Any]],
+                            function_call: Any = "auto", **params) -> Dict[str, Any]:
+        return self.chat(messages, model, functions=functions, function_call=function_call, **params)
+
+    def stream(self, messages: List[Dict[str, Any]], model: str, **params) -> Iterator[str]:
+        """Yield content deltas. Falls back to a single delta for providers without native streaming."""
+        message = self.chat(messages, model, **params)
+        if message.get("content"):
+            yield message["content"]
+
+    async def achat(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        """Async `chat`. Providers without a native async client run the blocking call in a worker thread."""
+        return await asyncio.to_thread(self.chat, messages, model, **params)
+
+    async def astream(self, messages: List[Dict[str, Any]], model: str, **params) -> AsyncIterator[str]:
+        message = await self.achat(messages, model, **params)
+        if message.get("content"):
+            yield message["content"]
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+def _normalize_message(message: Dict[str, Any], usage: Dict[str, Any] = None) -> Dict[str, Any]:
+    function_call = message.get("function_call")
+    if function_call:
+        function_call = {"name": function_call.get("name"), "arguments": function_call.get("arguments")}
+    tool_calls = []
+    for call in message.get("tool_calls") or []:
+        function = call.get("function") or call
+        tool_calls.append({"id": call.get("id"), "name": function.get("name"), "arguments": function.get("arguments")})
+    return {
+        "content": message.get("content"),
+        "function_call": function_call or None,
+        "tool_calls": tool_calls or None,
+        "usage": usage or None,
+    }
+
+
+class OpenAIProvider(LLMProvider):
+    """
+    Provider backed by the official `openai` SDK. The SDK's underlying httpx client is built with
+    explicit pool limits so that keep-alive and pool size can be tuned per provider.
+    """
+    name = "openai"
+
+    def __init__(self,
+                 api_key: str = None,
+                 base_url: str = None,
+                 timeout: float = 60.0,
+                 pool_size: int = 20,
+                 max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30.0):
+        import httpx
+        from openai import OpenAI
+
+        self._client_options = {
+            "api_key": api_key,
+            "base_url": base_url,
+            "timeout": timeout,
+            "limits": httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        }
+        self.http_client = httpx.Client(limits=self._client_options["limits"], timeout=timeout)
+        # Retries are handled (and classified) by utils.llm_retry, so the SDK must not retry on its own.
+        self.client = OpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client, max_retries=0)
+        # Async connections belong to the event loop that opened them, hence one client per loop
+        # (the caller's loops and the loop cancellable blocking calls run on).
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            import httpx
+            from openai import AsyncOpenAI
+
+            http_client = httpx.AsyncClient(limits=self._client_options["limits"],
+                                            timeout=self._client_options["timeout"])
+            self._async_clients[loop] = (http_client, AsyncOpenAI(api_key=self._client_options["api_key"],
+                                                                  base_url=self._client_options["base_url"],
+                                                                  http_client=http_client,
+                                                                  max_retries=0))
+        return self._async_clients[loop][1]
+
+    def chat(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        params = {k: v for k, v in params.items() if v is not None}
+        completion = self.client.chat.completions.create(model=model, messages=list(messages), **params)
+        usage = completion.usage.model_dump() if getattr(completion, "usage", None) else None
+        return _normalize_message(completion.choices[0].message.model_dump(), usage)
+
+    def stream(self, messages: List[Dict[str, Any]], model: str, **params) -> Iterator[str]:
+        params = {k: v for k, v in params.items() if v is not None}
+        chunks = self.client.chat.completions.create(model=model, messages=list(messages), stream=True, **params)
+        for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def achat(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        params = {k: v for k, v in params.items() if v is not None}
+        completion = await self._async_client().chat.completions.create(model=model, messages=list(messages),
+                                                                        **params)
+        usage = completion.usage.model_dump() if getattr(completion, "usage", None) else None
+        return _normalize_message(completion.choices[0].message.model_dump(), usage)
+
+    async def astream(self, messages: List[Dict[str, Any]], model: str, **params) -> AsyncIterator[str]:
+        params = {k: v for k, v in params.items() if v is not None}
+        chunks = await self._async_client().chat.completions.create(model=model, messages=list(messages),
+                                                                    stream=True, **params)
+        async for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def close(self):
+        self.http_client.close()
+
+    async def aclose(self):
+        clients = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if clients is not None:
+            await clients[0].aclose()
+
+
+class HTTPProvider(LLMProvider):
+    """
+    Minimal client for any OpenAI-compatible `/chat/completions` endpoint (vLLM, llama.cpp server,
+    Azure/OpenAI proxies, ...) over a pooled, keep-alive httpx client.
+    """
+    name = "http"
+
+    def __init__(self,
+                 base_url: str,
+                 api_key: str = None,
+                 timeout: float = 60.0,
+                 pool_size: int = 20,
+                 max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30.0,
+                 headers: Dict[str, str] = None):
+        import httpx
+
+        self.base_url = base_url.rstrip("/")
+        request_headers = {"Content-Type": "application/json"}
+        if api_key:
+            request_headers["Authorization"] = f"Bearer {api_key}"
+        request_headers.update(headers or {})
+
+        self._client_options = {
+            "base_url": self.base_url,
+            "headers": request_headers,
+            "timeout": timeout,
+            "limits": httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        }
+        self.client = httpx.Client(**self._client_options)
+        # One async client per event loop, as its connections belong to the loop that opened them.
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            import httpx
+            self._async_clients[loop] = httpx.AsyncClient(**self._client_options)
+        return self._async_clients[loop]
+
+    @staticmethod
+    def _parse_stream_line(line: str) -> Optional[str]:
+        """Return the content delta carried by one SSE line, "" for non-content lines and None at [DONE]."""
+        if not line.startswith("data:"):
+            return ""
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return None
+        chunk = json.loads(data)
+        choices = chunk.get("choices") or []
+        return (choices[0].get("delta", {}).get("content") or "") if choices else ""
+
+    def _payload(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        payload = {"model": model, "messages": list(messages)}
+        payload.update({k: v for k, v in params.items() if v is not None})
+        return payload
+
+    def chat(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        timeout = params.pop("timeout", None)
+        response = self.client.post("/chat/completions", json=self._payload(messages, model, **params),
+                                    **({"timeout": timeout} if timeout else {}))
+        response.raise_for_status()
+        body = response.json()
+        return _normalize_message(body["choices"][0]["message"], body.get("usage"))
+
+    def stream(self, messages: List[Dict[str, Any]], model: str, **params) -> Iterator[str]:
+        timeout = params.pop("timeout", None)
+        payload = self._payload(messages, model, stream=True, **params)
+        with self.client.stream("POST", "/chat/completions", json=payload,
+                                **({"timeout": timeout} if timeout else {})) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                delta = self._parse_stream_line(line)
+                if delta is None:
+                    break
+                if delta:
+                    yield delta
+
+    async def achat(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        timeout = params.pop("timeout", None)
+        response = await self._async_client().post("/chat/completions",
+                                                   json=self._payload(messages, model, **params),
+                                                   **({"timeout": timeout} if timeout else {}))
+        response.raise_for_status()
+        body = response.json()
+        return _normalize_message(body["choices"][0]["message"], body.get("usage"))
+
+    async def astream(self, messages: List[Dict[str, Any]], model: str, **params) -> AsyncIterator[str]:
+        timeout = params.pop("timeout", None)
+        payload = self._payload(messages, model, stream=True, **params)
+        async with self._async_client().stream("POST", "/chat/completions", json=payload,
+                                               **({"timeout": timeout} if timeout else {})) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                delta = self._parse_stream_line(line)
+                if delta is None:
+                    break
+                if delta:
+                    yield delta
+
+    def close(self):
+        self.client.close()
+
+    async def aclose(self):
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+class FakeProvider(LLMProvider):
+    """
+    Local stand-in that never touches the network.
+
+    Responses are taken, in order, from `responses`; once those run out `responder(messages, model, **params)`
+    is called, and failing that `default_response` is returned. A response may be a string (used as the
+    message content) or a dict with `content` / `function_call` / `tool_calls`. Every request is recorded
+    in `calls`.
+    """
+    name = "fake"
+
+    def __init__(self,
+                 responses: List[Union[str, Dict[str, Any]]] = None,
+                 responder: Optional[Callable[..., Union[str, Dict[str, Any]]]] = None,
+                 default_response: Union[str, Dict[str, Any]] = "{}"):
+        self.responses = deque(responses or [])
+        self.responder = responder
+        self.default_response = default_response
+        self.calls: List[Dict[str, Any]] = []
+
+    def add_response(self, response: Union[str, Dict[str, Any]]):
+        self.responses.append(response)
+
+    def chat(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        self.calls.append({"messages": list(messages), "model": model, **params})
+        if self.responses:
+            response = self.responses.popleft()
+        elif self.responder:
+            response = self.responder(messages, model, **params)
+        else:
+            response = self.default_response
+
+        if isinstance(response, str):
+            response = {"content": response}
+        return _normalize_message(response, response.get("usage"))
+
+    def stream(self, messages: List[Dict[str, Any]], model: str, **params) -> Iterator[str]:
+        content = self.chat(messages, model, **params).get("content") or ""
+        for token in re.findall(r"\S+\s*|\s+", content):
+            yield token
+
+    async def achat(self, messages: List[Dict[str, Any]], model: str, **params) -> Dict[str, Any]:
+        return self.chat(messages, model, **params)
+
+    async def astream(self, messages: List[Dict[str, Any]], model: str, **params) -> AsyncIterator[str]:
+        for token in self.stream(messages, model, **params):
+            yield token
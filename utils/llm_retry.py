@@ -0,0 +1,233 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from email.utils import parsedate_to_datetime
+from enum import Enum
+from typing import Any, Callable, Dict, Optional, Awaitable
+
+
+class ErrorClass(Enum):
+    TRANSIENT = "transient"
+    RATE_LIMIT = "rate_limit"
+    CONTENT = "content"
+    FATAL = "fatal"
+
+
+class LLMContentError(ValueError):
+    """The provider answered, but the answer could not be used (unparsable or wrongly shaped output)."""
+
+
+class BudgetExhaustedError(RuntimeError):
+    """The run's budget (see `utils.run_budget`) is used up; no further request is sent."""
+
+
+class RunCancelledError(RuntimeError):
+    """The run was cancelled (see `utils.cancellation`); the request was not sent or was abandoned."""
+
+
+TRANSIENT_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "InternalServerError", "ServiceUnavailableError",
+    "TransportError", "TimeoutException", "ConnectError", "ReadTimeout", "RemoteProtocolError",
+}
+RATE_LIMIT_ERROR_NAMES = {"RateLimitError"}
+CONTENT_ERROR_TYPES = (LLMContentError, json.JSONDecodeError)
+# Bugs in the calling code (parsers, validators): retrying would only repeat them.
+PROGRAMMING_ERROR_TYPES = (KeyError, TypeError, AttributeError, IndexError, NameError, AssertionError)
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error: Exception) -> ErrorClass:
+    if isinstance(error, (BudgetExhaustedError, RunCancelledError)):
+        return ErrorClass.FATAL
+    if isinstance(error, CONTENT_ERROR_TYPES):
+        return ErrorClass.CONTENT
+    if isinstance(error, PROGRAMMING_ERROR_TYPES):
+        return ErrorClass.FATAL
+
+    names = {cls.__name__ for cls in type(error).__mro__}
+    status = _status_code(error)
+    if names & RATE_LIMIT_ERROR_NAMES or status == 429:
+        return ErrorClass.RATE_LIMIT
+    if names & TRANSIENT_ERROR_NAMES or isinstance(error, (ConnectionError, TimeoutError)):
+        return ErrorClass.TRANSIENT
+    if status is not None:
+        return ErrorClass.TRANSIENT if status in (408, 409) or status >= 500 else ErrorClass.FATAL
+    if isinstance(error, ValueError):
+        return ErrorClass.CONTENT
+    return ErrorClass.TRANSIENT
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read `retry-after-ms` / `retry-after` (seconds or HTTP date) from the error's response, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+@dataclass
+class RetryPolicy:
+    """
+    max_attempts: total attempts, including the first one.
+    base_delay / max_delay: bounds of the decorrelated-jitter backoff (seconds).
+    deadline: overall budget for the call including backoff; no retry is started past it.
+    max_content_retries: immediate re-asks allowed for unusable (content) answers.
+    """
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    deadline: Optional[float] = 60.0
+    max_content_retries: int = 1
+
+    def next_delay(self, previous_delay: float) -> float:
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous_delay * 3)))
+
+
+class RetryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.retries = defaultdict(lambda: defaultdict(int))
+        self.failures = defaultdict(int)
+        self.backoff_seconds = defaultdict(float)
+
+    def record_call(self, call_site: str):
+        with self._lock:
+            self.calls[call_site] += 1
+
+    def record_retry(self, call_site: str, error_class: ErrorClass, delay: float):
+        with self._lock:
+            self.retries[call_site][error_class.value] += 1
+            self.backoff_seconds[call_site] += delay
+
+    def record_failure(self, call_site: str):
+        with self._lock:
+            self.failures[call_site] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                call_site: {
+                    "calls": self.calls[call_site],
+                    "retries": dict(self.retries[call_site]),
+                    "failures": self.failures[call_site],
+                    "backoff_seconds": round(self.backoff_seconds[call_site], 3),
+                }
+                for call_site in self.calls
+            }
+
+
+retry_stats = RetryStats()
+
+
+def _plan_retry(error: Exception, attempt: int, policy: RetryPolicy, started_at: float, delay: float,
+                content_failures: int):
+    """Return (error_class, wait) for a retry, or (error_class, None) when the error should be raised."""
+    error_class = classify_error(error)
+    if error_class == ErrorClass.FATAL or attempt >= policy.max_attempts - 1:
+        return error_class, None
+
+    if error_class == ErrorClass.CONTENT:
+        if content_failures >= policy.max_content_retries:
+            return error_class, None
+        wait = 0.0
+    else:
+        wait = policy.next_delay(delay)
+        if error_class == ErrorClass.RATE_LIMIT:
+            wait = max(wait, retry_after_seconds(error) or 0.0)
+
+    if policy.deadline is not None and time.monotonic() - started_at + wait > policy.deadline:
+        return error_class, None
+    return error_class, wait
+
+
+def call_with_retry(fn: Callable[[int], Any],
+                    policy: RetryPolicy = None,
+                    call_site: str = "default",
+                    on_rate_limit: Callable[[float], None] = None) -> Any:
+    """
+    Call `fn(attempt)` until it succeeds, retrying transient and rate-limit errors with backoff and
+    content errors immediately (up to `policy.max_content_retries`). The last error is re-raised.
+    """
+    policy = policy or RetryPolicy()
+    started_at = time.monotonic()
+    delay = policy.base_delay
+    content_failures = 0
+    retry_stats.record_call(call_site)
+
+    for attempt in range(policy.max_attempts):
+        try:
+            return fn(attempt)
+        except Exception as e:
+            error_class, wait = _plan_retry(e, attempt, policy, started_at, delay, content_failures)
+            if wait is None:
+                retry_stats.record_failure(call_site)
+                raise
+            if error_class == ErrorClass.CONTENT:
+                content_failures += 1
+            else:
+                delay = wait
+            if error_class == ErrorClass.RATE_LIMIT and on_rate_limit:
+                on_rate_limit(wait)
+            retry_stats.record_retry(call_site, error_class, wait)
+            time.sleep(wait)
+
+
+async def acall_with_retry(fn: Callable[[int], Awaitable[Any]],
+                           policy: RetryPolicy = None,
+                           call_site: str = "default",
+                           on_rate_limit: Callable[[float], None] = None) -> Any:
+    policy = policy or RetryPolicy()
+    started_at = time.monotonic()
+    delay = policy.base_delay
+    content_failures = 0
+    retry_stats.record_call(call_site)
+
+    for attempt in range(policy.max_attempts):
+        try:
+            return await fn(attempt)
+        except Exception as e:
+            error_class, wait = _plan_retry(e, attempt, policy, started_at, delay, content_failures)
+            if wait is None:
+                retry_stats.record_failure(call_site)
+                raise
+            if error_class == ErrorClass.CONTENT:
+                content_failures += 1
+            else:
+                delay = wait
+            if error_class == ErrorClass.RATE_LIMIT and on_rate_limit:
+                on_rate_limit(wait)
+            retry_stats.record_retry(call_site, error_class, wait)
+            await asyncio.sleep(wait)
+
+
+def with_attempts(policy: RetryPolicy, max_attempts: int) -> RetryPolicy:
+    return replace(policy, max_attempts=max_attempts)
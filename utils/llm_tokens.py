@@ -0,0 +1,43 @@
+import json
+from typing import List, Dict, Any
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to a character based estimate
+    tiktoken = None
+
+_encodings = {}
+
+
+def _encoding_for(model: str):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    if not text:
+        return 0
+    encoding = _encoding_for(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+def estimate_message_tokens(messages: List[Dict[str, Any]], model: str = "gpt-4o",
+                            functions: List[Dict[str, Any]] = None) -> int:
+    """Rough prompt size of a chat request: message contents plus a small per-message overhead."""
+    total = 0
+    for message in messages or []:
+        content = message.get("content")
+        if not isinstance(content, str):
+            content = json.dumps(content, default=str)
+        total += count_tokens(content, model) + 4
+    if functions:
+        total += count_tokens(json.dumps(functions, default=str), model)
+    return total
@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from utils.llm_api import track_usage, is_llm_error
+from utils.llm_retry import BudgetExhaustedError, RunCancelledError
+
+
+@dataclass
+class StepConfig:
+    """
+    model: model tried first for the step.
+    max_tokens / timeout: per request limits; None keeps the helper / provider default.
+    fallbacks: models tried in order once the previous model has failed (after its own retries).
+    """
+    model: str
+    max_tokens: Optional[int] = None
+    timeout: Optional[float] = None
+    fallbacks: List[str] = field(default_factory=list)
+
+    def chain(self) -> List["StepConfig"]:
+        return [self] + [replace(self, model=model, fallbacks=[]) for model in self.fallbacks]
+
+
+# The models every step was hard-wired to before policies existed.
+DEFAULT_STEPS = {
+    "plan": StepConfig("gpt-4o"),
+    "context": StepConfig("gpt-4o"),
+    "feedback": StepConfig("gpt-4o"),
+    "payload": StepConfig("gpt-4o"),
+    "generation": StepConfig("gpt-4o"),
+    "routing": StepConfig("gpt-4.1"),
+    "selection": StepConfig("gpt-4o", max_tokens=8096),
+}
+
+
+class StepStats:
+    def __init__(self, window: int):
+        self.calls = 0
+        self.failures = 0
+        self.fallbacks = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.models = defaultdict(int)
+        self.latencies = deque(maxlen=window)
+
+
+class ModelPolicy:
+    """
+    Per-step model tiering for the agent loop ("plan", "context", "feedback", "payload", "routing",
+    "selection", "generation", "compaction"). Steps without an entry use `default`.
+
+    `call(step, fn)` runs `fn(config)` for the step's model and then each fallback until one returns
+    a non-error result, recording latency and tokens per step and per model.
+    """
+
+    def __init__(self, steps: Dict[str, StepConfig] = None, default: StepConfig = None, stats_window: int = 1000):
+        self.steps = dict(DEFAULT_STEPS)
+        self.steps.update(steps or {})
+        self.default = default or StepConfig("gpt-4o")
+        self.stats_window = stats_window
+        self._stats: Dict[str, StepStats] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def tiered(cls, small_model: str = "gpt-4o-mini", large_model: str = "gpt-4o",
+               small_steps: List[str] = ("feedback", "payload"), **kwargs) -> "ModelPolicy":
+        """Run `small_steps` on `small_model`, falling back to `large_model`; other steps keep their defaults."""
+        steps = {step: StepConfig(small_model, fallbacks=[large_model]) for step in small_steps}
+        steps.update(kwargs.pop("steps", None) or {})
+        return cls(steps=steps, **kwargs)
+
+    def step(self, name: str) -> StepConfig:
+        return self.steps.get(name, self.default)
+
+    def _stats_for(self, step: str) -> StepStats:
+        if step not in self._stats:
+            self._stats[step] = StepStats(self.stats_window)
+        return self._stats[step]
+
+    def _record(self, step: str, config: StepConfig, latency: float, usage: List[Dict[str, Any]], failed: bool,
+                fallback: bool):
+        with self._lock:
+            stats = self._stats_for(step)
+            stats.calls += 1
+            stats.failures += int(failed)
+            stats.fallbacks += int(fallback)
+            stats.models[config.model] += 1
+            stats.latencies.append(latency)
+            for record in usage:
+                if record["cached"]:
+                    stats.cache_hits += 1
+                    continue
+                stats.prompt_tokens += record["prompt_tokens"]
+                stats.completion_tokens += record["completion_tokens"]
+
+    def call(self, step: str, fn: Callable[[StepConfig], Any]) -> Any:
+        result = None
+        chain = self.step(step).chain()
+        for i, config in enumerate(chain):
+            started_at = time.monotonic()
+            failed = True
+            with track_usage() as usage:
+                try:
+                    result = fn(config)
+                    failed = is_llm_error(result)
+                except (BudgetExhaustedError, RunCancelledError):
+                    raise
+                except Exception:
+                    if i == len(chain) - 1:
+                        raise
+                finally:
+                    self._record(step, config, time.monotonic() - started_at, usage, failed, i > 0)
+            if not failed:
+                break
+        return result
+
+    async def acall(self, step: str, fn: Callable[[StepConfig], Awaitable[Any]]) -> Any:
+        result = None
+        chain = self.step(step).chain()
+        for i, config in enumerate(chain):
+            started_at = time.monotonic()
+            failed = True
+            with track_usage() as usage:
+                try:
+                    result = await fn(config)
+                    failed = is_llm_error(result)
+                except (BudgetExhaustedError, RunCancelledError):
+                    raise
+                except Exception:
+                    if i == len(chain) - 1:
+                        raise
+                finally:
+                    self._record(step, config, time.monotonic() - started_at, usage, failed, i > 0)
+            if not failed:
+                break
+        return result
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            report = {}
+            for step, stats in self._stats.items():
+                ordered = sorted(stats.latencies)
+                report[step] = {
+                    "calls": stats.calls,
+                    "failures": stats.failures,
+                    "fallbacks": stats.fallbacks,
+                    "cache_hits": stats.cache_hits,
+                    "models": dict(stats.models),
+                    "prompt_tokens": stats.prompt_tokens,
+                    "completion_tokens": stats.completion_tokens,
+                    "latency": {
+                        "mean": sum(ordered) / len(ordered),
+                        "p50": ordered[len(ordered) // 2],
+                        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    } if ordered else None,
+                }
+            return report
+
+
+default_model_policy = ModelPolicy()
+_active_model_policy: ContextVar[Optional[ModelPolicy]] = ContextVar("active_model_policy", default=None)
+
+
+def get_model_policy(policy: ModelPolicy = None) -> ModelPolicy:
+    """`policy` if given, else the policy of the agent run in progress, else `default_model_policy`."""
+    return policy or _active_model_policy.get() or default_model_policy
+
+
+@contextmanager
+def use_model_policy(policy: Optional[ModelPolicy]):
+    """Make `policy` the active policy for the block (a None policy keeps whatever is active)."""
+    if policy is None:
+        yield get_model_policy()
+        return
+    token = _active_model_policy.set(policy)
+    try:
+        yield policy
+    finally:
+        _active_model_policy.reset(token)
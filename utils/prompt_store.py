@@ -23,6 +23,7 @@ class PromptStore:
                           {{ "type": "environment", "content": "StockPriceTool returned $175.20" }},
                             ...
                         ]  
+                   A `"summary"` item, when present, condenses the older history that is no longer listed item by item.
                 
                 ---
                 
@@ -36,6 +37,8 @@ class PromptStore:
                 3. **For each step**, include:
                    - A brief `"action"` (tool or agent invocation, with any key parameters),  
                    - A one‑sentence `"description"` explaining why or how.  
+                   - When a step calls a tool and every argument is already known from the task or memory, write its `"action"` as a call with literal keyword arguments, e.g. `StockPriceTool(symbol='AAPL')`. If an argument depends on the result of an earlier step, describe the action in words instead.  
+                   - Give every step a short `"id"` and a `"depends_on"` list with the ids of the steps it needs; steps that do not depend on each other can run in parallel. To pass the result of an earlier step as an argument, use the string `"$<id>"`, e.g. `ChartTool(data='$1')`, and list that step in `"depends_on"`.  
                 4. **Be concise**—no more than 5–7 steps unless absolutely necessary. Unless asked for detail/report etc., keep the plan limited to 2-3 steps.
                 5. In general, focus on the latest memory items.
                 6. Return **exactly** one JSON object with two top‑level fields:
@@ -67,7 +70,7 @@ class PromptStore:
                         Example: "Fetch the latest AAPL stock price and prepare it for charting."
                 
                 2.  A JSON array of the most recent, relevant interaction steps. Each element must be an object with:
-                        type: one of "user", "agent", or "environment".
+                        type: one of "user", "agent", "environment", or "summary" (a condensed account of the older steps, with their payload_ids).
                         content: the raw text of that step (e.g. user query, tool call description with its args, or the observation returned).
                         Example :
                             [
@@ -306,6 +309,21 @@ class PromptStore:
                 Agents : {agents}
             """,
             
+            "memory_compaction_instruction": """
+                You are a memory compactor. You condense the older part of an agent's memory so that it can replace those items in the agent's later prompts.
+                I will provide you with:
+                 1. The `PREVIOUS SUMMARY` of everything that happened before these items (may be empty).
+                 2. The `MEMORY` items to fold in (user tasks/queries, tool or agent invocations, observations from the environment).
+                 
+                Write one updated summary covering both, in plain text and at most {max_words} words: what the user asked and how each request was answered, the facts and results obtained, and anything still open.
+                Keep every `payload_id` that appears, verbatim, next to a few words on what that payload contains.
+                Return only the summary.
+                 
+                PREVIOUS SUMMARY : {previous_summary}
+                
+                MEMORY : {memory}
+            """,
+
             "agent_payload_memory_builder_instruction" : """
                 You are a memory organizer. You store large amounts of data(payload) in a memory store and generate a description so that an agent using the memory can identify which payload is most useful at a particular step.
                 Your task is to generate a concise (max. 1-3 sentences long) description of what the payload is for.
@@ -0,0 +1,126 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict, field
+from typing import Any, Dict, List, Optional
+
+from utils.llm_retry import BudgetExhaustedError
+
+
+@dataclass
+class RunBudget:
+    """
+    deadline: wall-clock seconds for the whole run.
+    max_tokens: prompt + completion tokens over every completion of the run (cache hits are free).
+    max_cost: estimated USD cost of the run (see `utils.token_ledger.MODEL_PRICES`).
+    answer_reserve: fraction of each limit kept back for the final answer; once it is reached the
+        agent stops exploring and answers from what it has gathered.
+    """
+    deadline: Optional[float] = None
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    answer_reserve: float = 0.15
+
+
+@dataclass
+class RunReport:
+    run_id: str
+    stop_reason: str
+    iterations: int
+    elapsed_seconds: float
+    total_tokens: int
+    cost: float
+    budget: Optional[Dict[str, Any]] = None
+    cancelled: List[Dict[str, Any]] = field(default_factory=list)
+
+
+class BudgetTracker:
+    """
+    Usage of one run against its `RunBudget`, shared by every thread / task working for the run. A
+    sub-agent run gets a tracker whose `parent` is the invoking run's: its usage counts against both,
+    and it stops when either is exhausted.
+    """
+
+    def __init__(self, budget: RunBudget = None, parent: "BudgetTracker" = None):
+        self.budget = budget or RunBudget()
+        self.parent = parent
+        self.started_at = time.monotonic()
+        self.total_tokens = 0
+        self.cost = 0.0
+        self.iterations = 0
+        self.stop_reason: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def record(self, tokens: int, cost: float):
+        with self._lock:
+            self.total_tokens += tokens
+            self.cost += cost
+        if self.parent is not None:
+            self.parent.record(tokens, cost)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining_seconds(self) -> Optional[float]:
+        remaining = None if self.budget.deadline is None else max(0.0, self.budget.deadline - self.elapsed())
+        parent_remaining = self.parent.remaining_seconds() if self.parent is not None else None
+        if remaining is None or parent_remaining is None:
+            return remaining if parent_remaining is None else parent_remaining
+        return min(remaining, parent_remaining)
+
+    def _over(self, share: float) -> Optional[str]:
+        """The first limit whose usage has reached `share` of it ("deadline", "tokens" or "cost")."""
+        if self.parent is not None:
+            reason = self.parent._over(share)
+            if reason is not None:
+                return reason
+        budget = self.budget
+        if budget.deadline is not None and self.elapsed() >= share * budget.deadline:
+            return "deadline"
+        if budget.max_tokens is not None and self.total_tokens >= share * budget.max_tokens:
+            return "tokens"
+        if budget.max_cost is not None and self.cost >= share * budget.max_cost:
+            return "cost"
+        return None
+
+    def exhausted(self) -> Optional[str]:
+        return self._over(1.0)
+
+    def nearly_exhausted(self) -> Optional[str]:
+        return self._over(1.0 - self.budget.answer_reserve)
+
+    def check(self):
+        """Raise `BudgetExhaustedError` once a limit has been used up."""
+        reason = self.exhausted()
+        if reason is not None:
+            raise BudgetExhaustedError(f"Run budget exhausted: {reason}")
+
+    def report(self, run_id: str) -> RunReport:
+        return RunReport(
+            run_id=run_id,
+            stop_reason=self.stop_reason or "completed",
+            iterations=self.iterations,
+            elapsed_seconds=round(self.elapsed(), 3),
+            total_tokens=self.total_tokens,
+            cost=round(self.cost, 6),
+            budget=asdict(self.budget),
+        )
+
+
+_active_budget: ContextVar[Optional[BudgetTracker]] = ContextVar("active_run_budget", default=None)
+
+
+def current_run_budget() -> Optional[BudgetTracker]:
+    return _active_budget.get()
+
+
+@contextmanager
+def use_run_budget(budget: Optional[RunBudget]):
+    """Track the block against `budget` (no limits when None), nested under the enclosing run's tracker."""
+    tracker = BudgetTracker(budget, parent=_active_budget.get())
+    token = _active_budget.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _active_budget.reset(token)
@@ -0,0 +1,147 @@
+import threading
+import time
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+# USD per 1M (prompt, completion) tokens. Models missing here are recorded with a cost of 0.
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+
+@dataclass
+class LedgerEntry:
+    timestamp: float
+    call_site: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+    latency: float
+    cached: bool
+    estimated: bool
+    session_id: Optional[str] = None
+    run_id: Optional[str] = None
+    agent: Optional[str] = None
+    iteration: Optional[int] = None
+
+
+# Attribution of the completions made in the current run; see ledger_scope().
+_ledger_scope: ContextVar[Optional[Dict[str, Any]]] = ContextVar("ledger_scope", default=None)
+
+
+@contextmanager
+def ledger_scope(**fields):
+    """
+    Attribute every completion made in the block to `fields` (session_id, run_id, agent, iteration),
+    layered over the enclosing scope; None values inherit the enclosing value.
+    """
+    scope = dict(_ledger_scope.get() or {})
+    scope.update({k: v for k, v in fields.items() if v is not None})
+    token = _ledger_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _ledger_scope.reset(token)
+
+
+def current_ledger_scope() -> Dict[str, Any]:
+    return _ledger_scope.get() or {}
+
+
+def set_ledger_iteration(iteration: Optional[int]):
+    """Advance the iteration of the innermost scope (the scope dict is private to its ledger_scope block)."""
+    scope = _ledger_scope.get()
+    if scope is not None:
+        scope["iteration"] = iteration
+
+
+class TokenLedger:
+    """
+    Bounded record of every completion: tokens, cost and latency, attributed to the call site and to
+    the session / run / iteration scope it was made in. Cache hits are recorded with zero cost.
+    """
+
+    def __init__(self, max_entries: int = 100000, prices: Dict[str, Tuple[float, float]] = None):
+        self.prices = dict(MODEL_PRICES)
+        self.prices.update(prices or {})
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def record(self, call_site: str, model: str, prompt_tokens: int, completion_tokens: int,
+               latency: float = 0.0, cached: bool = False, estimated: bool = False) -> LedgerEntry:
+        scope = current_ledger_scope()
+        entry = LedgerEntry(
+            timestamp=time.time(),
+            call_site=call_site or "default",
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost=0.0 if cached else self.cost(model, prompt_tokens, completion_tokens),
+            latency=latency,
+            cached=cached,
+            estimated=estimated,
+            session_id=scope.get("session_id"),
+            run_id=scope.get("run_id"),
+            agent=scope.get("agent"),
+            iteration=scope.get("iteration"),
+        )
+        with self._lock:
+            self._entries.append(entry)
+        return entry
+
+    def entries(self, **filters) -> List[LedgerEntry]:
+        """Entries matching every filter, e.g. entries(session_id="s1", call_site="routing")."""
+        with self._lock:
+            entries = list(self._entries)
+        return [e for e in entries if all(getattr(e, k) == v for k, v in filters.items())]
+
+    def totals(self, by: Union[str, Tuple[str, ...]] = "call_site", **filters) -> Dict[Any, Dict[str, Any]]:
+        """Aggregate the matching entries grouped by one field or a tuple of fields."""
+        fields = (by,) if isinstance(by, str) else tuple(by)
+        groups = defaultdict(lambda: {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                      "total_tokens": 0, "cost": 0.0, "latency": 0.0})
+        for entry in self.entries(**filters):
+            key = getattr(entry, fields[0]) if len(fields) == 1 else tuple(getattr(entry, f) for f in fields)
+            group = groups[key]
+            group["calls"] += 1
+            group["cached_calls"] += int(entry.cached)
+            group["prompt_tokens"] += entry.prompt_tokens
+            group["completion_tokens"] += entry.completion_tokens
+            group["total_tokens"] += entry.prompt_tokens + entry.completion_tokens
+            group["cost"] += entry.cost
+            group["latency"] += entry.latency
+        return dict(groups)
+
+    def top(self, n: int = 5, by: Union[str, Tuple[str, ...]] = "call_site", metric: str = "total_tokens",
+            **filters) -> List[Tuple[Any, Dict[str, Any]]]:
+        """The `n` groups with the largest `metric` ("total_tokens", "prompt_tokens", "cost", "latency", ...)."""
+        return sorted(self.totals(by, **filters).items(), key=lambda item: item[1][metric], reverse=True)[:n]
+
+    def summary(self, **filters) -> Dict[str, Any]:
+        by_call_site = self.totals(by="call_site", **filters)
+        overall = {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+                   "cost": 0.0, "latency": 0.0}
+        for group in by_call_site.values():
+            for key in overall:
+                overall[key] += group[key]
+        overall["by_call_site"] = by_call_site
+        return overall
+
+    def export(self, **filters) -> List[Dict[str, Any]]:
+        return [asdict(e) for e in self.entries(**filters)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import re
@@ -20,6 +21,8 @@ async def send_websocket_update(websocket: WebSocket, message: str, message_type
             await websocket.send_text(f"Update : {message}")
         elif message_type == "priority":
             await websocket.send_text(f"Priority : {message}")
+        elif message_type == "stream":
+            await websocket.send_text(message)
     else:
         if message_type == "progress":
             print(f"Progress : {message}")
@@ -27,6 +30,25 @@ async def send_websocket_update(websocket: WebSocket, message: str, message_type
             print(f"Update : {message}")
         elif message_type == "priority":
             print(f"Priority : {message}")
+        elif message_type == "stream":
+            print(message, end="", flush=True)
+
+
+def websocket_token_callback(websocket: WebSocket, loop: asyncio.AbstractEventLoop = None,
+                             message_type="stream"):
+    """
+    Build an `on_token` callback for `Agent.run` / `Agent.arun` that forwards every streamed delta
+    through `send_websocket_update`. For `arun` (same event loop) leave `loop` unset and a coroutine
+    function is returned; for `run` executing in a worker thread pass the websocket's event loop.
+    """
+    if loop is None:
+        async def on_token(delta: str):
+            await send_websocket_update(websocket, delta, message_type=message_type)
+        return on_token
+
+    def on_token_threadsafe(delta: str):
+        asyncio.run_coroutine_threadsafe(send_websocket_update(websocket, delta, message_type=message_type), loop)
+    return on_token_threadsafe
 
 
 def initialize_logging(logger):